@@ -0,0 +1,15 @@
+"""HTTP side of debateapp.timing: Server-Timing headers, slow request logs and query budgets"""
+from debateapp import timing
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with timing.collect() as timings:
+            response = self.get_response(request)
+        response['Server-Timing'] = timings.server_timing()
+        match = getattr(request, 'resolver_match', None)
+        timing.report(f'{request.method} {request.path}', match.url_name if match else None, timings)
+        return response
@@ -0,0 +1,131 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+INVALID_CURSOR_MESSAGE = 'Invalid cursor'
+SEARCH_ORDERING = ['rank', 'id']
+
+
+def is_paginated(request):
+    """Pagination is opt-in: without ?page_size= or ?cursor= lists return every row, as they always have"""
+    return 'page_size' in request.GET or 'cursor' in request.GET
+
+
+def get_page_size(request):
+    """Read ?page_size=, clamped to the configured maximum"""
+    default_size = getattr(settings, 'API_PAGE_SIZE', 50)
+    max_size = getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+    try:
+        page_size = int(request.GET.get('page_size', default_size))
+    except (TypeError, ValueError):
+        page_size = default_size
+    return max(1, min(page_size, max_size))
+
+
+def encode_cursor(ordering, values):
+    """Pack the ordering key of the last row into an opaque token"""
+    payload = {
+        'k': ','.join(ordering),
+        'v': [value.isoformat() if isinstance(value, datetime) else value for value in values],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        signature = payload['k']
+        values = [(parse_datetime(value) or value) if isinstance(value, str) else value for value in payload['v']]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValidationError({'cursor': [INVALID_CURSOR_MESSAGE]})
+    if signature != ','.join(ordering) or len(values) != len(ordering):
+        # Cursors are only valid for the ordering that produced them
+        raise ValidationError({'cursor': [INVALID_CURSOR_MESSAGE]})
+    return values
+
+
+def keyset_filter(ordering, values):
+    """Build the predicate selecting rows strictly after `values` in `ordering`
+
+    (a, b, id) > (x, y, z) expands to a > x OR (a = x AND b > y) OR ...; the
+    extra bound on the leading column lets the database range-scan its index.
+    """
+    leading = ordering[0].lstrip('-')
+    bound = Q(**{f"{leading}__{'lte' if ordering[0].startswith('-') else 'gte'}": values[0]})
+
+    after = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        clause = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            clause &= Q(**{prev_field.lstrip('-'): prev_value})
+        after |= clause
+    return bound & after
+
+
+def paginate_queryset(queryset, request, ordering):
+    """Return one page of `queryset` ordered by `ordering` and the cursor for the next one
+
+    `ordering` must end with a unique field (normally `id`) so that every row has
+    a distinct position; each page is a bounded index seek regardless of depth.
+    """
+    queryset = queryset.order_by(*ordering)
+    if not is_paginated(request):
+        return list(queryset), None
+    page_size = get_page_size(request)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, ordering)))
+
+    rows = list(queryset[:page_size + 1])
+    page, extra = rows[:page_size], rows[page_size:]
+
+    next_cursor = None
+    if extra:
+        last = page[-1]
+        next_cursor = encode_cursor(ordering, [getattr(last, field.lstrip('-')) for field in ordering])
+    return page, next_cursor
+
+
+def paginate_search(request, queryset, search):
+    """Return one page of ranked search hits as rows of `queryset`, and the next cursor
+
+    `search(limit, after)` returns up to `limit` (rank, id) hits, best first,
+    following the hit `after`; a `limit` of None means all of them.
+    """
+    if not is_paginated(request):
+        hits = search(None, None)
+        rows = queryset.in_bulk([row_id for _, row_id in hits])
+        return [rows[row_id] for _, row_id in hits if row_id in rows], None
+
+    page_size = get_page_size(request)
+    cursor = request.GET.get('cursor')
+    after = decode_cursor(cursor, SEARCH_ORDERING) if cursor else None
+
+    hits = search(page_size + 1, after)
+    hits, extra = hits[:page_size], hits[page_size:]
+    rows = queryset.in_bulk([row_id for _, row_id in hits])
+    page = [rows[row_id] for _, row_id in hits if row_id in rows]
+
+    next_cursor = encode_cursor(SEARCH_ORDERING, list(hits[-1])) if extra else None
+    return page, next_cursor
+
+
+def paginated_response(data, request, next_cursor):
+    """Keep the list body and advertise the next page in headers"""
+    response = Response(data)
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>; rel="next"'
+    return response
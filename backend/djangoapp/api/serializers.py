@@ -1,31 +1,129 @@
 from rest_framework import serializers
-from debateapp.models import Topic, User, Post, Comment, Reaction, Bookmark, PostView
-from django.db.models import Q
+from debateapp import topic_activity
+from debateapp.timing import TimedSerializerMixin
+from debateapp.models import Topic, User, Post, Comment, Reaction, Bookmark, PostView, AIJob
+from django.db.models.manager import BaseManager
 
+# For demo purposes, every request acts on behalf of user ID 1
+DEMO_USER_ID = 1
 
-class TopicSerializer(serializers.ModelSerializer):
+
+VIEWER_REACTION_FIELDS = {'is_liked', 'is_disliked', 'user_reaction'}
+
+
+def post_list_context(request):
+    """Serializer context for post lists, from ?shape=compact and ?fields=
+
+    `compact` replaces the embedded author and topic with their ids; the views
+    side-load each distinct one once (see compact_response). `fields` is the set
+    of post fields to return (`id` always is), or None for all of them.
+    """
+    fields = request.GET.get('fields')
+    return {
+        'request': request,
+        'compact': request.GET.get('shape') == 'compact',
+        'fields': {name.strip() for name in fields.split(',')} | {'id'} if fields else None,
+    }
+
+
+def build_post_context(posts, request, fields=None):
+    """Load topic activity and viewer state for a page of posts in a fixed number of queries
+
+    `fields` are the post fields being returned (default all); lookups only
+    they need are skipped when they are not.
+    """
+    post_ids = [post.id for post in posts]
+    topic_ids = {post.topic_id for post in posts}
+    fields = fields if fields is not None else {'topic_detail', 'is_bookmarked', *VIEWER_REACTION_FIELDS}
+
+    topic_stats = {}
+    # Compact responses side-load the topics, which show the same activity score
+    if fields & {'topic_detail', 'topic'}:
+        topic_stats = build_topic_context(topic_ids)['topic_stats']
+
+    # Mirror the per-object checks in PostSerializer: reactions need a request user,
+    # bookmarks additionally need an authenticated one
+    viewer_reactions = {}
+    viewer_bookmarks = set()
+    if post_ids and request and hasattr(request, 'user'):
+        if fields & VIEWER_REACTION_FIELDS:
+            viewer_reactions = dict(
+                Reaction.objects.filter(post_id__in=post_ids, created_by_id=DEMO_USER_ID).values_list('post_id', 'type')
+            )
+        if request.user.is_authenticated and 'is_bookmarked' in fields:
+            viewer_bookmarks = set(
+                Bookmark.objects.filter(post_id__in=post_ids, user_id=DEMO_USER_ID).values_list('post_id', flat=True)
+            )
+
+    return {
+        'topic_stats': topic_stats,
+        'viewer_reactions': viewer_reactions,
+        'viewer_bookmarks': viewer_bookmarks,
+    }
+
+
+class PostPageListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """List serializer that batches PostSerializer lookups for the whole page"""
+
+    def get_posts(self, items):
+        return items
+
+    def get_post_serializer(self):
+        return self.child
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        fields = {name for name, field in self.get_post_serializer().fields.items() if not field.write_only}
+        self.context.update(build_post_context(self.get_posts(items), self.context.get('request'), fields))
+        return super().to_representation(items)
+
+
+def build_topic_context(topic_ids):
+    """Activity scores for a list of topics: cached, or one aggregate query for the rest"""
+    return {
+        'topic_stats': {
+            topic_id: {'activity_score': score} for topic_id, score in topic_activity.scores(topic_ids).items()
+        },
+    }
+
+
+class TopicListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """List serializer that loads TopicSerializer activity scores for the whole list at once"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        self.context.update(build_topic_context([topic.id for topic in items]))
+        return super().to_representation(items)
+
+
+class TopicSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     post_count = serializers.ReadOnlyField()
-    activity_score = serializers.ReadOnlyField()
+    activity_score = serializers.SerializerMethodField()
     is_active = serializers.ReadOnlyField()
 
     class Meta:
         model = Topic
         fields = ['id', 'name', 'description', 'created_at', 'is_active', 'post_count', 'activity_score']
+        list_serializer_class = TopicListSerializer
+
+    def get_activity_score(self, obj):
+        stats = self.context.get('topic_stats', {}).get(obj.id)
+        return stats['activity_score'] if stats else obj.activity_score
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
 
 
-class ReactionSerializer(serializers.ModelSerializer):
+class ReactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Reaction
         fields = ['id', 'type', 'created_by', 'created_at', 'post', 'comment']
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_by_detail = UserSerializer(read_only=True, source='created_by')
     topic_detail = TopicSerializer(read_only=True, source='topic')
     
@@ -52,45 +150,79 @@ class PostSerializer(serializers.ModelSerializer):
             'like_count', 'dislike_count', 'comment_count',
             'is_bookmarked', 'is_liked', 'is_disliked', 'user_reaction'
         ]
+        list_serializer_class = PostPageListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('compact'):
+            del fields['created_by_detail'], fields['topic_detail']
+            fields['created_by'] = serializers.PrimaryKeyRelatedField(read_only=True)
+            fields['topic'] = serializers.PrimaryKeyRelatedField(read_only=True)
+        selected = self.context.get('fields')
+        if selected is not None:
+            fields = {name: field for name, field in fields.items() if name in selected}
+        return fields
+
+    def to_representation(self, instance):
+        # A single post loads the same batched context as a page, so the viewer fields share one lookup
+        if 'viewer_reactions' not in self.context:
+            self.context.update(build_post_context([instance], self.context.get('request')))
+        return super().to_representation(instance)
 
     def get_is_bookmarked(self, obj):
         """Check if current user has bookmarked this post"""
+        bookmarks = self.context.get('viewer_bookmarks')
+        if bookmarks is not None:
+            return obj.id in bookmarks
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
-            # For demo purposes, we'll use user ID 1
-            return Bookmark.objects.filter(post=obj, user_id=1).exists()
+            return Bookmark.objects.filter(post=obj, user_id=DEMO_USER_ID).exists()
         return False
 
     def get_is_liked(self, obj):
         """Check if current user has liked this post"""
-        request = self.context.get('request')
-        if request and hasattr(request, 'user'):
-            # For demo purposes, we'll use user ID 1
-            return Reaction.objects.filter(post=obj, created_by_id=1, type='like').exists()
-        return False
+        return self.get_user_reaction(obj) == 'like'
 
     def get_is_disliked(self, obj):
         """Check if current user has disliked this post"""
-        request = self.context.get('request')
-        if request and hasattr(request, 'user'):
-            # For demo purposes, we'll use user ID 1
-            return Reaction.objects.filter(post=obj, created_by_id=1, type='dislike').exists()
-        return False
+        return self.get_user_reaction(obj) == 'dislike'
 
     def get_user_reaction(self, obj):
         """Get current user's reaction to this post"""
+        reactions = self.context.get('viewer_reactions')
+        if reactions is not None:
+            return reactions.get(obj.id)
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            # For demo purposes, we'll use user ID 1
             try:
-                reaction = Reaction.objects.get(post=obj, created_by_id=1)
+                reaction = Reaction.objects.get(post=obj, created_by_id=DEMO_USER_ID)
                 return reaction.type
             except Reaction.DoesNotExist:
                 return None
         return None
 
 
-class CommentSerializer(serializers.ModelSerializer):
+def build_comment_context(comments, request):
+    """Load the viewer's reactions for a list of comments in one query"""
+    viewer_reactions = {}
+    comment_ids = [comment.id for comment in comments]
+    if comment_ids and request and hasattr(request, 'user'):
+        viewer_reactions = dict(
+            Reaction.objects.filter(comment_id__in=comment_ids, created_by_id=DEMO_USER_ID).values_list('comment_id', 'type')
+        )
+    return {'viewer_reactions': viewer_reactions}
+
+
+class CommentListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """List serializer that batches CommentSerializer lookups for the whole list"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        self.context.update(build_comment_context(items, self.context.get('request')))
+        return super().to_representation(items)
+
+
+class CommentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_by_detail = UserSerializer(read_only=True, source='created_by')
     
     # Engagement metrics
@@ -108,29 +240,65 @@ class CommentSerializer(serializers.ModelSerializer):
             'id', 'content', 'created_by', 'created_by_detail', 'created_at', 
             'updated_at', 'post', 'parent', 'like_count', 'dislike_count', 'user_reaction'
         ]
+        list_serializer_class = CommentListSerializer
 
     def get_user_reaction(self, obj):
         """Get current user's reaction to this comment"""
+        reactions = self.context.get('viewer_reactions')
+        if reactions is not None:
+            return reactions.get(obj.id)
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            # For demo purposes, we'll use user ID 1
             try:
-                reaction = Reaction.objects.get(comment=obj, created_by_id=1)
+                reaction = Reaction.objects.get(comment=obj, created_by_id=DEMO_USER_ID)
                 return reaction.type
             except Reaction.DoesNotExist:
                 return None
         return None
 
 
-class BookmarkSerializer(serializers.ModelSerializer):
+class BookmarkPageListSerializer(PostPageListSerializer):
+    def get_posts(self, items):
+        return [bookmark.post for bookmark in items]
+
+    def get_post_serializer(self):
+        return self.child.fields['post_detail']
+
+
+class BookmarkSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     post_detail = PostSerializer(read_only=True, source='post')
     
     class Meta:
         model = Bookmark
         fields = ['id', 'post', 'post_detail', 'created_at']
+        list_serializer_class = BookmarkPageListSerializer
 
 
-class PostViewSerializer(serializers.ModelSerializer):
+class PostViewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = PostView
-        fields = ['id', 'post', 'user', 'ip_address', 'viewed_at']
\ No newline at end of file
+        fields = ['id', 'post', 'user', 'ip_address', 'viewed_at']
+
+class AIJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = AIJob
+        fields = [
+            'id', 'post', 'trigger_comment', 'source', 'status', 'attempts', 'max_attempts',
+            'last_error', 'result', 'coalesced', 'created_at', 'run_after', 'finished_at'
+        ]
+
+
+def compact_response(key, rows, posts, context):
+    """A compact list body: `rows` under `key`, plus each distinct author and topic of `posts` once
+
+    Authors or topics are left out when ?fields= drops created_by or topic.
+    """
+    fields = context.get('fields')
+    data = {key: rows}
+    if fields is None or 'created_by' in fields:
+        users = {post.created_by_id: post.created_by for post in posts}
+        data['users'] = {user_id: UserSerializer(user).data for user_id, user in users.items()}
+    if fields is None or 'topic' in fields:
+        topics = {post.topic_id: post.topic for post in posts}
+        data['topics'] = {topic_id: TopicSerializer(topic, context=context).data for topic_id, topic in topics.items()}
+    return data
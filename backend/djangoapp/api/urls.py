@@ -19,17 +19,23 @@ urlpatterns = [
     path('post/create/', views.createPost, name='create_post'),
     path('post/<int:pk>/', views.post, name='post_detail'),
     path('post/<int:pk>/comments/', views.getCommentsForPost, name='post_comments'),
+    path('post/<int:pk>/thread/', views.getCommentThread, name='post_thread'),
     path('post/<int:post_id>/trigger-ai/', views.triggerAIResponses, name='trigger_ai_responses'),
+    path('ai-job/<int:pk>/', views.getAIJob, name='ai_job_detail'),
     
     # Comment endpoints
     path('comment/create/', views.createComment, name='create_comment'),
     
     # Reaction endpoints
     path('reaction/toggle/', views.toggleReaction, name='toggle_reaction'),
+    path('reaction/bulk/', views.bulkToggleReactions, name='bulk_toggle_reactions'),
     
     # Bookmark endpoints
     path('bookmark/toggle/', views.toggleBookmark, name='toggle_bookmark'),
     
     # Statistics endpoint
     path('statistics/', views.getStatistics, name='get_statistics'),
+
+    # Prometheus scrape endpoint
+    path('metrics/', views.getMetrics, name='metrics'),
 ]
@@ -1,19 +1,22 @@
 from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view
-from debateapp.models import Topic, User, Post, Comment, Reaction, Bookmark, PostView
+from debateapp.models import Topic, User, Post, Comment, Bookmark, AIJob
 from .serializers import (
     TopicSerializer, UserSerializer, PostSerializer, CommentSerializer, 
-    ReactionSerializer, BookmarkSerializer
+    BookmarkSerializer, AIJobSerializer, compact_response, post_list_context
 )
+from .pagination import paginate_queryset, paginate_search, paginated_response
 from rest_framework import status
-from django.db.models import Q, Count, F
-from django.utils import timezone
-from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.http import HttpResponse
 import ipaddress
-import threading
 import time
-from debateapp.personas import choose_persona_ai, get_ai_responses, AI_PERSONAS
+from debateapp import activity, conversation, metrics, reactions, rollups, search, threads, trending, view_tracking
+from debateapp.jobs import JobQueueFull, enqueue_ai_round
 
 def get_client_ip(request):
     """Get client IP address from request"""
@@ -24,34 +27,45 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
+def post_list_response(page, request, next_cursor=None, serializer_class=PostSerializer, key='posts', posts=None):
+    """Serialize a list of posts (or of rows embedding them) in the shape the request asks for
+
+    See post_list_context for ?shape=compact and ?fields=.
+    """
+    context = post_list_context(request)
+    data = serializer_class(page, many=True, context=context).data
+    if context['compact']:
+        data = compact_response(key, data, page if posts is None else posts, context)
+    return paginated_response(data, request, next_cursor)
+
 @api_view(['GET'])
 def getTopics(request):
     """Get all topics with post counts and activity status"""
-    topics = Topic.objects.annotate(
-        annotated_post_count=Count('topics', distinct=True)
-    ).order_by('-annotated_post_count', 'name')
+    topics = Topic.objects.order_by('-post_count', 'name')
     serializer = TopicSerializer(topics, many=True)
     return Response(serializer.data)
 
 @api_view(['GET'])
 def searchTopics(request):
-    """Search topics by name"""
+    """Search topics by name and description, best matches first"""
     query = request.GET.get('q', '')
+    page, next_cursor = [], None
     if query:
-        topics = Topic.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        ).annotate(annotated_post_count=Count('topics', distinct=True)).order_by('-annotated_post_count')
-    else:
-        topics = Topic.objects.none()
-    
-    serializer = TopicSerializer(topics, many=True)
-    return Response(serializer.data)
+        backend = search.get_backend()
+        page, next_cursor = paginate_search(
+            request, Topic.objects.all(), lambda limit, after: backend.search_topics(query, limit, after)
+        )
+
+    serializer = TopicSerializer(page, many=True)
+    return paginated_response(serializer.data, request, next_cursor)
 
 @api_view(['POST'])
 def createTopic(request):
     serializer = TopicSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            topic = serializer.save()
+            activity.topic_created(topic)
         return Response(serializer.data)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -59,68 +73,48 @@ def createTopic(request):
 @api_view(['GET'])
 def getPosts(request):
     """Get posts with filtering and sorting"""
-    posts = Post.objects.select_related('created_by', 'topic').prefetch_related('reactions')
+    posts = Post.objects.select_related('created_by', 'topic')
     
     # Topic filtering
     topic_id = request.GET.get('topic')
     if topic_id:
         posts = posts.filter(topic_id=topic_id)
     
-    # Search filtering
-    search = request.GET.get('search', '')
-    if search:
-        posts = posts.filter(
-            Q(content__icontains=search) | 
-            Q(topic__name__icontains=search) |
-            Q(created_by__name__icontains=search)
+    # Search results are ranked by relevance, so they ignore `sort`
+    query = request.GET.get('search', '')
+    if query:
+        backend = search.get_backend()
+        page, next_cursor = paginate_search(
+            request, posts, lambda limit, after: backend.search_posts(query, limit, after, topic_id)
         )
-    
-    # Sorting
+        return post_list_response(page, request, next_cursor)
+
+    # Sorting on stored counters; every ordering ends in id so the cursor position is unique
     sort_by = request.GET.get('sort', 'latest')
-    if sort_by == 'latest':
-        posts = posts.order_by('-updated_at')
-    elif sort_by == 'popular':
+    if sort_by == 'popular':
         # Sort by engagement score (likes + comments + views)
-        posts = posts.annotate(
-            annotated_like_count=Count('reactions', filter=Q(reactions__type='like'), distinct=True),
-            annotated_comment_count=Count('comments', distinct=True),
-        ).order_by('-annotated_like_count', '-annotated_comment_count', '-view_count', '-updated_at')
+        ordering = ['-like_count', '-comment_count', '-view_count', '-updated_at', '-id']
     elif sort_by == 'controversial':
         # Sort by controversy score (posts with mixed reactions)
-        posts = posts.annotate(
-            annotated_like_count=Count('reactions', filter=Q(reactions__type='like'), distinct=True),
-            annotated_dislike_count=Count('reactions', filter=Q(reactions__type='dislike'), distinct=True),
-            annotated_total_reactions=Count('reactions', distinct=True)
-        ).order_by('-annotated_total_reactions', '-updated_at')
-    
-    serializer = PostSerializer(posts, many=True, context={'request': request})
-    return Response(serializer.data)
+        posts = posts.annotate(total_reactions=F('like_count') + F('dislike_count'))
+        ordering = ['-total_reactions', '-updated_at', '-id']
+    else:
+        ordering = ['-updated_at', '-id']
+
+    page, next_cursor = paginate_queryset(posts, request, ordering)
+    return post_list_response(page, request, next_cursor)
 
 @api_view(['GET'])
 def getTrendingPosts(request):
-    """Get trending posts based on recent activity"""
-    week_ago = timezone.now() - timedelta(days=7)
-    
-    trending_posts = Post.objects.select_related('created_by', 'topic').annotate(
-        recent_likes=Count('reactions', filter=Q(reactions__type='like', reactions__created_at__gte=week_ago)),
-        recent_comments=Count('comments', filter=Q(comments__created_at__gte=week_ago)),
-        recent_views=Count('views', filter=Q(views__viewed_at__gte=week_ago))
-    ).filter(
-        Q(updated_at__gte=week_ago) |
-        Q(recent_likes__gt=0) |
-        Q(recent_comments__gt=0) |
-        Q(recent_views__gt=5)
-    ).order_by('-recent_likes', '-recent_comments', '-recent_views', '-updated_at')[:20]
-    
-    serializer = PostSerializer(trending_posts, many=True, context={'request': request})
-    return Response(serializer.data)
+    """Get trending posts: the top decayed engagement scores, read from the trending index"""
+    return post_list_response(list(trending.top_posts(settings.TRENDING_LIMIT)), request)
 
 @api_view(['GET'])
 def getUsersPosts(request, userId):
     try:
         posts = Post.objects.filter(created_by=userId).select_related('created_by', 'topic')
-        serializer = PostSerializer(posts, many=True, context={'request': request})
-        return Response(serializer.data)
+        page, next_cursor = paginate_queryset(posts, request, ['-updated_at', '-id'])
+        return post_list_response(page, request, next_cursor)
     except Post.DoesNotExist:
         return Response([], status=status.HTTP_404_NOT_FOUND)
 
@@ -132,25 +126,25 @@ def post(request, pk):
         return Response(status=status.HTTP_404_NOT_FOUND)
     
     if request.method == 'GET':
-        # Track view
+        # Track the view in memory; view_tracking writes views in bulk, off the request
         client_ip = get_client_ip(request)
         if client_ip:
-            PostView.objects.get_or_create(
-                post=post_obj,
-                ip_address=client_ip,
-                defaults={'user_id': 1}  # For demo, use user ID 1
-            )
-            # Update view count
-            post_obj.view_count = F('view_count') + 1
-            post_obj.save(update_fields=['view_count'])
-            post_obj.refresh_from_db()
+            view_tracking.buffer.record(post_obj.pk, client_ip, user_id=1)  # For demo, use user ID 1
         
         serializer = PostSerializer(post_obj, context={'request': request})
-        return Response(serializer.data)
+        data = serializer.data
+        # A count over the post's viewers, so only on request
+        if 'unique_viewers' in request.GET.get('include', '').split(','):
+            data = {**data, 'unique_viewers': view_tracking.unique_viewers(post_obj.pk)}
+        return Response(data)
     elif request.method == 'PUT':
         serializer = PostSerializer(post_obj, data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            previous_topic_id = post_obj.topic_id
+            with transaction.atomic():
+                post_obj = serializer.save()
+                activity.post_updated(post_obj, previous_topic_id)
+            conversation.forget(post_obj)
             return Response(serializer.data)
         else:
             return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
@@ -158,76 +152,47 @@ def post(request, pk):
 @api_view(['GET'])
 def getCommentsForPost(request, pk):
     try:
-        comments = Comment.objects.filter(post=pk).select_related('created_by').order_by('created_at')
-        serializer = CommentSerializer(comments, many=True, context={'request': request})
-        return Response(serializer.data)
+        comments = Comment.objects.filter(post=pk).select_related('created_by')
+        page, next_cursor = paginate_queryset(comments, request, ['created_at', 'id'])
+        serializer = CommentSerializer(page, many=True, context={'request': request})
+        return paginated_response(serializer.data, request, next_cursor)
     except Comment.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
+def get_thread_depth(request):
+    """Read ?depth=, clamped to THREAD_MAX_DEPTH"""
+    try:
+        depth = int(request.GET.get('depth', settings.THREAD_DEFAULT_DEPTH))
+    except (TypeError, ValueError):
+        depth = settings.THREAD_DEFAULT_DEPTH
+    return max(0, min(depth, settings.THREAD_MAX_DEPTH))
+
+@api_view(['GET'])
+def getCommentThread(request, pk):
+    """A page of top-level comments (or of one comment's replies, ?parent=) with their nested replies"""
+    parent_id = request.GET.get('parent') or None
+    if parent_id is not None and not parent_id.isdigit():
+        return Response({'error': 'parent must be a comment ID'}, status=status.HTTP_400_BAD_REQUEST)
+    roots = Comment.objects.filter(post=pk, parent_id=parent_id).select_related('created_by')
+    page, next_cursor = paginate_queryset(roots, request, ['created_at', 'id'])
+    comments, stats = threads.load(page, get_thread_depth(request))
+    serializer = CommentSerializer(comments, many=True, context={'request': request})
+    return paginated_response(threads.nest(serializer.data, stats, [comment.id for comment in page]), request, next_cursor)
+
 @api_view(['POST'])
 def createPost(request):
     serializer = PostSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        post = serializer.save()
-        
-        # Trigger AI responses in a background thread to avoid blocking the response
-        def generate_ai_responses():
-            try:
-                # Build conversation history for this specific post
-                conversation_history = []
-                
-                # Start with the original post
-                conversation_history.append({
-                    "role": "user" if post.created_by.type == "human" else "assistant",
-                    "content": f"{post.created_by.name}: {post.content}"
-                })
-                
-                # Add all existing comments/replies to this post in chronological order
-                existing_comments = Comment.objects.filter(post=post).order_by('created_at')
-                for comment in existing_comments:
-                    conversation_history.append({
-                        "role": "user" if comment.created_by.type == "human" else "assistant", 
-                        "content": f"{comment.created_by.name}: {comment.content}"
-                    })
-                
-                # Add some recent context from other posts in the same topic (for broader context)
-                recent_posts = Post.objects.filter(topic=post.topic).exclude(id=post.id).order_by('-created_at')[:3]
-                topic_context = []
-                for p in recent_posts:
-                    topic_context.append({
-                        "role": "system",
-                        "content": f"Recent topic discussion - {p.created_by.name}: {p.content}"
-                    })
-                
-                # Combine topic context + current post conversation
-                full_context = topic_context + conversation_history
-                
-                # Choose which AI personas should respond
-                selected_personas = choose_persona_ai(post.content, full_context)
-                
-                # Get AI responses
-                ai_responses = get_ai_responses(selected_personas, full_context)
-                
-                # Create comments for each AI response immediately
-                for i, response in enumerate(ai_responses):
-                    persona_name = response["persona"]["username"]
-                    ai_user = User.objects.filter(name=persona_name, type="ai").first()
-                    
-                    if ai_user:
-                        Comment.objects.create(
-                            created_by=ai_user,
-                            post=post,
-                            content=response["message"]
-                        )
-                        
-            except Exception as e:
-                print(f"Error generating AI responses: {e}")
-        
-        # Start the AI response generation in a background thread
-        thread = threading.Thread(target=generate_ai_responses)
-        thread.daemon = True
-        thread.start()
+        with transaction.atomic():
+            post = serializer.save()
+            activity.post_created(post)
         
+        # AI replies are generated by the job workers, off the request
+        try:
+            enqueue_ai_round(post, post.content, 'post')
+        except JobQueueFull as e:
+            print(f"Not generating AI responses for post {post.id}: {e}")
+
         return Response(serializer.data)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -237,76 +202,36 @@ def triggerAIResponses(request, post_id):
     """Manually trigger AI responses for a specific post (for testing/debugging)"""
     try:
         post = Post.objects.get(id=post_id)
-        
-        # Build conversation history for this specific post
-        conversation_history = []
-        
-        # Start with the original post
-        conversation_history.append({
-            "role": "user" if post.created_by.type == "human" else "assistant",
-            "content": f"{post.created_by.name}: {post.content}"
-        })
-        
-        # Add all existing comments/replies to this post in chronological order
-        existing_comments = Comment.objects.filter(post=post).order_by('created_at')
-        for comment in existing_comments:
-            conversation_history.append({
-                "role": "user" if comment.created_by.type == "human" else "assistant", 
-                "content": f"{comment.created_by.name}: {comment.content}"
-            })
-        
-        # Add some recent context from other posts in the same topic
-        recent_posts = Post.objects.filter(topic=post.topic).exclude(id=post.id).order_by('-created_at')[:3]
-        topic_context = []
-        for p in recent_posts:
-            topic_context.append({
-                "role": "system",
-                "content": f"Recent topic discussion - {p.created_by.name}: {p.content}"
-            })
-        
-        # Combine topic context + current post conversation
-        full_context = topic_context + conversation_history
-        
-        # Choose which AI personas should respond
-        selected_personas = choose_persona_ai(post.content, full_context)
-        
-        # Get AI responses
-        ai_responses = get_ai_responses(selected_personas, full_context)
-        
-        # Create comments for each AI response
-        created_comments = []
-        for response in ai_responses:
-            persona_name = response["persona"]["username"]
-            ai_user = User.objects.filter(name=persona_name, type="ai").first()
-            
-            if ai_user:
-                comment = Comment.objects.create(
-                    created_by=ai_user,
-                    post=post,
-                    content=response["message"]
-                )
-                created_comments.append({
-                    'id': comment.id,
-                    'persona': persona_name,
-                    'content': response["message"]
-                })
-        
-        return Response({
-            'success': True,
-            'message': f'Created {len(created_comments)} AI responses',
-            'responses': created_comments
-        })
-        
     except Post.DoesNotExist:
         return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    try:
+        job = enqueue_ai_round(post, post.content, 'manual')
+    except JobQueueFull as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response({
+        'success': True,
+        'message': 'Queued AI responses',
+        'job': AIJobSerializer(job).data
+    }, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+def getAIJob(request, pk):
+    """Status of a queued AI reply round"""
+    try:
+        job = AIJob.objects.get(pk=pk)
+    except AIJob.DoesNotExist:
+        return Response({'error': 'AI job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(AIJobSerializer(job).data)
 
 @api_view(['POST'])
 def createComment(request):
     serializer = CommentSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            comment = serializer.save()
+            activity.comment_created(comment)
         return Response(serializer.data)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -315,51 +240,54 @@ def createComment(request):
 @csrf_exempt
 @api_view(['POST'])
 def toggleReaction(request):
-    """Toggle like/dislike on post or comment"""
+    """Toggle like/dislike on post or comment, returning the target's updated counts"""
     reaction_type = request.data.get('type')  # 'like' or 'dislike'
     post_id = request.data.get('post_id')
     comment_id = request.data.get('comment_id')
     user_id = request.data.get('user_id', 1)  # Default to user 1 for demo
     
-    if not reaction_type or reaction_type not in ['like', 'dislike']:
-        return Response({'error': 'Invalid reaction type'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    if not (post_id or comment_id):
-        return Response({'error': 'Post ID or Comment ID required'}, status=status.HTTP_400_BAD_REQUEST)
-    
     try:
-        # Check if reaction already exists
-        if post_id:
-            existing_reaction = Reaction.objects.filter(post_id=post_id, created_by_id=user_id).first()
-        else:
-            existing_reaction = Reaction.objects.filter(comment_id=comment_id, created_by_id=user_id).first()
-        
-        if existing_reaction:
-            if existing_reaction.type == reaction_type:
-                # Remove reaction if same type
-                existing_reaction.delete()
-                return Response({'action': 'removed', 'type': reaction_type})
-            else:
-                # Update reaction type
-                existing_reaction.type = reaction_type
-                existing_reaction.save()
-                return Response({'action': 'updated', 'type': reaction_type})
-        else:
-            # Create new reaction
-            reaction_data = {
-                'type': reaction_type,
-                'created_by': user_id,
-                'post': post_id,
-                'comment': comment_id
-            }
-            serializer = ReactionSerializer(data=reaction_data)
-            if serializer.is_valid():
-                serializer.save()
-                return Response({'action': 'created', 'type': reaction_type})
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            action, counts = reactions.toggle(user_id, reaction_type, post_id, comment_id)
+    except reactions.InvalidReaction as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response({'action': action, 'type': reaction_type, **counts})
+
+@csrf_exempt
+@api_view(['POST'])
+def bulkToggleReactions(request):
+    """Apply many reaction toggles in order, e.g. ones an offline client queued up"""
+    toggles = request.data.get('toggles')
+    user_id = request.data.get('user_id', 1)  # Default to user 1 for demo
+    if not isinstance(toggles, list) or not toggles:
+        return Response({'error': 'toggles must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(toggles) > settings.REACTION_BULK_MAX:
+        return Response({'error': f'At most {settings.REACTION_BULK_MAX} toggles per request'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    with transaction.atomic():
+        for toggle in toggles:
+            try:
+                if not isinstance(toggle, dict):
+                    raise reactions.InvalidReaction('Each toggle must be an object')
+                # A savepoint per toggle, so one bad toggle does not undo the others
+                with transaction.atomic():
+                    action, counts = reactions.toggle(
+                        toggle.get('user_id', user_id), toggle.get('type'), toggle.get('post_id'), toggle.get('comment_id')
+                    )
+                results.append({'action': action, 'type': toggle['type'], **counts})
+            except reactions.InvalidReaction as e:
+                results.append({'error': str(e)})
+            except ObjectDoesNotExist:
+                # The post or comment was deleted while the toggle ran
+                results.append({'error': 'Unknown post or comment'})
+            except (DatabaseError, TypeError, ValueError) as e:
+                # e.g. an id of the wrong type or a constraint violation; the savepoint undid this toggle only
+                results.append({'error': str(e)})
+    return Response({'results': results})
 
 # Bookmark endpoints
 @csrf_exempt
@@ -387,34 +315,22 @@ def toggleBookmark(request):
 def getUserBookmarks(request, user_id):
     """Get user's bookmarked posts"""
     bookmarks = Bookmark.objects.filter(user_id=user_id).select_related('post__created_by', 'post__topic')
-    serializer = BookmarkSerializer(bookmarks, many=True, context={'request': request})
-    return Response(serializer.data)
+    page, next_cursor = paginate_queryset(bookmarks, request, ['-created_at', '-id'])
+    return post_list_response(
+        page, request, next_cursor,
+        serializer_class=BookmarkSerializer, key='bookmarks', posts=[bookmark.post for bookmark in page],
+    )
 
 # Statistics endpoints
 @api_view(['GET'])
 def getStatistics(request):
-    """Get dashboard statistics"""
-    from django.utils import timezone
-    from datetime import timedelta
-    
-    today = timezone.now().date()
-    week_ago = timezone.now() - timedelta(days=7)
-    
-    stats = {
-        'total_posts': Post.objects.count(),
-        'total_users': User.objects.count(),
-        'total_comments': Comment.objects.count(),
-        'active_debates': Post.objects.filter(updated_at__gte=week_ago).count(),
-        'participants_today': User.objects.filter(
-            Q(posts__created_at__date=today) | Q(comments__created_at__date=today)
-        ).distinct().count(),
-        'new_posts_today': Post.objects.filter(created_at__date=today).count(),
-        'trending_topics': Topic.objects.annotate(
-            recent_posts=Count('topics', filter=Q(topics__updated_at__gte=week_ago))
-        ).filter(recent_posts__gt=0).order_by('-recent_posts')[:5].values('id', 'name', 'recent_posts')
-    }
-    
-    return Response(stats)
+    """Get dashboard statistics from the activity rollups (cached for STATISTICS_CACHE_TTL seconds)"""
+    return Response(rollups.statistics_snapshot())
+
+@api_view(['GET'])
+def getMetrics(request):
+    """Operational metrics (LLM latency, tokens, fallbacks, caches) in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @api_view(['GET'])
 def getUsers(request):
@@ -437,7 +353,9 @@ def user(request, pk):
     elif request.method == 'PUT':
         serializer = UserSerializer(user, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                user = serializer.save()
+                activity.user_updated(user)
             return Response(serializer.data)
         else:
             return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
@@ -446,7 +364,9 @@ def user(request, pk):
 def createUser(request):
     serializer = UserSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            user = serializer.save()
+            activity.user_created(user)
         return Response(serializer.data)
     else:
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -469,13 +389,5 @@ def comment(request, pk):
             return Response(serializer.data)
         else:
             return Response(status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        
-@api_view(['POST'])
-def createComment(request):
-    serializer = CommentSerializer(data=request.data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data)
-    else:
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     
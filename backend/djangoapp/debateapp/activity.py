@@ -0,0 +1,128 @@
+"""Write-side bookkeeping for posts, comments, topics and reactions.
+
+Every code path that creates content or changes a reaction calls the matching
+hook inside its transaction, so stored counters are kept current with atomic
+F() updates and reads never need a COUNT(*), and the search index, trending
+scores and statistics rollups follow the same writes.
+"""
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import rollups, search, topic_activity, trending
+from .models import Comment, Post, Reaction, Topic
+
+
+def _increment(field, delta):
+    if delta > 0:
+        return F(field) + delta
+    # Never let a drifted counter go negative; repair_counters fixes the drift
+    return Greatest(F(field) + delta, Value(0))
+
+
+def post_created(post):
+    Topic.objects.filter(pk=post.topic_id).update(post_count=_increment('post_count', 1))
+    search.get_backend().index_post(post)
+    trending.record(post.pk, 'post', post.created_at)
+    rollups.record_post(post)
+    topic_activity.invalidate(post.topic_id)
+
+
+def post_updated(post, previous_topic_id):
+    """Re-index an edited post and move its topic counter if the topic changed"""
+    if post.topic_id != previous_topic_id:
+        Topic.objects.filter(pk=previous_topic_id).update(post_count=_increment('post_count', -1))
+        Topic.objects.filter(pk=post.topic_id).update(post_count=_increment('post_count', 1))
+    search.get_backend().index_post(post)
+    # The edit moved updated_at into the week, and maybe the post to another topic
+    topic_activity.invalidate(post.topic_id, previous_topic_id)
+
+
+def comment_created(comment):
+    Post.objects.filter(pk=comment.post_id).update(comment_count=_increment('comment_count', 1))
+    search.get_backend().index_comment(comment)
+    trending.record(comment.post_id, 'comment', comment.created_at)
+    rollups.record_comment(comment)
+    topic_activity.invalidate(comment.post.topic_id)
+
+
+def post_viewed(post_id, views, viewed_at):
+    """A batch of deduplicated views of a post, flushed by view_tracking"""
+    Post.objects.filter(pk=post_id).update(view_count=_increment('view_count', views))
+    trending.record(post_id, 'view', viewed_at, count=views)
+
+
+def topic_created(topic):
+    search.get_backend().index_topic(topic)
+
+
+def user_created(user):
+    rollups.record_user(user)
+
+
+def user_updated(user):
+    # Posts are searchable by author name
+    search.get_backend().index_author(user)
+
+
+def reaction_changed(post_id=None, comment_id=None, added=None, removed=None, reacted_at=None):
+    """Apply a reaction being added, removed or switched to its target's counters
+
+    `reacted_at` is when the reaction was first made; trending weighs (and
+    takes back) post reactions as of that time.
+    """
+    updates = {}
+    if added:
+        updates[f'{added}_count'] = _increment(f'{added}_count', 1)
+    if removed:
+        updates[f'{removed}_count'] = _increment(f'{removed}_count', -1)
+    if not updates:
+        return
+    if post_id:
+        Post.objects.filter(pk=post_id).update(**updates)
+        if removed:
+            trending.record(post_id, removed, reacted_at, removed=True)
+        if added:
+            trending.record(post_id, added, reacted_at)
+    else:
+        Comment.objects.filter(pk=comment_id).update(**updates)
+
+
+def _count_of(model, fk, **filters):
+    rows = model.objects.filter(**{fk: OuterRef('pk')}, **filters).order_by().values(fk).annotate(total=Count('pk'))
+    return Coalesce(Subquery(rows.values('total')), 0)
+
+
+def counter_sources():
+    """Stored counters and the aggregate each one must equal"""
+    return [
+        (Post, {
+            'like_count': _count_of(Reaction, 'post', type='like'),
+            'dislike_count': _count_of(Reaction, 'post', type='dislike'),
+            'comment_count': _count_of(Comment, 'post'),
+        }),
+        (Comment, {
+            'like_count': _count_of(Reaction, 'comment', type='like'),
+            'dislike_count': _count_of(Reaction, 'comment', type='dislike'),
+        }),
+        (Topic, {
+            'post_count': _count_of(Post, 'topic'),
+        }),
+    ]
+
+
+def repair_counters(dry_run=False):
+    """Recompute every stored counter and fix rows that drifted
+
+    Returns a mapping of model name to the number of drifted rows.
+    """
+    drift = {}
+    for model, sources in counter_sources():
+        actual = {f'actual_{field}': expression for field, expression in sources.items()}
+        mismatch = Q()
+        for field in sources:
+            mismatch |= ~Q(**{field: F(f'actual_{field}')})
+        drifted = model.objects.annotate(**actual).filter(mismatch)
+        drift[model.__name__] = drifted.count()
+        if drift[model.__name__] and not dry_run:
+            model.objects.filter(pk__in=drifted.values('pk')).update(**sources)
+    return drift
@@ -0,0 +1,218 @@
+"""AI reply rounds for a post, broadcast to the post's WebSocket subscribers.
+
+A round routes the latest message to personas, generates their replies
+(streamed or not, see AI_STREAMING), persists them and publishes every frame
+to the `post_<id>` group; persisted comments also go to the `topic_<id>` group.
+Afterwards it refreshes the thread summary if one is due (see summaries.py).
+It runs exactly once per human reply, as an AIJob (see jobs.py).
+"""
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from . import activity, conversation, metrics, persona_router, summaries
+from .speculation import Speculation
+from .models import User
+from .openai_client import record_fallback
+from .personas import (
+    AI_PERSONAS, aget_single_response, aiter_ai_responses, aiter_batched_responses, astream_single_response
+)
+
+
+def post_group(post_id):
+    return f'post_{post_id}'
+
+
+def topic_group(topic_id):
+    return f'topic_{topic_id}'
+
+
+def user_detail(user):
+    """Full user detail object for WebSocket responses"""
+    return {
+        'id': user.id,
+        'name': user.name,
+        'join_date': user.join_date.isoformat(),
+        'type': user.type,
+        'agent_description': user.agent_description
+    }
+
+
+def comment_frame(comment, **extra):
+    return {
+        'type': 'post_reply',
+        'comment_id': comment.id,
+        'message': comment.content,
+        'post_id': comment.post_id,
+        'user_id': comment.created_by.id,
+        'created_by_detail': user_detail(comment.created_by),
+        'created_at': comment.created_at.isoformat(),
+        **extra,
+    }
+
+
+class PostBroadcast:
+    """Publishes frames for one post through the channel layer"""
+
+    def __init__(self, channel_layer, post_id, topic_id):
+        self.channel_layer = channel_layer
+        self.post_id = post_id
+        self.topic_id = topic_id
+
+    async def __call__(self, frame):
+        message = {'type': 'post.event', 'frame': frame}
+        await self.channel_layer.group_send(post_group(self.post_id), message)
+        # Topic subscribers only follow persisted comments, not typing or token frames
+        if frame['type'] == 'post_reply' and self.topic_id:
+            await self.channel_layer.group_send(topic_group(self.topic_id), message)
+
+
+@database_sync_to_async
+def save_comment(data):
+    """Validate and persist a comment, returning None when the user or post is invalid"""
+    from api.serializers import CommentSerializer
+    serializer = CommentSerializer(data=data)
+    if not serializer.is_valid():
+        return None
+    with transaction.atomic():
+        comment = serializer.save()
+        activity.comment_created(comment)
+    # Validation loaded the author and post the response frames need, so nothing is fetched on the event loop
+    return comment
+
+
+@database_sync_to_async
+def get_ai_users():
+    return {user.name: user for user in User.objects.filter(type='ai')}
+
+
+async def run_ai_round(post, user_message, emit, answered=(), on_saved=None):
+    """Route `user_message`, then generate, persist and emit the persona replies
+
+    Personas whose usernames are in `answered` already replied in an earlier
+    attempt of this round and are skipped. `on_saved(comment)` is awaited as
+    each reply is persisted, before it is emitted. Returns the ids of the AI
+    comments created.
+    """
+    metrics.increment('ai_reply_rounds_total')
+    full_context = await database_sync_to_async(conversation.build_context)(post)
+
+    # Start on the likely personas while the router decides (see AI_SPECULATION_BUDGET)
+    speculation = Speculation.start(user_message, full_context)
+    try:
+        # Step 1: Choose the persona(s) to reply (see PERSONA_ROUTER)
+        selected_personas = [
+            name for name in await persona_router.aroute(user_message, full_context)
+            if name in AI_PERSONAS and AI_PERSONAS[name]['username'] not in answered
+        ]
+        if speculation:
+            speculation.confirm(selected_personas)
+
+        if selected_personas:
+            await emit({
+                'type': 'post_users_typing',
+                'message': [AI_PERSONAS[name]["username"] for name in selected_personas],
+                'post_id': post.id,
+            })
+
+        # Step 2: Generate their responses concurrently, emitting each one as soon as it is ready
+        ai_users = await get_ai_users()
+        if settings.AI_GENERATION == 'batched' and len(selected_personas) > 1:
+            # One request answers for every persona, so there is nothing to stream per persona
+            comments = [
+                await emit_ai_reply(ai_response, post.id, ai_users, emit, on_saved)
+                async for ai_response in aiter_batched_responses(selected_personas, full_context)
+            ]
+        elif settings.AI_STREAMING:
+            streams = speculation.streams() if speculation else {}
+            # Let every persona finish (and record its reply) before a failure fails the round
+            comments = await asyncio.gather(*(
+                stream_persona_reply(persona_name, full_context, post.id, ai_users, emit, on_saved, streams.get(persona_name))
+                for persona_name in selected_personas
+            ), return_exceptions=True)
+            for comment in comments:
+                if isinstance(comment, Exception):
+                    raise comment
+        else:
+            started = speculation.responses() if speculation else {}
+            comments = [
+                await emit_ai_reply(ai_response, post.id, ai_users, emit, on_saved)
+                async for ai_response in aiter_ai_responses(selected_personas, full_context, started)
+            ]
+    finally:
+        if speculation:
+            speculation.cancel()
+
+    # Off the reply path: the replies are out, and they count towards the next summary
+    await summaries.arefresh(post)
+    return [comment.id for comment in comments if comment is not None]
+
+
+async def stream_persona_reply(persona_name, full_context, post_id, ai_users, emit, on_saved=None, deltas=None):
+    """Emit one persona's tokens as post_reply_delta frames, then persist the full reply
+
+    `deltas` continues a generation that was already started speculatively.
+    If the stream fails, the reply falls back to a regular completion; the final
+    post_reply frame always carries the complete message, so clients replace
+    whatever draft they built from the deltas.
+    """
+    persona = AI_PERSONAS[persona_name]
+    ai_user = ai_users.get(persona['username'])
+    if ai_user is None:
+        return None
+
+    stream_id = uuid.uuid4().hex
+    started = time.monotonic()
+    first_token_ms = None
+    parts = []
+    try:
+        async for delta in deltas or astream_single_response(persona_name, full_context):
+            if first_token_ms is None:
+                first_token_ms = round((time.monotonic() - started) * 1000)
+            parts.append(delta)
+            await emit({
+                'type': 'post_reply_delta',
+                'stream_id': stream_id,
+                'delta': delta,
+                'post_id': post_id,
+                'user_id': ai_user.id,
+            })
+        if not parts:
+            raise ValueError("stream ended without content")
+        ai_response = {"message": ''.join(parts), "persona": persona}
+    except Exception as e:
+        print(f"Streaming error for {persona_name}, falling back to a full completion: {e}")
+        record_fallback('stream', persona_name)
+        ai_response = await aget_single_response(persona_name, full_context)
+
+    return await emit_ai_reply(
+        ai_response, post_id, ai_users, emit, on_saved, stream_id=stream_id, first_token_ms=first_token_ms
+    )
+
+
+async def emit_ai_reply(ai_response, post_id, ai_users, emit, on_saved=None, **extra):
+    # Get the AI user from the database based on the persona username
+    ai_user = ai_users.get(ai_response['persona']['username'])
+    if ai_user is None:
+        return None
+
+    ai_comment = await save_comment({
+        "content": ai_response["message"],
+        "post": post_id,
+        "created_by": ai_user.id
+    })
+    if ai_comment is None:
+        return None
+    if on_saved:
+        await on_saved(ai_comment)
+
+    await emit(comment_frame(
+        ai_comment,
+        created_by_description=ai_response['persona']['description'],
+        **extra,
+    ))
+    return ai_comment
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class DebateappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'debateapp'
+
+    def ready(self):
+        from .timing import install_query_recorder
+        connection_created.connect(install_query_recorder)
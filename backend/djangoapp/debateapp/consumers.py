@@ -1,159 +1,132 @@
+import asyncio
 import json
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync
-from .models import Comment, Post, User
-from .personas import AI_PERSONAS, choose_persona_ai, get_ai_responses
-
-
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
-        print("WebSocket connection attempt started")  # Add this
-        self.group = 'timeline'
-
+from collections import deque
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from .ai_replies import PostBroadcast, comment_frame, post_group, save_comment, topic_group
+from . import timing
+from .jobs import JobQueueFull, aenqueue_ai_round
+from .models import Post, Topic
+
+
+def requested_ids(payload, key):
+    """Accept both `post_id: 1` and `post_ids: [1, 2]` style subscription payloads"""
+    ids = list(payload.get(f'{key}s') or [])
+    if payload.get(key) is not None:
+        ids.append(payload[key])
+    valid = []
+    for value in ids:
         try:
-            async_to_sync(self.channel_layer.group_add)(self.group, self.channel_name)
-            print(f"Added to group: {self.group}")  # Add this
-            self.accept()
-            print("WebSocket connection accepted")  # Add this
-        except Exception as e:
-            print(f"Error in connect: {e}")  # Add this
-
-    def disconnect(self, close_code):
-        print(f"WebSocket disconnected with code: {close_code}")  # Add this
-        async_to_sync(self.channel_layer.group_discard)(self.group, self.channel_name)
-
-    def receive(self, text_data):
-        print(f"Received data: {text_data}")  # Add this
+            valid.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return valid
+
+
+@database_sync_to_async
+def existing_ids(model, ids):
+    """The subset of `ids` that name a row of `model`, in one query"""
+    if not ids:
+        return set()
+    return set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """Per-post (and per-topic) subscriptions over a single socket
+
+    Clients send `subscribe`/`unsubscribe` with `post_id(s)`/`topic_id(s)` and only
+    receive events for those groups. A `post_reply` is persisted here and queued
+    for exactly one AI round, whose frames are broadcast to the post's group.
+    """
+
+    async def connect(self):
+        self.subscriptions = set()
+        # Comments reach a socket twice when it follows both the post and its topic
+        self.delivered_comments = deque(maxlen=256)
+        self.reply_tasks = set()
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.subscriptions.clear()
+
+    async def subscribe(self, group):
+        if group not in self.subscriptions:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions.add(group)
+
+    async def unsubscribe(self, group):
+        if group in self.subscriptions:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.subscriptions.discard(group)
+
+    async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_type = text_data_json['type']
-        message = text_data_json['message']
-        post_id = text_data_json['post_id']
-        user_id = 1
-
-        print(text_data_json)
-
-        if message_type == 'post_reply':
-            async_to_sync(self.channel_layer.group_send)(self.group, {
-                'type': 'post_reply',
-                'message': message,
-                'post_id': post_id,
-                'user_id': user_id
-            })
-
-    def post_reply(self, event):
-        from api.serializers import CommentSerializer
-        data = {
-            "content": event['message'],
-            "post": event['post_id'],
-            "created_by": event['user_id']
-        }
-
-        serializer = CommentSerializer(data=data)
-
-        if serializer.is_valid():
-            comment = serializer.save()
-            print('saved new comment', comment.post.id)
-            
-            # Create the full user detail object for the WebSocket response
-            user_detail = {
-                'id': comment.created_by.id,
-                'name': comment.created_by.name,
-                'join_date': comment.created_by.join_date.isoformat(),
-                'type': comment.created_by.type,
-                'agent_description': comment.created_by.agent_description
-            }
-            
-            self.send(text_data=json.dumps({
-                'type': 'post_reply',
-                'message': comment.content,
-                'post_id': comment.post.id,
-                'user_id': comment.created_by.id,
-                'created_by_detail': user_detail,
-                'created_at': comment.created_at.isoformat()
-            }))
-
-            # Build proper conversation history for this post
-            post = comment.post
-            conversation_history = []
-            
-            # Start with the original post
-            conversation_history.append({
-                "role": "user" if post.created_by.type == "human" else "assistant",
-                "content": f"{post.created_by.name}: {post.content}"
-            })
-            
-            # Add all existing comments/replies to this post in chronological order
-            existing_comments = Comment.objects.filter(post=post).order_by('created_at')
-            for existing_comment in existing_comments:
-                conversation_history.append({
-                    "role": "user" if existing_comment.created_by.type == "human" else "assistant", 
-                    "content": f"{existing_comment.created_by.name}: {existing_comment.content}"
-                })
-            
-            # Add some recent context from other posts in the same topic
-            recent_posts = Post.objects.filter(topic=post.topic).exclude(id=post.id).order_by('-created_at')[:2]
-            topic_context = []
-            for p in recent_posts:
-                topic_context.append({
-                    "role": "system",
-                    "content": f"Recent topic discussion - {p.created_by.name}: {p.content}"
-                })
-            
-            # Combine topic context + current post conversation
-            full_context = topic_context + conversation_history
-
-            # Step 1: Let AI choose persona(s)
-            selected_personas = choose_persona_ai(data["content"], full_context)
-            print(selected_personas)
-
-            if selected_personas:
-                self.send(text_data=json.dumps({
-                    'type': 'post_users_typing',
-                    'message': list(map(lambda x: AI_PERSONAS[x]["username"], selected_personas)),
-                    'post_id': comment.post.id,
-                }))
-
-            # Step 2: Generate their responses
-            ai_responses = get_ai_responses(selected_personas, full_context)
-
-            print(ai_responses)
-            for ai_response in ai_responses:
-                # Get the AI user from the database based on the persona username
-                ai_user = User.objects.get(
-                    name=ai_response['persona']['username'],
-                    type='ai'
-                )
-                
-                ai_comment = {
-                    "content": ai_response["message"],
-                    "post": event['post_id'],
-                    "created_by": ai_user.id
-                }
-
-                serializer = CommentSerializer(data=ai_comment)
-
-                if serializer.is_valid():
-                    ai_comment_obj = serializer.save()
-                    
-                    # Create the full user detail object for the WebSocket response
-                    user_detail = {
-                        'id': ai_user.id,
-                        'name': ai_user.name,
-                        'join_date': ai_user.join_date.isoformat(),
-                        'type': ai_user.type,
-                        'agent_description': ai_user.agent_description
-                    }
-                    
-                    self.send(text_data=json.dumps({
-                        'type': 'post_reply',
-                        'message': ai_response["message"],
-                        'post_id': comment.post.id,
-                        'user_id': ai_user.id,
-                        'created_by_detail': user_detail,
-                        'created_at': ai_comment_obj.created_at.isoformat(),
-                        "created_by_description": ai_response['persona']['description']
-                    }))
-
-        else:
+
+        if message_type in ('subscribe', 'unsubscribe'):
+            post_ids = requested_ids(text_data_json, 'post_id')
+            topic_ids = requested_ids(text_data_json, 'topic_id')
+            if message_type == 'subscribe':
+                # Don't create groups for posts or topics that don't exist
+                post_ids = await existing_ids(Post, post_ids)
+                topic_ids = await existing_ids(Topic, topic_ids)
+            action = self.subscribe if message_type == 'subscribe' else self.unsubscribe
+            groups = [post_group(post_id) for post_id in post_ids]
+            groups += [topic_group(topic_id) for topic_id in topic_ids]
+            for group in groups:
+                await action(group)
+        elif message_type == 'post_reply':
+            post_ids = requested_ids({'post_id': text_data_json.get('post_id')}, 'post_id')
+            if not post_ids:
+                await self.send_error('Post not found', text_data_json.get('post_id'))
+                return
+            post_id = post_ids[0]
+            # Generation takes a while; keep reading subscription changes meanwhile
+            task = asyncio.create_task(self.handle_reply(text_data_json['message'], post_id, user_id=1))
+            self.reply_tasks.add(task)
+            task.add_done_callback(self.reply_tasks.discard)
+
+    async def handle_reply(self, message, post_id, user_id):
+        with timing.collect() as timings:
+            try:
+                await self.save_reply(message, post_id, user_id)
+            except Exception as e:
+                # Nothing awaits this task, so report the failure here rather than losing it
+                print(f'Error handling reply for post {post_id}: {e!r}')
+                await self.send_error('Could not save your reply', post_id)
+        timing.report(f'ws post_reply for post {post_id}', 'ws:post_reply', timings)
+
+    async def save_reply(self, message, post_id, user_id):
+        comment = await save_comment({
+            "content": message,
+            "post": post_id,
+            "created_by": user_id
+        })
+        if comment is None:
             print('Error saving comment for post. Either the user id or post id is invalid')
+            await self.send_error('Post not found', post_id)
             return
+        print('saved new comment', comment.post.id)
+        # Replying to a post implies following it; only subscribe once the post is known to exist
+        await self.subscribe(post_group(comment.post.id))
+
+        broadcast = PostBroadcast(self.channel_layer, comment.post.id, comment.post.topic_id)
+        await broadcast(comment_frame(comment))
+        try:
+            await aenqueue_ai_round(comment.post, comment.content, 'reply', trigger_comment=comment)
+        except JobQueueFull as e:
+            await self.send_error(str(e), comment.post.id)
+
+    async def send_error(self, message, post_id):
+        await self.send(text_data=json.dumps({'type': 'error', 'message': message, 'post_id': post_id}))
+
+    async def post_event(self, event):
+        """Forward a broadcast frame from one of our groups to the client"""
+        frame = event['frame']
+        if frame['type'] == 'post_reply':
+            if frame['comment_id'] in self.delivered_comments:
+                return
+            self.delivered_comments.append(frame['comment_id'])
+        await self.send(text_data=json.dumps(frame))
@@ -0,0 +1,157 @@
+"""Conversation context for AI replies.
+
+The rendered history of each post is cached together with the position of the
+last comment it includes, so a new reply only reads the comments added since
+instead of the whole thread. Context is capped at AI_CONTEXT_TOKEN_BUDGET
+estimated tokens: the post itself and the recent topic posts are always kept,
+then as many of the latest comments as fit.
+
+Once a thread is long enough to have a ThreadSummary (see summaries.py), the
+comments it covers are replaced by the summary, and only the comments after
+it are sent. The summary is cached next to the history.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .models import Comment, Post, ThreadSummary
+
+CACHE_TIMEOUT = 60 * 60
+REREAD_WINDOW = timedelta(seconds=5)
+TOPIC_CONTEXT_POSTS = 2
+# Upper bounds in estimated tokens, up to well past the default budget
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token, plus the per-message overhead
+    return len(text) // 4 + 4
+
+
+def render(author, content):
+    return {
+        "role": "user" if author.type == "human" else "assistant",
+        "content": f"{author.name}: {content}"
+    }
+
+
+def cache_key(post):
+    # Post ids can be reused after a delete; the creation time tells the posts apart
+    return f'debateapp:conversation:{post.pk}:{post.created_at.timestamp()}'
+
+
+def summary_key(post):
+    return f'{cache_key(post)}:summary'
+
+
+def forget(post):
+    """Drop the cached history, e.g. after the post was edited"""
+    cache.delete(cache_key(post))
+
+
+def trim(entries, budget):
+    """Keep the newest (comment id, tokens, message) entries whose tokens fit in `budget`"""
+    kept = []
+    for entry in reversed(entries):
+        if entry[1] > budget:
+            break
+        budget -= entry[1]
+        kept.append(entry)
+    kept.reverse()
+    return kept
+
+
+def post_history(post):
+    """The post and its comments, oldest first, read incrementally through the cache"""
+    key = cache_key(post)
+    history = cache.get(key)
+    comments = Comment.objects.filter(post_id=post.pk).select_related('created_by').order_by('created_at', 'id')
+    if history is None:
+        post = Post.objects.select_related('created_by').get(pk=post.pk)
+        opening = render(post.created_by, post.content)
+        history = {'post': (estimate_tokens(opening['content']), opening), 'comments': [], 'after': None}
+    else:
+        # Comments can commit out of created_at order; re-read a short window and skip known ids
+        comments = comments.filter(created_at__gte=history['after'] - REREAD_WINDOW)
+
+    known = {comment_id for comment_id, _, _ in history['comments']}
+    new_comments = [comment for comment in comments if comment.pk not in known]
+    if new_comments or history['after'] is None:
+        entries = []
+        for comment in new_comments:
+            message = render(comment.created_by, comment.content)
+            entries.append((comment.pk, estimate_tokens(message['content']), message))
+        # Nothing older than the budget can ever be sent again, so it need not be stored
+        history['comments'] = trim(history['comments'] + entries, settings.AI_CONTEXT_TOKEN_BUDGET - history['post'][0])
+        history['after'] = max([history['after'] or post.created_at] + [comment.created_at for comment in new_comments])
+        cache.set(key, history, CACHE_TIMEOUT)
+    return history
+
+
+def summary(post):
+    """The post's ThreadSummary, or None; read through the cache"""
+    if not settings.AI_SUMMARY_ENABLED:
+        return None
+    cached = cache.get(summary_key(post))
+    if cached is None:
+        # False marks a thread known to have no summary yet
+        cached = ThreadSummary.objects.filter(post_id=post.pk).first() or False
+        cache.set(summary_key(post), cached, CACHE_TIMEOUT)
+    return cached or None
+
+
+def remember_summary(post, thread_summary):
+    cache.set(summary_key(post), thread_summary, CACHE_TIMEOUT)
+
+
+def summary_message(thread_summary):
+    return {
+        "role": "system",
+        "content": f"Summary of the {thread_summary.comment_count} earlier replies: {thread_summary.content}"
+    }
+
+
+def unsummarized(entries, thread_summary):
+    """The history entries newer than the last comment `thread_summary` covers
+
+    Comment ids increase in creation order, so the comparison holds even for
+    comments that committed out of created_at order.
+    """
+    if thread_summary is None:
+        return entries
+    return [entry for entry in entries if entry[0] > thread_summary.last_comment_id]
+
+
+def build_context(post):
+    """Recent topic posts plus the post's conversation so far, oldest first, within the token budget"""
+    history = post_history(post)
+    thread_summary = summary(post)
+
+    recent_posts = (
+        Post.objects.filter(topic_id=post.topic_id).exclude(id=post.pk)
+        .select_related('created_by').order_by('-created_at')[:TOPIC_CONTEXT_POSTS]
+    )
+    topic_context = [{
+        "role": "system",
+        "content": f"Recent topic discussion - {p.created_by.name}: {p.content}"
+    } for p in recent_posts]
+
+    budget = settings.AI_CONTEXT_TOKEN_BUDGET - history['post'][0]
+    budget -= sum(estimate_tokens(message['content']) for message in topic_context)
+    summarized = []
+    if thread_summary:
+        summarized = [summary_message(thread_summary)]
+        budget -= estimate_tokens(summarized[0]['content'])
+    comments = [message for _, _, message in trim(unsummarized(history['comments'], thread_summary), budget)]
+    messages = topic_context + [history['post'][1]] + summarized + comments
+
+    sent = sum(estimate_tokens(message['content']) for message in messages)
+    metrics.observe('conversation_context_tokens', sent, buckets=TOKEN_BUCKETS)
+    metrics.increment('conversation_context_tokens_total', sent)
+    if thread_summary:
+        # What the summarized comments would have cost, less the summary sent in their place
+        saved = thread_summary.source_tokens - estimate_tokens(summarized[0]['content'])
+        metrics.increment('conversation_summary_saved_tokens_total', max(saved, 0))
+    return messages
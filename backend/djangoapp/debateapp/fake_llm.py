@@ -0,0 +1,186 @@
+"""Stand-ins for the OpenAI API, for tests and latency benchmarks.
+
+FakeAsyncLLM mirrors the `client.chat.completions.create` surface the persona
+code uses and sleeps for an injected latency instead of calling the network.
+FakeOpenAIServer is a local HTTP server speaking the chat completions wire
+format (including SSE streaming), for exercising the real OpenAI client.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+def reply_for(messages):
+    return f"Considered reply to: {messages[-1]['content'][:80]}"
+
+
+def structured_reply(response_format, messages, personas):
+    """Content for a structured request: persona routing or a batch of persona replies"""
+    schema = response_format["json_schema"]
+    if schema["name"] == "persona_replies":
+        return json.dumps({name: reply_for(messages) for name in schema["schema"]["required"]})
+    return json.dumps({"personas": personas})
+
+
+def usage_for(messages, content):
+    """Token usage, counting words as tokens"""
+    prompt_tokens = sum(len(str(message['content']).split()) for message in messages)
+    completion_tokens = len(content.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def split_tokens(text):
+    words = text.split(' ')
+    return [word if i == 0 else f' {word}' for i, word in enumerate(words)]
+
+
+class FakeAsyncLLM:
+    def __init__(self, latency=0.0, personas=("logic_master", "critic"), token_latency=0.0, fail_batches=False):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.personas = list(personas)
+        self.fail_batches = fail_batches
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def reply_for(self, messages):
+        return reply_for(messages)
+
+    async def create(self, model, messages, response_format=None, stream=False, stream_options=None, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        if response_format:
+            content = structured_reply(response_format, messages, self.personas)
+            if self.fail_batches and response_format["json_schema"]["name"] == "persona_replies":
+                content = content[:len(content) // 2]
+        else:
+            content = self.reply_for(messages)
+        usage = SimpleNamespace(**usage_for(messages, content))
+        if stream:
+            return self.stream(content, usage if (stream_options or {}).get("include_usage") else None)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    async def stream(self, content, usage=None):
+        for token in split_tokens(content):
+            await asyncio.sleep(self.token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], usage=None)
+        if usage:
+            yield SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeOpenAIServer:
+    """Serve /v1/chat/completions on localhost with injected latency
+
+    Usage::
+
+        with FakeOpenAIServer(first_token_latency=0.05) as server:
+            client = AsyncOpenAI(base_url=server.base_url, api_key="test")
+    """
+
+    def __init__(self, personas=("logic_master", "critic"), first_token_latency=0.0, token_latency=0.0,
+                 fail_streams=False):
+        self.personas = list(personas)
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.fail_streams = fail_streams
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(body)
+                if body.get('response_format'):
+                    content = structured_reply(body['response_format'], body['messages'], server.personas)
+                else:
+                    content = reply_for(body['messages'])
+
+                time.sleep(server.first_token_latency)
+                if body.get('stream'):
+                    self.stream(body, content)
+                else:
+                    self.complete(body, content)
+
+            def complete(self, body, content):
+                payload = json.dumps({
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                    "model": body['model'],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage_for(body['messages'], content),
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, body, content):
+                if server.fail_streams:
+                    self.send_error(500, "streaming unavailable")
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i, token in enumerate(split_tokens(content)):
+                    if i:
+                        time.sleep(server.token_latency)
+                    self.event({
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body['model'],
+                        "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token}}],
+                    })
+                if body.get('stream_options', {}).get('include_usage'):
+                    self.event({
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body['model'], "choices": [], "usage": usage_for(body['messages'], content),
+                    })
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.write_chunk(b"")
+
+            def event(self, payload):
+                self.write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+            def write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
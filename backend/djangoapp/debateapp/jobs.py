@@ -0,0 +1,365 @@
+"""Persistent queue for AI reply rounds.
+
+Every round is an AIJob row and the table is the queue. A fixed pool of worker
+coroutines claims jobs under a lease, runs `run_ai_round` and records the
+outcome, retrying with exponential backoff up to the job's max_attempts. Each
+reply is added to the job's result as it is saved, and a retry only runs the
+personas that have not replied yet, so a partly failed round posts nothing
+twice. The lease is renewed while the round runs; a worker that finds its job
+claimed by another stops the round and records nothing more.
+Jobs still queued when a process stops, or running under a lease that has
+expired, are claimed by the next pool to start. Enqueueing raises JobQueueFull
+once AI_JOB_QUEUE_LIMIT jobs are waiting.
+
+Busy threads are coalesced: a reply waits AI_REPLY_DEBOUNCE seconds before
+its round may start, and a reply to a post that already has a round waiting is
+folded into that round (which then answers the latest context) rather than
+queueing another, up to AI_REPLY_MAX_DELAY after the first. A new round also
+cancels the post's rounds running in this process (AI_REPLY_SUPERSEDE); they
+end as `superseded`. Claims leave out posts already running
+AI_JOB_MAX_PER_POST rounds, so one hot thread cannot take every worker, and
+nothing is claimed while AI_JOB_MAX_RUNNING rounds run across all processes.
+
+The pool runs on the ASGI server's event loop (JobWorkersMiddleware starts it)
+so workers share the channel layer with the consumers. `manage.py
+run_ai_workers` runs it standalone, which needs a Redis channel layer to reach
+sockets served by other processes. With AI_JOBS_EAGER jobs run inline instead.
+"""
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Count, Exists, F, Q
+from django.utils import timezone
+
+from . import metrics, timing
+from .ai_replies import PostBroadcast, run_ai_round
+from .models import AIJob
+from .openai_client import entry_point
+
+# The telemetry entry point (openai_client.entry_point) for each AIJob source
+ENTRY_POINTS = {'post': 'rest', 'manual': 'rest', 'reply': 'websocket'}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def debounced(source, since):
+    """When a round for `source` first queued at `since` may start"""
+    if source != 'reply':
+        return timezone.now()
+    return min(
+        timezone.now() + timedelta(seconds=settings.AI_REPLY_DEBOUNCE),
+        since + timedelta(seconds=settings.AI_REPLY_MAX_DELAY),
+    )
+
+
+def coalesce(post, message, source, trigger_comment=None):
+    """Fold a reply into the post's waiting round and return it; None when there is none"""
+    job = AIJob.objects.filter(post=post, status='queued').order_by('-created_at').first()
+    if job is None:
+        return None
+    changes = {
+        'message': message, 'trigger_comment': trigger_comment, 'source': source,
+        'run_after': debounced(source, job.created_at),
+    }
+    # A worker may have claimed it since the select
+    if not AIJob.objects.filter(pk=job.pk, status='queued').update(coalesced=F('coalesced') + 1, **changes):
+        return None
+    metrics.increment('ai_jobs_coalesced_total')
+    job.refresh_from_db()
+    return job
+
+
+def create_job(post, message, source, trigger_comment=None):
+    if source == 'reply' and (job := coalesce(post, message, source, trigger_comment)) is not None:
+        return job
+    if AIJob.objects.filter(status='queued').count() >= settings.AI_JOB_QUEUE_LIMIT:
+        raise JobQueueFull(f'AI job queue is full ({settings.AI_JOB_QUEUE_LIMIT} jobs waiting)')
+    now = timezone.now()
+    return AIJob.objects.create(
+        post=post,
+        trigger_comment=trigger_comment,
+        message=message,
+        source=source,
+        max_attempts=settings.AI_JOB_MAX_ATTEMPTS,
+        run_after=debounced(source, now),
+    )
+
+
+def schedule(job):
+    """Cancel the rounds this job supersedes and wake the workers when it is due"""
+    if settings.AI_REPLY_SUPERSEDE:
+        pool.supersede(job.post_id, keep=job.pk)
+    pool.notify(delay=max((job.run_after - timezone.now()).total_seconds(), 0))
+
+
+def enqueue_ai_round(post, message, source, trigger_comment=None):
+    """Queue an AI reply round for `post` and return its job
+
+    Eager jobs run at once, without debouncing.
+    """
+    job = create_job(post, message, source, trigger_comment)
+    if settings.AI_JOBS_EAGER:
+        async_to_sync(run_eagerly)(job.pk)
+        job.refresh_from_db()
+    else:
+        schedule(job)
+    return job
+
+
+async def aenqueue_ai_round(post, message, source, trigger_comment=None):
+    job = await database_sync_to_async(create_job)(post, message, source, trigger_comment)
+    if settings.AI_JOBS_EAGER:
+        await run_eagerly(job.pk)
+        await job.arefresh_from_db()
+    else:
+        schedule(job)
+    return job
+
+
+def lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.AI_JOB_LEASE_SECONDS)
+
+
+def claim_job(claimable):
+    """Atomically move the oldest claimable job to running; None when there is none"""
+    lease = lease_expiry()
+    for job_id in AIJob.objects.filter(claimable).order_by('run_after', 'id').values_list('id', flat=True)[:5]:
+        # Another worker (or process) may have taken it since the select
+        claimed = AIJob.objects.filter(claimable, pk=job_id).update(
+            status='running', attempts=F('attempts') + 1, lease_expires_at=lease,
+        )
+        if claimed:
+            return AIJob.objects.select_related('post').get(pk=job_id)
+    return None
+
+
+def capacity(now):
+    """Leaves out posts running AI_JOB_MAX_PER_POST rounds, and every job while AI_JOB_MAX_RUNNING rounds run
+
+    Part of the claiming UPDATE itself, so concurrent claims cannot both take the last slot.
+    """
+    running = AIJob.objects.filter(status='running', lease_expires_at__gte=now).order_by()
+    busy_posts = running.values('post').annotate(rounds=Count('id')).filter(rounds__gte=settings.AI_JOB_MAX_PER_POST)
+    allowed = ~Q(post__in=busy_posts.values('post'))
+    if settings.AI_JOB_MAX_RUNNING:
+        full = running.values('status').annotate(rounds=Count('id')).filter(rounds__gte=settings.AI_JOB_MAX_RUNNING)
+        allowed &= ~Exists(full)
+    return allowed
+
+
+def claim_next_job():
+    now = timezone.now()
+    return claim_job(capacity(now) & (
+        Q(status='queued', run_after__lte=now) |
+        # The worker holding it died; the job is retried like any failure
+        Q(status='running', lease_expires_at__lt=now)
+    ))
+
+
+def owned(job):
+    """The job while this claim still holds it; every claim counts an attempt, so a reclaim changes `attempts`"""
+    return AIJob.objects.filter(pk=job.pk, status='running', attempts=job.attempts)
+
+
+def renew_lease(job):
+    """Extend the lease of a job this worker still holds; False once it was lost"""
+    return bool(owned(job).update(lease_expires_at=lease_expiry()))
+
+
+def record_reply(job, comment):
+    """Note a reply as soon as it is saved, so a retry of the round does not post it again"""
+    job.result.setdefault('comment_ids', []).append(comment.id)
+    job.result.setdefault('answered', []).append(comment.created_by.name)
+    owned(job).update(result=job.result)
+
+
+def complete_job(job):
+    owned(job).update(
+        status='succeeded', result={'comment_ids': [], **job.result},
+        lease_expires_at=None, finished_at=timezone.now(),
+    )
+
+
+def fail_job(job, error):
+    if job.attempts < job.max_attempts:
+        delay = settings.AI_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        owned(job).update(
+            status='queued', last_error=error, lease_expires_at=None,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+    else:
+        owned(job).update(
+            status='failed', last_error=error, lease_expires_at=None, finished_at=timezone.now(),
+        )
+
+
+def supersede_job(job):
+    owned(job).update(
+        status='superseded', last_error='Superseded by a newer round', lease_expires_at=None,
+        finished_at=timezone.now(),
+    )
+
+
+async def keep_lease(job, round_task):
+    """Renew the job's lease every third of AI_JOB_LEASE_SECONDS while the round runs
+
+    Cancels `round_task` and returns True if the lease was lost, so the round
+    stops before it posts replies the new owner posts as well.
+    """
+    while True:
+        await asyncio.sleep(settings.AI_JOB_LEASE_SECONDS / 3)
+        if not await database_sync_to_async(renew_lease)(job):
+            round_task.cancel()
+            return True
+
+
+async def run_job(job):
+    """Run one claimed job and record its outcome"""
+    if job.attempts > job.max_attempts:
+        await database_sync_to_async(fail_job)(job, 'Gave up after the worker running it was lost')
+        return
+    broadcast = PostBroadcast(get_channel_layer(), job.post_id, job.post.topic_id)
+    token = entry_point.set(ENTRY_POINTS.get(job.source, 'other'))
+    lease = asyncio.ensure_future(keep_lease(job, asyncio.current_task()))
+    try:
+        # Timed on its own, also when run eagerly inside a request
+        with timing.collect() as timings:
+            # Replies saved by a failed earlier attempt stay; only the personas still owed one answer
+            await run_ai_round(
+                job.post, job.message, broadcast,
+                answered=set(job.result.get('answered', [])),
+                on_saved=database_sync_to_async(lambda comment: record_reply(job, comment)),
+            )
+    except asyncio.CancelledError:
+        if not (lease.done() and not lease.cancelled() and lease.result()):
+            raise
+        # Cancelled by keep_lease: another worker owns the job now
+        asyncio.current_task().uncancel()
+        print(f"AI job {job.pk} lost its lease (attempt {job.attempts}), stopped the round")
+        return
+    except Exception as e:
+        print(f"AI job {job.pk} failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+        await database_sync_to_async(fail_job)(job, str(e))
+        return
+    finally:
+        lease.cancel()
+        entry_point.reset(token)
+    await database_sync_to_async(complete_job)(job)
+    timing.report(f'AI job {job.pk} for post {job.post_id}', 'job:ai_round', timings)
+
+
+async def run_eagerly(job_id):
+    """Run a job inline, retrying immediately until it succeeds or gives up"""
+    while (job := await database_sync_to_async(claim_job)(Q(pk=job_id, status='queued'))) is not None:
+        await run_job(job)
+
+
+class AIJobPool:
+    """AI_JOB_WORKERS worker coroutines sharing one event loop"""
+
+    def __init__(self):
+        self.loop = None
+        self.wakeup = None
+        self.workers = []
+        self.rounds = {}  # job id -> (post id, task) of the rounds running here
+        self.superseded = set()
+
+    def start(self, loop=None):
+        """Start the workers on `loop` (the running loop by default), once per loop"""
+        loop = loop or asyncio.get_running_loop()
+        if loop is self.loop:
+            return
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.workers = [loop.create_task(self.work()) for _ in range(settings.AI_JOB_WORKERS)]
+        print(f"Started {len(self.workers)} AI job workers")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.loop, self.wakeup, self.workers = None, None, []
+
+    async def run(self):
+        """Run the workers until cancelled (the run_ai_workers command)"""
+        self.start()
+        try:
+            await asyncio.gather(*self.workers)
+        finally:
+            await self.stop()
+
+    def notify(self, delay=0):
+        """Wake idle workers, after `delay` seconds; safe to call from any thread"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.wakeup.set)
+
+    def supersede(self, post_id, keep=None):
+        """Cancel the rounds running here for `post_id`, other than job `keep`; safe to call from any thread"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.cancel_rounds, post_id, keep)
+
+    def cancel_rounds(self, post_id, keep):
+        for job_id, (round_post_id, task) in self.rounds.items():
+            if round_post_id == post_id and job_id != keep and not task.done():
+                self.superseded.add(job_id)
+                task.cancel()
+
+    async def run_round(self, job):
+        """Run a claimed job as its own task, so a newer round can cancel it without stopping the worker"""
+        task = asyncio.ensure_future(run_job(job))
+        self.rounds[job.pk] = (job.post_id, task)
+        try:
+            await asyncio.wait([task])
+        finally:
+            del self.rounds[job.pk]
+            # Only still running when the worker itself is being stopped
+            task.cancel()
+        if job.pk in self.superseded:
+            self.superseded.discard(job.pk)
+            if task.cancelled():
+                await database_sync_to_async(supersede_job)(job)
+                metrics.increment('ai_jobs_superseded_total')
+                # Clients drop the drafts streamed for it; the replies it already saved stay
+                broadcast = PostBroadcast(get_channel_layer(), job.post_id, job.post.topic_id)
+                await broadcast({'type': 'post_round_cancelled', 'job_id': job.pk, 'post_id': job.post_id})
+                # Its slot for the post is free again
+                self.wakeup.set()
+
+    async def work(self):
+        while True:
+            # Clear before looking so a notify that races the claim is not lost
+            self.wakeup.clear()
+            try:
+                job = await database_sync_to_async(claim_next_job)()
+            except Exception as e:
+                print(f"Error claiming AI job: {e}")
+                job = None
+            if job is not None:
+                await self.run_round(job)
+                continue
+            try:
+                # Polling also picks up retries that became due and other processes' jobs
+                await asyncio.wait_for(self.wakeup.wait(), settings.AI_JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+pool = AIJobPool()
+
+
+class JobWorkersMiddleware:
+    """ASGI middleware starting the AI job workers on the server's event loop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if settings.AI_JOB_AUTOSTART and not settings.AI_JOBS_EAGER:
+            pool.start()
+        return await self.app(scope, receive, send)
@@ -0,0 +1,117 @@
+"""Content-addressed cache for LLM responses.
+
+Keys hash the model, persona, full prompt and response format, so any change in
+the conversation is a different entry and nothing needs invalidating. Entries
+live in an in-process LRU (LLM_CACHE_MAX_ENTRIES) in front of the
+LLMCacheEntry table, which survives restarts and is shared by every process
+(LLM_CACHE_PERSIST). Both tiers expire entries after LLM_CACHE_TTL seconds.
+Lookups count `llm_cache_hits_total{kind,tier}` and `llm_cache_misses_total{kind}`.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .models import LLMCacheEntry
+
+
+def cache_key(model, messages, persona=None, response_format=None):
+    payload = json.dumps({
+        'model': model,
+        'persona': persona,
+        'messages': messages,
+        'response_format': response_format,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryCache:
+    """Thread-safe LRU with per-entry expiry"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.LLM_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+memory = MemoryCache()
+
+
+def db_get(key):
+    return LLMCacheEntry.objects.filter(key=key, expires_at__gt=timezone.now()).values_list(
+        'response', 'expires_at'
+    ).first()
+
+
+def db_set(key, value, model, kind):
+    LLMCacheEntry.objects.update_or_create(key=key, defaults={
+        'model': model,
+        'kind': kind,
+        'response': value,
+        'expires_at': timezone.now() + timedelta(seconds=settings.LLM_CACHE_TTL),
+    })
+
+
+def purge_expired():
+    deleted, _ = LLMCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+async def aget(key, kind):
+    """The cached response for `key`, or None"""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    value = memory.get(key)
+    if value is not None:
+        metrics.increment('llm_cache_hits_total', kind=kind, tier='memory')
+        return value
+    if settings.LLM_CACHE_PERSIST:
+        row = await database_sync_to_async(db_get)(key)
+        if row is not None:
+            value, expires_at = row
+            memory.set(key, value, (expires_at - timezone.now()).total_seconds())
+            metrics.increment('llm_cache_hits_total', kind=kind, tier='db')
+            return value
+    metrics.increment('llm_cache_misses_total', kind=kind)
+    return None
+
+
+async def aset(key, value, model, kind):
+    if not settings.LLM_CACHE_ENABLED:
+        return
+    memory.set(key, value, settings.LLM_CACHE_TTL)
+    if settings.LLM_CACHE_PERSIST:
+        try:
+            await database_sync_to_async(db_set)(key, value, model, kind)
+        except Exception as e:
+            # The memory tier still has it; a failed write only costs a future miss elsewhere
+            print(f"Error persisting LLM cache entry: {e}")
@@ -0,0 +1,80 @@
+import asyncio
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from debateapp import metrics, personas
+from debateapp.fake_llm import FakeAsyncLLM
+from debateapp.persona_router import aroute
+
+SAMPLE_MESSAGES = [
+    "Where is the evidence for that? It sounds like a logical fallacy.",
+    "lol seriously, whatever you say",
+    "I hope this makes the future better for everyone.",
+    "Can we find some middle ground that both sides accept?",
+    "Recent research papers disagree, do you have a source?",
+    "I can't even afford rent with my student loans.",
+    "What do you all think about pineapple on pizza?",
+    "DrKnowItAll, explain this to me.",
+]
+
+HISTORY = [
+    {"role": "user", "content": "You: Should cities ban cars from downtown?"},
+    {"role": "assistant", "content": "RazorTongue: That plan ignores everyone who lives outside the center."},
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare AI reply latency across PERSONA_ROUTER modes against a simulated LLM (no network, no writes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Passes over the sample messages per mode')
+        parser.add_argument('--llm-latency', type=float, default=0.4, help='Simulated seconds per completion')
+        parser.add_argument('--modes', default='llm,local,hybrid', help='Comma separated router modes')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'mode':<8} {'first reply p50':>16} {'first reply p95':>16} {'all replies p50':>16} "
+                          f"{'LLM routes':>11} {'local route':>12}")
+        for mode in options['modes'].split(','):
+            fake = FakeAsyncLLM(latency=options['llm_latency'], personas=["critic", "diplomat"])
+            metrics.reset()
+            # The cache would hide the router's round trip after the first pass
+            with override_settings(PERSONA_ROUTER=mode, LLM_CACHE_ENABLED=False), \
+                    mock.patch.object(personas, 'async_client', fake):
+                first_replies, all_replies = asyncio.run(self.measure(options['runs']))
+
+            routes = metrics.value('persona_routes_total', mode=mode, router='llm') + \
+                metrics.value('persona_routes_total', mode=mode, router='local')
+            llm_routes = metrics.value('persona_routes_total', mode=mode, router='llm')
+            local_seconds = metrics.value('persona_router_local_seconds_total')
+            local_route = f"{local_seconds / routes * 1e6:.0f}us" if local_seconds else "-"
+            self.stdout.write(
+                f"{mode:<8} {self.ms(statistics.median(first_replies)):>16} "
+                f"{self.ms(percentile(first_replies, 95)):>16} {self.ms(statistics.median(all_replies)):>16} "
+                f"{llm_routes:>5}/{routes:<5} {local_route:>12}"
+            )
+
+    async def measure(self, runs):
+        first_replies, all_replies = [], []
+        for _ in range(runs):
+            for message in SAMPLE_MESSAGES:
+                started = time.perf_counter()
+                first = None
+                selected = await aroute(message, HISTORY)
+                async for _ in personas.aiter_ai_responses(selected, HISTORY):
+                    first = first or time.perf_counter() - started
+                first_replies.append(first or time.perf_counter() - started)
+                all_replies.append(time.perf_counter() - started)
+        return first_replies, all_replies
+
+    @staticmethod
+    def ms(seconds):
+        return f"{seconds * 1000:.0f}ms"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
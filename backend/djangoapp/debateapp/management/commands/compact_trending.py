@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from debateapp import trending
+
+
+class Command(BaseCommand):
+    help = 'Rescale trending scores to the current time and drop posts that are no longer trending (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute every score from the last week of posts, comments, reactions and views',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            scored = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Trending scores rebuilt for {scored} post(s)'))
+            return
+
+        rescaled, dropped = trending.compact()
+        self.stdout.write(self.style.SUCCESS(
+            f'Trending compacted: {rescaled} score(s) rescaled, {dropped} cold post(s) dropped'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from debateapp import llm_cache
+from debateapp.models import LLMCacheEntry
+
+
+class Command(BaseCommand):
+    help = 'Delete expired LLM cache entries (or all of them with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Delete every entry, not only expired ones')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            deleted, _ = LLMCacheEntry.objects.all().delete()
+        else:
+            deleted = llm_cache.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} LLM cache entries'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from debateapp import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the statistics rollups from the posts, comments and users in the database'
+
+    def handle(self, *args, **options):
+        days = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Statistics rollups rebuilt ({days} day(s) of activity)'))
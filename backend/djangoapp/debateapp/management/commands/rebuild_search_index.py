@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from debateapp.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the posts, comments and topics in the database'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        with transaction.atomic():
+            counts = backend.rebuild()
+
+        for table, rows in counts.items():
+            self.stdout.write(f'{table}: {rows} row(s) indexed')
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt ({type(backend).__name__})'))
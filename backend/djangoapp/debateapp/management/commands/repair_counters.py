@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from debateapp.activity import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored like/dislike/comment/post counters and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = repair_counters(dry_run=options['dry_run'])
+
+        for model_name, rows in drift.items():
+            self.stdout.write(f'{model_name}: {rows} drifted row(s)')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, no counters were changed'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Counters are in sync'))
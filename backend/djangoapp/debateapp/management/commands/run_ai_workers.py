@@ -0,0 +1,15 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from debateapp.jobs import pool
+
+
+class Command(BaseCommand):
+    help = 'Run the AI job workers outside the web server (needs a Redis channel layer to reach sockets)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Processing AI jobs, press Ctrl+C to stop'))
+        try:
+            asyncio.run(pool.run())
+        except KeyboardInterrupt:
+            pass
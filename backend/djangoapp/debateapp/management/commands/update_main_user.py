@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from debateapp import activity
 from debateapp.models import User
 
 class Command(BaseCommand):
@@ -22,6 +23,7 @@ class Command(BaseCommand):
                 type="human",
                 agent_description=""
             )
+            activity.user_created(user)
             self.stdout.write(
                 self.style.SUCCESS('Successfully created user ID 1 with name "You"')
             )
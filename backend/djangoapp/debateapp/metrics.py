@@ -0,0 +1,144 @@
+"""In-process operational metrics: counters, gauges and histograms.
+
+A metric is a name plus labels, e.g.
+`metrics.increment('llm_cache_hits_total', kind='route', tier='memory')` or
+`metrics.observe('llm_request_duration_seconds', 0.42, purpose='reply')`.
+Values are per process and reset on restart. `render()` formats them in the
+Prometheus text exposition format, served at /api/metrics/.
+"""
+import math
+import threading
+from collections import Counter
+
+# Upper bounds in seconds, from a cache hit to a slow streamed reply
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = Counter()
+_gauges = Counter()
+_histograms = {}  # key -> Histogram
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # per bucket, not cumulative
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, amount):
+        self.count += 1
+        self.sum += amount
+        for i, bound in enumerate(self.buckets):
+            if amount <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += amount
+
+
+def adjust(name, amount, **labels):
+    """Move a gauge (e.g. requests in flight) up or down"""
+    with _lock:
+        _gauges[_key(name, labels)] += amount
+
+
+def observe(name, amount, buckets=LATENCY_BUCKETS, **labels):
+    """Add a sample to a histogram"""
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = Histogram(buckets)
+        _histograms[key].observe(amount)
+
+
+def _matching(series, name, labels):
+    wanted = set(labels.items())
+    return [value for (series_name, series_labels), value in series.items()
+            if series_name == name and wanted <= set(series_labels)]
+
+
+def value(name, **labels):
+    """A counter's or gauge's total over every series carrying `labels`"""
+    with _lock:
+        return sum(_matching(_counters, name, labels)) + sum(_matching(_gauges, name, labels))
+
+
+def histogram(name, **labels):
+    """(count, sum) of a histogram over every series carrying `labels`"""
+    with _lock:
+        matching = _matching(_histograms, name, labels)
+        return sum(h.count for h in matching), sum(h.sum for h in matching)
+
+
+def snapshot():
+    """Every counter as (name, labels, value), sorted by name and labels"""
+    with _lock:
+        return [(name, dict(labels), total) for (name, labels), total in sorted(_counters.items())]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, label in labels
+    )
+    return '{' + ','.join(f'{name}="{label}"' for name, label in escaped) + '}'
+
+
+def _format_value(amount):
+    if amount == math.inf:
+        return '+Inf'
+    return repr(amount) if isinstance(amount, float) else str(amount)
+
+
+def render():
+    """All metrics in the Prometheus text format (version 0.0.4)"""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted(
+            ((key, list(h.cumulative()), h.count, h.sum) for key, h in _histograms.items()), key=lambda item: item[0]
+        )
+
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+
+    for kind, series in (('counter', counters), ('gauge', gauges)):
+        for (name, labels), amount in series:
+            declare(name, kind)
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(amount)}')
+    for (name, labels), buckets, count, total in histograms:
+        declare(name, 'histogram')
+        for bound, cumulative in buckets + [(math.inf, count)]:
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
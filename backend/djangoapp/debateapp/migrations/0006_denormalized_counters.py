@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:56
+
+import django.db.models.expressions
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Topic = apps.get_model('debateapp', 'Topic')
+    Post = apps.get_model('debateapp', 'Post')
+    Comment = apps.get_model('debateapp', 'Comment')
+    Reaction = apps.get_model('debateapp', 'Reaction')
+
+    def count_of(model, fk, **filters):
+        rows = model.objects.filter(**{fk: OuterRef('pk')}, **filters).order_by().values(fk).annotate(total=Count('pk'))
+        return Coalesce(Subquery(rows.values('total')), 0)
+
+    Post.objects.update(
+        like_count=count_of(Reaction, 'post', type='like'),
+        dislike_count=count_of(Reaction, 'post', type='dislike'),
+        comment_count=count_of(Comment, 'post'),
+    )
+    Comment.objects.update(
+        like_count=count_of(Reaction, 'comment', type='like'),
+        dislike_count=count_of(Reaction, 'comment', type='dislike'),
+    )
+    Topic.objects.update(post_count=count_of(Post, 'topic'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-like_count', '-comment_count', '-view_count', '-updated_at', '-id'], name='post_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(models.OrderBy(django.db.models.expressions.CombinedExpression(models.F('like_count'), '+', models.F('dislike_count')), descending=True), models.OrderBy(models.F('updated_at'), descending=True), models.OrderBy(models.F('id'), descending=True), name='post_controversial_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+CREATE_TABLES = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS debateapp_post_search USING fts5("
+    "content, topic, author, comments, topic_id UNINDEXED, tokenize='porter unicode61')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS debateapp_topic_search USING fts5("
+    "name, description, tokenize='porter unicode61')",
+]
+
+BACKFILL = [
+    "INSERT INTO debateapp_post_search (rowid, content, topic, author, comments, topic_id) "
+    "SELECT p.id, p.content, t.name, u.name, "
+    "COALESCE((SELECT group_concat(c.content, ' ') FROM debateapp_comment c WHERE c.post_id = p.id), ''), p.topic_id "
+    "FROM debateapp_post p JOIN debateapp_topic t ON t.id = p.topic_id JOIN debateapp_user u ON u.id = p.created_by_id",
+    "INSERT INTO debateapp_topic_search (rowid, name, description) "
+    "SELECT id, name, COALESCE(description, '') FROM debateapp_topic",
+]
+
+
+def create_search_tables(apps, schema_editor):
+    # FTS5 is SQLite only; other databases use SEARCH_BACKEND=basic
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_TABLES + BACKFILL:
+        schema_editor.execute(statement)
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS debateapp_post_search")
+    schema_editor.execute("DROP TABLE IF EXISTS debateapp_topic_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0008_llm_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:21
+
+import django.db.models.deletion
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copies of trending.WEIGHTS and the default settings at the time of this migration
+WEIGHTS = {'post': 1.0, 'like': 1.0, 'dislike': 0.5, 'comment': 2.0, 'view': 0.2}
+HALF_LIFE_SECONDS = 24 * 3600
+MIN_SCORE = 0.05
+
+
+def backfill_scores(apps, schema_editor):
+    Post = apps.get_model('debateapp', 'Post')
+    Comment = apps.get_model('debateapp', 'Comment')
+    Reaction = apps.get_model('debateapp', 'Reaction')
+    PostView = apps.get_model('debateapp', 'PostView')
+    TrendingScore = apps.get_model('debateapp', 'TrendingScore')
+    TrendingLandmark = apps.get_model('debateapp', 'TrendingLandmark')
+
+    now = timezone.now()
+    since = now - timedelta(days=7)
+    events = [
+        ('post', Post.objects.filter(created_at__gte=since).values_list('id', 'created_at')),
+        ('comment', Comment.objects.filter(created_at__gte=since).values_list('post_id', 'created_at')),
+        ('view', PostView.objects.filter(viewed_at__gte=since).values_list('post_id', 'viewed_at')),
+    ]
+    for reaction_type in ('like', 'dislike'):
+        events.append((reaction_type, Reaction.objects.filter(
+            post__isnull=False, type=reaction_type, created_at__gte=since,
+        ).values_list('post_id', 'created_at')))
+
+    scores = defaultdict(float)
+    for event, rows in events:
+        for post_id, at in rows:
+            scores[post_id] += WEIGHTS[event] * 2 ** ((at - now).total_seconds() / HALF_LIFE_SECONDS)
+
+    TrendingLandmark.objects.create(pk=1, landmark=now)
+    TrendingScore.objects.bulk_create([
+        TrendingScore(post_id=post_id, score=score) for post_id, score in scores.items() if score >= MIN_SCORE
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0009_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingLandmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('landmark', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='debateapp.post')),
+                ('score', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score'], name='trending_score_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:24
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate, TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    Post = apps.get_model('debateapp', 'Post')
+    Comment = apps.get_model('debateapp', 'Comment')
+    User = apps.get_model('debateapp', 'User')
+    DailyActivity = apps.get_model('debateapp', 'DailyActivity')
+    DailyParticipant = apps.get_model('debateapp', 'DailyParticipant')
+    HourlyTopicActivity = apps.get_model('debateapp', 'HourlyTopicActivity')
+
+    daily = defaultdict(lambda: defaultdict(int))
+    hourly = defaultdict(lambda: defaultdict(int))
+    participants = set()
+    for field, model, topic in (('posts', Post, 'topic_id'), ('comments', Comment, 'post__topic_id')):
+        rows = model.objects.filter(created_at__isnull=False)
+        for row in rows.annotate(day=TruncDate('created_at')).values('day').annotate(total=Count('pk')):
+            daily[row['day']][field] += row['total']
+        for row in rows.annotate(hour=TruncHour('created_at')).values('hour', topic).annotate(total=Count('pk')):
+            hourly[row['hour'], row[topic]][field] += row['total']
+        participants.update(rows.annotate(day=TruncDate('created_at')).values_list('day', 'created_by_id').distinct())
+    for row in User.objects.annotate(day=TruncDate('join_date')).values('day').annotate(total=Count('pk')):
+        daily[row['day']]['users'] += row['total']
+    for day, _ in participants:
+        daily[day]['participants'] += 1
+
+    DailyActivity.objects.bulk_create([DailyActivity(date=day, **counts) for day, counts in daily.items()])
+    DailyParticipant.objects.bulk_create([DailyParticipant(date=day, user_id=user_id) for day, user_id in participants])
+    HourlyTopicActivity.objects.bulk_create([
+        HourlyTopicActivity(hour=hour, topic_id=topic_id, **counts) for (hour, topic_id), counts in hourly.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0010_trending_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('posts', models.PositiveIntegerField(default=0)),
+                ('comments', models.PositiveIntegerField(default=0)),
+                ('users', models.PositiveIntegerField(default=0)),
+                ('participants', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_days', to='debateapp.user')),
+            ],
+            options={
+                'unique_together': {('date', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyTopicActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('posts', models.PositiveIntegerField(default=0)),
+                ('comments', models.PositiveIntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_activity', to='debateapp.topic')),
+            ],
+            options={
+                'unique_together': {('hour', 'topic')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
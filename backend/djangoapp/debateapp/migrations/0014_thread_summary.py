@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0013_comment_parent_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadSummary',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='thread_summary', serialize=False, to='debateapp.post')),
+                ('content', models.TextField()),
+                ('last_comment_id', models.PositiveIntegerField()),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('source_tokens', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debateapp', '0014_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aijob',
+            name='coalesced',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='aijob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('superseded', 'Superseded')], default='queued', max_length=20),
+        ),
+    ]
@@ -13,20 +13,18 @@ class Topic(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Maintained by debateapp.activity; repair with `manage.py repair_counters`
+    post_count = models.PositiveIntegerField(default=0)
 
-    @property
-    def post_count(self):
-        return self.topics.count()
-    
     @property
     def activity_score(self):
-        """Calculate activity based on recent posts and comments"""
-        from django.utils import timezone
-        from datetime import timedelta
-        
-        week_ago = timezone.now() - timedelta(days=7)
-        recent_posts = self.topics.filter(updated_at__gte=week_ago).count()
-        recent_comments = Comment.objects.filter(post__topic=self, created_at__gte=week_ago).count()
+        """Activity based on recent posts and comments (cached, see debateapp.topic_activity)"""
+        from .topic_activity import scores
+        return scores([self.pk]).get(self.pk, 0)
+
+    @staticmethod
+    def compute_activity_score(recent_posts, recent_comments):
+        """Weight recent posts and comments into a single activity score"""
         return recent_posts + (recent_comments * 0.5)
 
 class Post(models.Model):
@@ -36,19 +34,11 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='topics')
     view_count = models.PositiveIntegerField(default=0)
+    # Maintained by debateapp.activity; repair with `manage.py repair_counters`
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
 
-    @property
-    def like_count(self):
-        return self.reactions.filter(type='like').count()
-    
-    @property
-    def dislike_count(self):
-        return self.reactions.filter(type='dislike').count()
-    
-    @property
-    def comment_count(self):
-        return self.comments.count()
-    
     @property
     def engagement_score(self):
         """Calculate engagement for trending/popular sorting"""
@@ -64,6 +54,23 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Keyset pagination seeks for the feed, per-topic and per-author listings
+            models.Index(fields=['-updated_at', '-id'], name='post_updated_idx'),
+            models.Index(fields=['topic', '-updated_at', '-id'], name='post_topic_updated_idx'),
+            models.Index(fields=['created_by', '-updated_at', '-id'], name='post_author_updated_idx'),
+            # Backs the `popular` and `controversial` feed orderings
+            models.Index(
+                fields=['-like_count', '-comment_count', '-view_count', '-updated_at', '-id'],
+                name='post_popular_idx',
+            ),
+            models.Index(
+                (models.F('like_count') + models.F('dislike_count')).desc(),
+                models.F('updated_at').desc(),
+                models.F('id').desc(),
+                name='post_controversial_idx',
+            ),
+        ]
 
 class Comment(models.Model):
     created_by  = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
@@ -72,17 +79,17 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
-
-    @property
-    def like_count(self):
-        return self.reactions.filter(type='like').count()
-    
-    @property
-    def dislike_count(self):
-        return self.reactions.filter(type='dislike').count()
+    # Maintained by debateapp.activity; repair with `manage.py repair_counters`
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+            # Walking a thread (debateapp.threads) and paging one comment's replies
+            models.Index(fields=['parent', 'created_at', 'id'], name='comment_parent_created_idx'),
+        ]
 
 class Reaction(models.Model):
     reaction_types = [
@@ -108,6 +115,9 @@ class Bookmark(models.Model):
 
     class Meta:
         unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='bookmark_user_created_idx'),
+        ]
 
 class PostView(models.Model):
     """Track post views for analytics"""
@@ -119,3 +129,100 @@ class PostView(models.Model):
     class Meta:
         unique_together = ['post', 'ip_address']  # Prevent duplicate views from same IP
 
+class PostViewSketch(models.Model):
+    """HyperLogLog registers estimating a post's distinct viewers (VIEW_UNIQUE_COUNTING=hll)"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='view_sketch')
+    registers = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ThreadSummary(models.Model):
+    """A rolling summary of a post's older comments, sent to the AI in their place (see summaries.py)"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='thread_summary')
+    content = models.TextField()
+    last_comment_id = models.PositiveIntegerField()  # the newest comment covered; not a key, comments can be deleted
+    comment_count = models.PositiveIntegerField(default=0)
+    source_tokens = models.PositiveIntegerField(default=0)  # estimated tokens of the comments covered
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class AIJob(models.Model):
+    """A queued AI reply round; the table is the queue, so pending work survives restarts"""
+    statuses = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('superseded', 'Superseded'),
+    ]
+    sources = [('post', 'New post'), ('reply', 'Reply'), ('manual', 'Manual trigger')]
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='ai_jobs')
+    trigger_comment = models.ForeignKey(Comment, on_delete=models.SET_NULL, related_name='ai_jobs', null=True, blank=True)
+    message = models.TextField()
+    source = models.CharField(max_length=20, choices=sources)
+    status = models.CharField(max_length=20, choices=statuses, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    coalesced = models.PositiveIntegerField(default=0)  # later replies folded into this round
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField()
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='aijob_claim_idx'),
+        ]
+
+class LLMCacheEntry(models.Model):
+    """Persistent tier of the LLM response cache (see llm_cache.py)"""
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20)
+    response = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+class TrendingScore(models.Model):
+    """A post's forward-decayed engagement score, kept current by the activity hooks (see trending.py)"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='trending_score_idx'),
+        ]
+
+class TrendingLandmark(models.Model):
+    """The single time all trending scores are currently relative to"""
+    landmark = models.DateTimeField()
+
+class DailyActivity(models.Model):
+    """Per-day totals behind the statistics dashboard, kept by the activity hooks (see rollups.py)"""
+    date = models.DateField(unique=True)
+    posts = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+    users = models.PositiveIntegerField(default=0)
+    participants = models.PositiveIntegerField(default=0)
+
+class DailyParticipant(models.Model):
+    """A user who posted or commented on a given day, so participants are only counted once"""
+    date = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='active_days')
+
+    class Meta:
+        unique_together = ['date', 'user']
+
+class HourlyTopicActivity(models.Model):
+    """Posts and comments per topic per hour, for windowed topic activity"""
+    hour = models.DateTimeField()
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='hourly_activity')
+    posts = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['hour', 'topic']
@@ -1,4 +1,82 @@
-from openai import OpenAI
+"""The OpenAI client and the telemetry recorded around every chat completion.
+
+`instrument()` wraps one request. It counts the request, its prompt bytes and
+the tokens the API reports, tracks how many requests are in flight, counts
+errors and times the request into llm_request_duration_seconds; streams also
+record their time to first token. Metrics are labelled by purpose (route,
+reply, batch, summary), persona for single-persona replies, and the entry
+point the round came from (`rest` or `websocket`, see `entry_point`).
+`record_fallback()` counts canned or degraded answers. Everything is served at /api/metrics/.
+"""
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+
+from openai import AsyncOpenAI
 from django.conf import settings
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+from . import metrics
+
+async_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+
+# Set per AI job from its source (jobs.run_job); tasks started by the job inherit it
+entry_point = contextvars.ContextVar('llm_entry_point', default='other')
+
+
+def base_labels(purpose, persona=None):
+    labels = {'purpose': purpose, 'entry_point': entry_point.get()}
+    if persona:
+        labels['persona'] = persona
+    return labels
+
+
+class LLMCall:
+    def __init__(self, labels):
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.first_token = False
+
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        metrics.increment('llm_prompt_tokens_total', usage.prompt_tokens or 0, **self.labels)
+        metrics.increment('llm_completion_tokens_total', usage.completion_tokens or 0, **self.labels)
+
+    def record_response(self, response):
+        self.record_usage(getattr(response, 'usage', None))
+
+    def record_chunk(self, chunk):
+        """Note the first token of a stream; the final chunk carries the usage"""
+        if not self.first_token and chunk.choices and chunk.choices[0].delta.content:
+            self.first_token = True
+            metrics.observe('llm_time_to_first_token_seconds', time.perf_counter() - self.started, **self.labels)
+        self.record_usage(getattr(chunk, 'usage', None))
+
+
+@contextmanager
+def instrument(purpose, messages, persona=None):
+    """Record one chat completion request; yields an LLMCall to report the response to"""
+    labels = base_labels(purpose, persona)
+    metrics.increment('llm_requests_total', **labels)
+    metrics.increment('llm_prompt_bytes_total', len(json.dumps(messages).encode()), **labels)
+    metrics.adjust('llm_requests_in_flight', 1, purpose=purpose)
+    call = LLMCall(labels)
+    outcome = 'ok'
+    try:
+        yield call
+    except Exception as e:
+        outcome = 'error'
+        metrics.increment('llm_errors_total', error=type(e).__name__, **labels)
+        raise
+    except BaseException:
+        # Cancelled, e.g. a wasted speculative generation
+        outcome = 'cancelled'
+        raise
+    finally:
+        metrics.adjust('llm_requests_in_flight', -1, purpose=purpose)
+        metrics.observe('llm_request_duration_seconds', time.perf_counter() - call.started, outcome=outcome, **labels)
+
+
+def record_fallback(purpose, persona=None):
+    metrics.increment('llm_fallbacks_total', **base_labels(purpose, persona))
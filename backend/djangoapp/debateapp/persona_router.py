@@ -0,0 +1,150 @@
+"""Persona routing: which personas answer a message.
+
+PERSONA_ROUTER selects the strategy per deployment:
+
+- `llm`: ask the model (`achoose_persona_ai`), one extra round trip per reply
+- `local`: score the personas in-process, well under a millisecond
+- `hybrid`: take the local choice when its confidence reaches
+  PERSONA_ROUTER_MIN_CONFIDENCE, otherwise ask the model
+
+The local scorer weighs the message (and, more lightly, the last messages of
+the thread) against a TF-IDF profile of each persona built from its prompt,
+description and cue words. Mentioning a persona's username selects it, and
+personas that spoke in the last few messages are damped so voices rotate.
+"""
+import math
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import metrics
+from .personas import AI_PERSONAS, achoose_persona_ai, fallback_personas
+
+MAX_PERSONAS = 3
+# Personas scoring at least this share of the best score are selected alongside it
+SELECTION_RATIO = 0.5
+THREAD_WEIGHT = 0.5
+THREAD_MESSAGES = 2
+RECENT_SPEAKERS = 4
+RECENT_SPEAKER_DAMPING = 0.7
+MENTION_SCORE = 1.0
+
+# Words people use when they want a given voice, beyond what the prompts say
+PERSONA_CUES = {
+    "logic_master": "logic logical evidence prove proof reason reasoning argument fallacy premise conclusion "
+                    "contradiction consistent rational facts",
+    "storyteller": "story stories analogy imagine once tale example metaphor picture history legend",
+    "critic": "wrong flawed weak disagree problem criticism critique overrated nonsense counterpoint bad",
+    "optimist": "hope hopeful positive opportunity bright future better good great improve potential",
+    "troll": "lol lmao joke funny sarcasm whatever seriously cringe meme troll",
+    "angry_person": "angry furious outrageous ridiculous unacceptable hate sick tired unfair rage",
+    "diplomat": "compromise agree middle ground both sides calm peace respect consensus common",
+    "redditor": "upvote reddit thread meme hot take internet tldr edit op",
+    "expert_in_everything": "actually explain how why what expert know science fact everything",
+    "phd_student": "study studies research paper papers citation source sources literature peer data "
+                   "academic journal",
+    "unemployed_student": "job jobs rent money student loans broke afford tuition school economy work",
+}
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its of on or so that the this to was "
+    "we were what with you your who persona debate assistant responds arguments points".split()
+)
+
+TOKEN_RE = re.compile(r"[a-z']+")
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS and len(token) > 1]
+
+
+@lru_cache(maxsize=1)
+def persona_profiles():
+    """Unit-length TF-IDF vectors per persona, built once per process"""
+    documents = {
+        name: tokenize(f"{persona['description']} {persona['system_prompt']} {PERSONA_CUES.get(name, '')}")
+        for name, persona in AI_PERSONAS.items()
+    }
+    document_frequency = Counter(token for tokens in documents.values() for token in set(tokens))
+    idf = {token: math.log(len(documents) / count) + 1 for token, count in document_frequency.items()}
+
+    profiles = {}
+    for name, tokens in documents.items():
+        weights = {token: count * idf[token] for token, count in Counter(tokens).items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        profiles[name] = {token: weight / norm for token, weight in weights.items()}
+    return profiles
+
+
+@lru_cache(maxsize=1)
+def persona_by_username():
+    return {persona["username"].lower(): name for name, persona in AI_PERSONAS.items()}
+
+
+def recent_speakers(conversation_history):
+    """Personas among the authors of the last RECENT_SPEAKERS messages ("Name: content")"""
+    speakers = set()
+    for message in conversation_history[-RECENT_SPEAKERS:]:
+        author = message["content"].split(":", 1)[0].lower()
+        if author in persona_by_username():
+            speakers.add(persona_by_username()[author])
+    return speakers
+
+
+def score_personas(user_message, conversation_history):
+    """Score every persona for `user_message`; higher is a better fit"""
+    features = Counter(tokenize(user_message))
+    for message in conversation_history[-THREAD_MESSAGES:]:
+        for token in tokenize(message["content"]):
+            features[token] += THREAD_WEIGHT
+
+    words = set(TOKEN_RE.findall(user_message.lower()))
+    speakers = recent_speakers(conversation_history)
+    scores = {}
+    for name, profile in persona_profiles().items():
+        score = sum(weight * profile.get(token, 0.0) for token, weight in features.items())
+        if AI_PERSONAS[name]["username"].lower() in words:
+            score += MENTION_SCORE
+        if name in speakers:
+            score *= RECENT_SPEAKER_DAMPING
+        scores[name] = score
+    return scores
+
+
+def local_route(user_message, conversation_history):
+    """Return (personas, confidence) from the local scorer
+
+    Confidence is the selected personas' share of the total score, 0 when
+    nothing in the message matched any persona.
+    """
+    scores = score_personas(user_message, conversation_history)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best = ranked[0][1]
+    total = sum(score for _, score in ranked)
+    if best <= 0:
+        return [], 0.0
+    selected = [name for name, score in ranked[:MAX_PERSONAS] if score >= best * SELECTION_RATIO]
+    return selected, sum(scores[name] for name in selected) / total
+
+
+async def aroute(user_message, conversation_history):
+    """Choose the personas to answer `user_message` using the configured PERSONA_ROUTER"""
+    mode = settings.PERSONA_ROUTER
+    if mode == 'llm':
+        metrics.increment('persona_routes_total', mode=mode, router='llm')
+        return await achoose_persona_ai(user_message, conversation_history)
+
+    started = time.perf_counter()
+    personas, confidence = local_route(user_message, conversation_history)
+    metrics.increment('persona_router_local_seconds_total', time.perf_counter() - started)
+
+    if mode == 'hybrid' and confidence < settings.PERSONA_ROUTER_MIN_CONFIDENCE:
+        metrics.increment('persona_routes_total', mode=mode, router='llm')
+        return await achoose_persona_ai(user_message, conversation_history)
+
+    metrics.increment('persona_routes_total', mode=mode, router='local')
+    # Nothing matched: behave like the LLM router's own fallback
+    return personas or fallback_personas()
@@ -1,5 +1,9 @@
+from django.conf import settings
+
+from . import activity, llm_cache, metrics, timing
 from .models import User
-from .openai_client import client
+from .openai_client import async_client, instrument, record_fallback
+import asyncio
 import json
 import random
 
@@ -61,100 +65,285 @@ AI_PERSONAS = {
     },
 }
 
-def choose_persona_ai(user_message, conversation_history):
-    # Fallback persona selection if OpenAI is not available
+CHAT_MODEL = "gpt-4o-mini"
+
+ROUTER_SYSTEM_PROMPT = "You are a routing assistant. Decide which AI persona(s) should respond based on the conversation. Available personas: logic_master, storyteller, critic, optimist, troll, angry_person, diplomat, redditor, expert_in_everything, phd_student, unemployed_student. Only 3 personas max can be selected. Only return their names as a JSON list."
+
+PERSONA_SELECTION_FORMAT = { "type": "json_schema", "json_schema": {
+    "name": "persona_selection",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "personas": {
+                "type": "array",
+                "items": {"type": "string"},
+            }
+        },
+        "required": ["personas"]
+    }
+}}
+
+BATCH_SYSTEM_PROMPT = "You write the next reply for several debate personas at once. Write each reply independently and fully in character, as that persona alone would answer the conversation. Return a JSON object with exactly one reply per persona, keyed by persona name."
+
+SUMMARY_SYSTEM_PROMPT = "You keep a running summary of a debate thread. Extend the summary so far with the new replies. Keep who argued what, the main arguments and the open disagreements; drop repetition and small talk. Answer with the summary only, in at most 150 words."
+
+# Fallback responses based on persona type
+FALLBACK_RESPONSES = {
+    "logic_master": "Let's analyze this logically. What evidence supports this claim?",
+    "storyteller": "This reminds me of an old tale where...",
+    "critic": "I have to disagree with several points here.",
+    "optimist": "Great point! I see lots of potential here.",
+    "troll": "LOL, seriously? 🙄",
+    "angry_person": "This is absolutely ridiculous!",
+    "diplomat": "Perhaps we can find some middle ground here.",
+    "redditor": "This. So much this. Take my upvote!",
+    "expert_in_everything": "Actually, studies show that...",
+    "phd_student": "According to recent literature...",
+    "unemployed_student": "Honestly, I don't know much about this but..."
+}
+
+
+def router_messages(user_message, conversation_history):
+    return [
+        {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
+        *conversation_history,
+        {"role": "user", "content": f"User just said: {user_message}\n\nWhich persona(s) should reply?"}
+    ]
+
+
+def parse_persona_selection(message_text):
+    # Parse JSON safely
     try:
-        router_prompt = [
-            {"role": "system", "content": "You are a routing assistant. Decide which AI persona(s) should respond based on the conversation. Available personas: logic_master, storyteller, critic, optimist, troll, angry_person, diplomat, redditor, expert_in_everything, phd_student, unemployed_student. Only 3 personas max can be selected. Only return their names as a JSON list."},
-            *conversation_history,
-            {"role": "user", "content": f"User just said: {user_message}\n\nWhich persona(s) should reply?"}
-        ]
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=router_prompt,
-            response_format={ "type": "json_schema", "json_schema": {
-                "name": "persona_selection",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "personas": {
-                            "type": "array",
-                            "items": {"type": "string"},
-                        }
-                    },
-                    "required": ["personas"]
-                }
-            }},
-        )
-        message_text = response.choices[0].message.content
+        parsed = json.loads(message_text)
+        return parsed.get("personas", [])
+    except json.JSONDecodeError:
+        # fallback if AI returns something invalid
+        return []
+
+
+def fallback_personas():
+    # Fallback: randomly select 1-3 personas
+    available_personas = list(AI_PERSONAS.keys())
+    num_personas = random.randint(1, 3)
+    return random.sample(available_personas, min(num_personas, len(available_personas)))
 
-        # Parse JSON safely
-        try:
-            parsed = json.loads(message_text)
-            selected_personas = parsed.get("personas", [])
-        except json.JSONDecodeError:
-            # fallback if AI returns something invalid
-            selected_personas = []
 
-        return selected_personas
+def persona_messages(persona_name, conversation_history):
+    return [
+        {"role": "system", "content": AI_PERSONAS[persona_name]["system_prompt"]},
+        *conversation_history,
+    ]
+
+
+async def achoose_persona_ai(user_message, conversation_history):
+    messages = router_messages(user_message, conversation_history)
+    key = llm_cache.cache_key(CHAT_MODEL, messages, response_format=PERSONA_SELECTION_FORMAT)
+    cached = await llm_cache.aget(key, 'route')
+    if cached is not None:
+        return parse_persona_selection(cached)
+
+    try:
+        with instrument('route', messages) as call, timing.span('llm'):
+            response = await async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                response_format=PERSONA_SELECTION_FORMAT,
+                # Routing should be a function of the conversation, which is what makes it cacheable
+                temperature=0,
+            )
+            call.record_response(response)
+        content = response.choices[0].message.content
     except Exception as e:
         print(f"OpenAI error, using fallback persona selection: {e}")
-        # Fallback: randomly select 1-3 personas
-        available_personas = list(AI_PERSONAS.keys())
-        num_personas = random.randint(1, 3)
-        return random.sample(available_personas, min(num_personas, len(available_personas)))
-
-def get_ai_responses(selected_personas, conversation_history):
-    import concurrent.futures
-    import threading
-    
-    def get_single_response(persona_name):
-        persona = AI_PERSONAS[persona_name]
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": persona["system_prompt"]},
-                    *conversation_history,
-                ],
+        record_fallback('route')
+        return fallback_personas()
+
+    await llm_cache.aset(key, content, CHAT_MODEL, 'route')
+    return parse_persona_selection(content)
+
+
+def reply_options():
+    """Cached replies are only sound when the completion is deterministic"""
+    return {"temperature": 0} if settings.LLM_CACHE_REPLIES else {}
+
+
+def reply_cache_key(persona_name, messages):
+    return llm_cache.cache_key(CHAT_MODEL, messages, persona=persona_name)
+
+
+async def aget_single_response(persona_name, conversation_history):
+    persona = AI_PERSONAS[persona_name]
+    messages = persona_messages(persona_name, conversation_history)
+    key = reply_cache_key(persona_name, messages)
+    if settings.LLM_CACHE_REPLIES:
+        cached = await llm_cache.aget(key, 'reply')
+        if cached is not None:
+            return {"message": cached, "persona": persona}
+
+    try:
+        with instrument('reply', messages, persona=persona_name) as call, timing.span('llm'):
+            response = await async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                **reply_options(),
+            )
+            call.record_response(response)
+        ai_message = response.choices[0].message.content
+    except Exception as e:
+        print(f"OpenAI error for {persona_name}, using fallback response: {e}")
+        record_fallback('reply', persona_name)
+        return {"message": FALLBACK_RESPONSES.get(persona_name, "Interesting perspective!"), "persona": persona}
+
+    if settings.LLM_CACHE_REPLIES:
+        await llm_cache.aset(key, ai_message, CHAT_MODEL, 'reply')
+    return {"message": ai_message, "persona": persona}
+
+
+async def astream_single_response(persona_name, conversation_history):
+    """Yield content deltas of one persona's reply as the model produces them"""
+    messages = persona_messages(persona_name, conversation_history)
+    key = reply_cache_key(persona_name, messages)
+    if settings.LLM_CACHE_REPLIES:
+        cached = await llm_cache.aget(key, 'reply')
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    with instrument('reply', messages, persona=persona_name) as call:
+        with timing.span('llm'):
+            stream = await async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                stream=True,
+                # The last chunk reports the token usage
+                stream_options={"include_usage": True},
+                **reply_options(),
             )
-            ai_message = response.choices[0].message.content
+        async for chunk in timing.timed_chunks(stream):
+            call.record_chunk(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+    if settings.LLM_CACHE_REPLIES and parts:
+        await llm_cache.aset(key, ''.join(parts), CHAT_MODEL, 'reply')
+
+
+async def aiter_ai_responses(selected_personas, conversation_history, started=None):
+    """Yield persona responses in completion order while all requests run concurrently
+
+    `started` maps persona names to requests already in flight, which are reused.
+    """
+    started = started or {}
+    tasks = [
+        started.get(persona_name) or asyncio.ensure_future(aget_single_response(persona_name, conversation_history))
+        for persona_name in selected_personas if persona_name in AI_PERSONAS
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def aget_ai_responses(selected_personas, conversation_history):
+    return [response async for response in aiter_ai_responses(selected_personas, conversation_history)]
+
+
+def batch_format(persona_names):
+    return {"type": "json_schema", "json_schema": {
+        "name": "persona_replies",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {name: {"type": "string"} for name in persona_names},
+            "required": list(persona_names),
+            "additionalProperties": False,
+        }
+    }}
+
+
+def batch_messages(persona_names, conversation_history):
+    personas = "\n".join(f"- {name}: {AI_PERSONAS[name]['system_prompt']}" for name in persona_names)
+    return [
+        {"role": "system", "content": f"{BATCH_SYSTEM_PROMPT}\n\nPersonas:\n{personas}"},
+        *conversation_history,
+    ]
+
+
+def parse_batch(message_text, persona_names):
+    """The valid replies in a batch response, by persona; anything malformed is dropped"""
+    try:
+        parsed = json.loads(message_text)
+    except (TypeError, json.JSONDecodeError):
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {
+        name: parsed[name].strip() for name in persona_names
+        if isinstance(parsed.get(name), str) and parsed[name].strip()
+    }
+
+
+async def aiter_batched_responses(selected_personas, conversation_history):
+    """Replies for all personas from one structured request
+
+    Personas the batch did not answer validly get their own request, so a bad
+    batch costs one extra round trip rather than the replies.
+    """
+    persona_names = [name for name in selected_personas if name in AI_PERSONAS]
+    replies = {}
+    if len(persona_names) > 1:
+        messages = batch_messages(persona_names, conversation_history)
+        try:
+            with instrument('batch', messages) as call, timing.span('llm'):
+                response = await async_client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    response_format=batch_format(persona_names),
+                )
+                call.record_response(response)
+            replies = parse_batch(response.choices[0].message.content, persona_names)
         except Exception as e:
-            print(f"OpenAI error for {persona_name}, using fallback response: {e}")
-            # Fallback responses based on persona type
-            fallback_responses = {
-                "logic_master": "Let's analyze this logically. What evidence supports this claim?",
-                "storyteller": "This reminds me of an old tale where...",
-                "critic": "I have to disagree with several points here.",
-                "optimist": "Great point! I see lots of potential here.",
-                "troll": "LOL, seriously? 🙄",
-                "angry_person": "This is absolutely ridiculous!",
-                "diplomat": "Perhaps we can find some middle ground here.",
-                "redditor": "This. So much this. Take my upvote!",
-                "expert_in_everything": "Actually, studies show that...",
-                "phd_student": "According to recent literature...",
-                "unemployed_student": "Honestly, I don't know much about this but..."
-            }
-            ai_message = fallback_responses.get(persona_name, "Interesting perspective!")
-        
-        return {"message": ai_message, "persona": persona}
-    
-    # Use ThreadPoolExecutor for concurrent API calls
-    responses = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(selected_personas), 5)) as executor:
-        future_to_persona = {executor.submit(get_single_response, persona): persona 
-                           for persona in selected_personas}
-        
-        for future in concurrent.futures.as_completed(future_to_persona):
-            try:
-                response = future.result()
-                responses.append(response)
-            except Exception as exc:
-                persona_name = future_to_persona[future]
-                print(f'Persona {persona_name} generated an exception: {exc}')
-    
-    return responses
+            print(f"OpenAI error for batched replies, falling back to one request per persona: {e}")
+
+    for name in persona_names:
+        if name in replies:
+            yield {"message": replies[name], "persona": AI_PERSONAS[name]}
+    missing = [name for name in persona_names if name not in replies]
+    if len(persona_names) > 1 and missing:
+        metrics.increment('llm_batch_fallbacks_total', len(missing))
+    async for response in aiter_ai_responses(missing, conversation_history):
+        yield response
+
+
+def summary_messages(previous, replies):
+    earlier = f"Summary so far: {previous}\n\n" if previous else ""
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": earlier + "New replies:\n" + "\n".join(reply['content'] for reply in replies)},
+    ]
+
+
+async def asummarize(previous, replies):
+    """`previous` summary extended with the rendered `replies`, or None if the request failed"""
+    messages = summary_messages(previous, replies)
+    try:
+        with instrument('summary', messages) as call, timing.span('llm'):
+            response = await async_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0,
+                max_tokens=settings.AI_SUMMARY_MAX_TOKENS,
+            )
+            call.record_response(response)
+        return response.choices[0].message.content.strip() or None
+    except Exception as e:
+        print(f"OpenAI error, keeping the previous thread summary: {e}")
+        record_fallback('summary')
+        return None
 
 
 def load_personas():
@@ -167,6 +356,7 @@ def load_personas():
             },
         )
         if created:
+            activity.user_created(user)
             print(f"✅ Created AI persona: {persona['username']}")
         else:
             print(f"⚡ Already exists: {persona['username']}")
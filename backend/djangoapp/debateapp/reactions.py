@@ -0,0 +1,103 @@
+"""Reaction toggles as single atomic statements.
+
+A toggle first deletes the user's reaction of the same type (clicking again
+removes it). If there was none, it switches a reaction of the other type in
+place with an UPDATE, or else inserts one with INSERT ... ON CONFLICT DO
+NOTHING. Which statement changed a row says what happened. Each statement is
+atomic on its own, so concurrent clicks never trip the unique constraints,
+and the stored counters move exactly once per change. Uses RETURNING (SQLite
+3.35+, PostgreSQL).
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import activity
+from .models import Comment, Post, Reaction, User
+
+REACTION_TYPES = ('like', 'dislike')
+
+
+class InvalidReaction(Exception):
+    pass
+
+
+def _as_datetime(value):
+    """Datetimes come back from raw SQLite cursors as naive UTC strings"""
+    if not isinstance(value, datetime):
+        value = parse_datetime(value)
+    return value if timezone.is_aware(value) else timezone.make_aware(value, dt_timezone.utc)
+
+
+def _switch_or_insert(cursor, table, target, column, target_id, user_id, reaction_type):
+    """Switch the user's reaction of the other type to `reaction_type`, or insert one
+
+    Returns (action, added, removed, reacted_at). A concurrent toggle can insert
+    between the two statements; the loop then takes another look.
+    """
+    other = next(other for other in REACTION_TYPES if other != reaction_type)
+    quote = connection.ops.quote_name
+    for _ in range(2):
+        cursor.execute(
+            f"UPDATE {table} SET type = %s WHERE {column} = %s AND created_by_id = %s AND type = %s RETURNING created_at",
+            [reaction_type, target_id, user_id, other],
+        )
+        row = cursor.fetchone()
+        if row:
+            return 'updated', reaction_type, other, _as_datetime(row[0])
+
+        now = timezone.now()
+        created_at = Reaction._meta.get_field('created_at').get_db_prep_save(now, connection)
+        cursor.execute(
+            f"INSERT INTO {table} (type, created_by_id, created_at, post_id, comment_id) "
+            f"SELECT %s, %s, %s, %s, %s "
+            f"WHERE EXISTS (SELECT 1 FROM {quote(target._meta.db_table)} WHERE id = %s) "
+            f"AND EXISTS (SELECT 1 FROM {quote(User._meta.db_table)} WHERE id = %s) "
+            f"ON CONFLICT (created_by_id, {column}) DO NOTHING "
+            f"RETURNING id",
+            [reaction_type, user_id, created_at, *((target_id, None) if column == 'post_id' else (None, target_id)),
+             target_id, user_id],
+        )
+        if cursor.fetchone():
+            return 'created', reaction_type, None, now
+
+        existing = Reaction.objects.filter(**{column: target_id}, created_by_id=user_id).values_list('type', flat=True).first()
+        if existing is None:
+            raise InvalidReaction(f'Unknown {target.__name__.lower()} or user')
+        if existing == reaction_type:
+            return 'unchanged', None, None, None
+    return 'unchanged', None, None, None
+
+
+def toggle(user_id, reaction_type, post_id=None, comment_id=None):
+    """Toggle `user_id`'s reaction on a post or comment; returns (action, counts)
+
+    `action` is created, updated, removed, or unchanged when a concurrent
+    identical toggle got there first. `counts` holds the target's like_count
+    and dislike_count afterwards. Call inside a transaction so the counters
+    move with the reaction.
+    """
+    if reaction_type not in REACTION_TYPES:
+        raise InvalidReaction('Invalid reaction type')
+    if not (post_id or comment_id):
+        raise InvalidReaction('Post ID or Comment ID required')
+    target, column, target_id = (Post, 'post_id', post_id) if post_id else (Comment, 'comment_id', comment_id)
+
+    quote = connection.ops.quote_name
+    table = quote(Reaction._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE {column} = %s AND created_by_id = %s AND type = %s RETURNING created_at",
+            [target_id, user_id, reaction_type],
+        )
+        row = cursor.fetchone()
+        if row:
+            action, added, removed, reacted_at = 'removed', None, reaction_type, _as_datetime(row[0])
+        else:
+            action, added, removed, reacted_at = _switch_or_insert(cursor, table, target, column, target_id, user_id, reaction_type)
+
+    activity.reaction_changed(post_id, comment_id, added=added, removed=removed, reacted_at=reacted_at)
+    counts = target.objects.filter(pk=target_id).values('like_count', 'dislike_count').get()
+    return action, counts
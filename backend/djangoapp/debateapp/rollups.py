@@ -0,0 +1,121 @@
+"""Rollup tables behind the statistics dashboard.
+
+The activity hooks bump per-day totals (DailyActivity), record who took part
+each day (DailyParticipant) and bump per-topic hourly counts
+(HourlyTopicActivity) as content is written, so dashboard statistics read a
+handful of small rows instead of counting the content tables. Days and hours
+are in the project time zone.
+
+`statistics_snapshot()` caches the computed statistics for
+STATISTICS_CACHE_TTL seconds, so polling the dashboard costs one cache read.
+Run `manage.py rebuild_rollups` after importing data outside the API.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from . import upsert
+from .models import Comment, DailyActivity, DailyParticipant, HourlyTopicActivity, Post, User
+
+SNAPSHOT_KEY = 'statistics:snapshot'
+WINDOW = timedelta(days=7)
+
+
+def day_of(at):
+    return timezone.localdate(at)
+
+
+def hour_of(at):
+    return timezone.localtime(at).replace(minute=0, second=0, microsecond=0)
+
+
+def record_participant(user_id, at):
+    if upsert.insert_missing(DailyParticipant, {'date': day_of(at), 'user_id': user_id}):
+        upsert.increment(DailyActivity, {'date': day_of(at)}, participants=1)
+
+
+def record_post(post):
+    upsert.increment(DailyActivity, {'date': day_of(post.created_at)}, posts=1)
+    upsert.increment(HourlyTopicActivity, {'hour': hour_of(post.created_at), 'topic_id': post.topic_id}, posts=1)
+    record_participant(post.created_by_id, post.created_at)
+
+
+def record_comment(comment):
+    # Writers validate the post, so it is normally already loaded
+    upsert.increment(DailyActivity, {'date': day_of(comment.created_at)}, comments=1)
+    upsert.increment(HourlyTopicActivity, {'hour': hour_of(comment.created_at), 'topic_id': comment.post.topic_id}, comments=1)
+    record_participant(comment.created_by_id, comment.created_at)
+
+
+def record_user(user):
+    upsert.increment(DailyActivity, {'date': day_of(user.join_date)}, users=1)
+
+
+def statistics():
+    """Dashboard statistics computed from the rollups"""
+    now = timezone.now()
+    week_ago = now - WINDOW
+    totals = DailyActivity.objects.aggregate(posts=Sum('posts'), comments=Sum('comments'), users=Sum('users'))
+    today = DailyActivity.objects.filter(date=day_of(now)).first() or DailyActivity()
+    trending_topics = (
+        HourlyTopicActivity.objects.filter(hour__gte=hour_of(week_ago))
+        .values('topic_id', 'topic__name')
+        .annotate(recent_posts=Sum('posts'))
+        .filter(recent_posts__gt=0)
+        .order_by('-recent_posts', 'topic_id')[:5]
+    )
+    return {
+        'total_posts': totals['posts'] or 0,
+        'total_users': totals['users'] or 0,
+        'total_comments': totals['comments'] or 0,
+        # A range count on post_updated_idx, bounded by recent activity rather than history
+        'active_debates': Post.objects.filter(updated_at__gte=week_ago).count(),
+        'participants_today': today.participants,
+        'new_posts_today': today.posts,
+        'trending_topics': [
+            {'id': row['topic_id'], 'name': row['topic__name'], 'recent_posts': row['recent_posts']}
+            for row in trending_topics
+        ],
+    }
+
+
+def statistics_snapshot():
+    return cache.get_or_set(SNAPSHOT_KEY, statistics, settings.STATISTICS_CACHE_TTL)
+
+
+def rebuild():
+    """Recompute every rollup from the content tables; returns the number of days covered"""
+    daily = defaultdict(lambda: defaultdict(int))
+    hourly = defaultdict(lambda: defaultdict(int))
+    participants = set()
+
+    for field, model, topic in (('posts', Post, 'topic_id'), ('comments', Comment, 'post__topic_id')):
+        rows = model.objects.filter(created_at__isnull=False)
+        for row in rows.annotate(day=TruncDate('created_at')).values('day').annotate(total=Count('pk')):
+            daily[row['day']][field] += row['total']
+        for row in rows.annotate(hour=TruncHour('created_at')).values('hour', topic).annotate(total=Count('pk')):
+            hourly[row['hour'], row[topic]][field] += row['total']
+        participants.update(rows.annotate(day=TruncDate('created_at')).values_list('day', 'created_by_id').distinct())
+
+    for row in User.objects.annotate(day=TruncDate('join_date')).values('day').annotate(total=Count('pk')):
+        daily[row['day']]['users'] += row['total']
+    for day, _ in participants:
+        daily[day]['participants'] += 1
+
+    with transaction.atomic():
+        DailyActivity.objects.all().delete()
+        DailyParticipant.objects.all().delete()
+        HourlyTopicActivity.objects.all().delete()
+        DailyActivity.objects.bulk_create([DailyActivity(date=day, **counts) for day, counts in daily.items()])
+        DailyParticipant.objects.bulk_create([DailyParticipant(date=day, user_id=user_id) for day, user_id in participants])
+        HourlyTopicActivity.objects.bulk_create([
+            HourlyTopicActivity(hour=hour, topic_id=topic_id, **counts) for (hour, topic_id), counts in hourly.items()
+        ])
+    cache.delete(SNAPSHOT_KEY)
+    return len(daily)
@@ -0,0 +1,176 @@
+"""Full-text search over posts and topics.
+
+SEARCH_BACKEND picks the implementation: `fts5` keeps SQLite FTS5 indexes in
+sync from the activity hooks and ranks matches with bm25; `basic` is a plain
+icontains scan for databases without FTS5; `auto` (the default) uses fts5 on
+SQLite. A dotted class path plugs in another backend.
+
+Every term of a query must match, as a word prefix. Backends return
+(rank, id) hits, best first, and continue after a given hit, so views can
+page through results with a keyset cursor.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Comment, Post, Topic, User
+
+TERM_RE = re.compile(r"\w+")
+MAX_TERMS = 8
+
+
+def query_terms(query):
+    return TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+class BasicSearch:
+    """Substring scan, newest first; every hit ranks the same"""
+
+    def search_posts(self, query, limit, after=None, topic_id=None):
+        posts = Post.objects.filter(
+            Q(content__icontains=query) |
+            Q(topic__name__icontains=query) |
+            Q(created_by__name__icontains=query)
+        )
+        if topic_id:
+            posts = posts.filter(topic_id=topic_id)
+        if after:
+            posts = posts.filter(id__lt=after[1])
+        return [(0, post_id) for post_id in posts.order_by('-id').values_list('id', flat=True)[:limit]]
+
+    def search_topics(self, query, limit, after=None):
+        topics = Topic.objects.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        if after:
+            topics = topics.filter(id__lt=after[1])
+        return [(0, topic_id) for topic_id in topics.order_by('-id').values_list('id', flat=True)[:limit]]
+
+    def index_post(self, post):
+        pass
+
+    def index_comment(self, comment):
+        pass
+
+    def index_topic(self, topic):
+        pass
+
+    def index_author(self, user):
+        pass
+
+    def rebuild(self):
+        return {}
+
+
+class FTS5Search:
+    """SQLite FTS5 tables (created by migration 0009), ranked with bm25"""
+
+    post_table = 'debateapp_post_search'
+    topic_table = 'debateapp_topic_search'
+    # Column weights: content, topic, author, comments, topic_id (unindexed)
+    post_weights = '4.0, 2.0, 2.0, 1.0, 0.0'
+    topic_weights = '3.0, 1.0'
+
+    def match_expression(self, query):
+        return ' '.join(f'"{term}"*' for term in query_terms(query))
+
+    def ranked(self, table, weights, query, limit, after, condition='', params=()):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        sql = (
+            f"SELECT rank, id FROM ("
+            f"SELECT bm25({table}, {weights}) AS rank, rowid AS id FROM {table} WHERE {table} MATCH %s{condition}"
+            f")"
+        )
+        args = [expression, *params]
+        if after:
+            sql += " WHERE rank > %s OR (rank = %s AND id > %s)"
+            args += [after[0], after[0], after[1]]
+        sql += " ORDER BY rank, id LIMIT %s"
+        with connection.cursor() as cursor:
+            # A negative LIMIT is no limit in SQLite
+            cursor.execute(sql, args + [-1 if limit is None else limit])
+            return cursor.fetchall()
+
+    def search_posts(self, query, limit, after=None, topic_id=None):
+        if topic_id:
+            return self.ranked(self.post_table, self.post_weights, query, limit, after, ' AND topic_id = %s', [int(topic_id)])
+        return self.ranked(self.post_table, self.post_weights, query, limit, after)
+
+    def search_topics(self, query, limit, after=None):
+        return self.ranked(self.topic_table, self.topic_weights, query, limit, after)
+
+    def post_rows(self, where=''):
+        return (
+            f"INSERT INTO {self.post_table} (rowid, content, topic, author, comments, topic_id) "
+            f"SELECT p.id, p.content, t.name, u.name, "
+            f"COALESCE((SELECT group_concat(c.content, ' ') FROM {Comment._meta.db_table} c WHERE c.post_id = p.id), ''), "
+            f"p.topic_id "
+            f"FROM {Post._meta.db_table} p "
+            f"JOIN {Topic._meta.db_table} t ON t.id = p.topic_id "
+            f"JOIN {User._meta.db_table} u ON u.id = p.created_by_id{where}"
+        )
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.post_table} WHERE rowid = %s", [post.pk])
+            cursor.execute(self.post_rows(' WHERE p.id = %s'), [post.pk])
+
+    def index_comment(self, comment):
+        # Append rather than re-read every comment of the post
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {self.post_table} SET comments = comments || ' ' || %s WHERE rowid = %s",
+                [comment.content, comment.post_id],
+            )
+
+    def index_topic(self, topic):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.topic_table} WHERE rowid = %s", [topic.pk])
+            cursor.execute(
+                f"INSERT INTO {self.topic_table} (rowid, name, description) VALUES (%s, %s, %s)",
+                [topic.pk, topic.name, topic.description or ''],
+            )
+            cursor.execute(f"UPDATE {self.post_table} SET topic = %s WHERE topic_id = %s", [topic.name, topic.pk])
+
+    def index_author(self, user):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {self.post_table} SET author = %s "
+                f"WHERE rowid IN (SELECT id FROM {Post._meta.db_table} WHERE created_by_id = %s)",
+                [user.name, user.pk],
+            )
+
+    def rebuild(self):
+        """Re-index everything; returns the number of rows indexed per table"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.post_table}")
+            cursor.execute(self.post_rows())
+            cursor.execute(f"DELETE FROM {self.topic_table}")
+            cursor.execute(
+                f"INSERT INTO {self.topic_table} (rowid, name, description) "
+                f"SELECT id, name, COALESCE(description, '') FROM {Topic._meta.db_table}"
+            )
+            cursor.execute(f"INSERT INTO {self.post_table} ({self.post_table}) VALUES ('optimize')")
+            cursor.execute(f"INSERT INTO {self.topic_table} ({self.topic_table}) VALUES ('optimize')")
+            counts = {}
+            for table in (self.post_table, self.topic_table):
+                cursor.execute(f"SELECT count(*) FROM {table}")
+                counts[table] = cursor.fetchone()[0]
+        return counts
+
+
+SEARCH_BACKENDS = {
+    'fts5': FTS5Search,
+    'basic': BasicSearch,
+}
+
+
+def get_backend():
+    name = settings.SEARCH_BACKEND
+    if name == 'auto':
+        name = 'fts5' if connection.vendor == 'sqlite' else 'basic'
+    backend_class = SEARCH_BACKENDS.get(name) or import_string(name)
+    return backend_class()
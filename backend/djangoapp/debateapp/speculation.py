@@ -0,0 +1,117 @@
+"""Speculative persona generation, overlapping the router's decision.
+
+While the router decides, up to AI_SPECULATION_BUDGET personas predicted from
+the message and the thread's recent speakers start generating. Personas the
+router confirms keep their head start; the others are cancelled. Streamed
+generations buffer their deltas until they are confirmed.
+
+Metrics: `speculative_generations_total{outcome=confirmed|wasted}`, plus
+`speculation_saved_seconds_total` (generation time confirmed personas had
+before the decision) and `speculation_wasted_seconds_total` (generation time
+spent on cancelled ones).
+"""
+import asyncio
+import time
+
+from django.conf import settings
+
+from . import metrics, persona_router
+from .personas import AI_PERSONAS, aget_single_response, astream_single_response
+
+DONE = object()
+
+
+def predict(user_message, conversation_history, budget):
+    """The `budget` personas most likely to be routed to: best local scores, then recent AI speakers"""
+    scores = persona_router.score_personas(user_message, conversation_history)
+    predicted = [name for name, score in sorted(scores.items(), key=lambda item: item[1], reverse=True) if score > 0]
+    for message in reversed(conversation_history):
+        author = message["content"].split(":", 1)[0].lower()
+        name = persona_router.persona_by_username().get(author)
+        if name and name not in predicted:
+            predicted.append(name)
+    return [name for name in predicted if name in AI_PERSONAS][:budget]
+
+
+class Generation:
+    """One persona's reply, started before we know whether it is wanted"""
+
+    def __init__(self, persona_name, conversation_history, streaming):
+        self.started = time.monotonic()
+        self.finished = None
+        if streaming:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.ensure_future(self.stream(persona_name, conversation_history))
+        else:
+            self.task = asyncio.ensure_future(self.complete(persona_name, conversation_history))
+
+    async def stream(self, persona_name, conversation_history):
+        try:
+            async for delta in astream_single_response(persona_name, conversation_history):
+                self.queue.put_nowait(delta)
+            self.queue.put_nowait(DONE)
+        except Exception as e:
+            self.queue.put_nowait(e)
+        finally:
+            self.finished = time.monotonic()
+
+    async def complete(self, persona_name, conversation_history):
+        try:
+            return await aget_single_response(persona_name, conversation_history)
+        finally:
+            self.finished = time.monotonic()
+
+    async def deltas(self):
+        """Replay the buffered deltas, then follow the live stream"""
+        while True:
+            item = await self.queue.get()
+            if item is DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def runtime(self, until):
+        return (self.finished or until) - self.started
+
+
+class Speculation:
+    def __init__(self, personas, conversation_history):
+        self.generations = {
+            name: Generation(name, conversation_history, settings.AI_STREAMING) for name in personas
+        }
+
+    @classmethod
+    def start(cls, user_message, conversation_history):
+        """Start speculating, or return None when it cannot help"""
+        budget = settings.AI_SPECULATION_BUDGET
+        # The local router decides in microseconds, so there is no wait to overlap,
+        # and batched generation does not use per-persona requests
+        if budget <= 0 or settings.PERSONA_ROUTER == 'local' or settings.AI_GENERATION == 'batched':
+            return None
+        personas = predict(user_message, conversation_history, budget)
+        return cls(personas, conversation_history) if personas else None
+
+    def confirm(self, selected_personas):
+        """Keep the generations the router chose and cancel the rest"""
+        decided = time.monotonic()
+        for name, generation in list(self.generations.items()):
+            head_start = generation.runtime(decided)
+            if name in selected_personas:
+                metrics.increment('speculative_generations_total', outcome='confirmed')
+                metrics.increment('speculation_saved_seconds_total', head_start)
+            else:
+                generation.task.cancel()
+                del self.generations[name]
+                metrics.increment('speculative_generations_total', outcome='wasted')
+                metrics.increment('speculation_wasted_seconds_total', head_start)
+
+    def streams(self):
+        return {name: generation.deltas() for name, generation in self.generations.items()}
+
+    def responses(self):
+        return {name: generation.task for name, generation in self.generations.items()}
+
+    def cancel(self):
+        for generation in self.generations.values():
+            generation.task.cancel()
@@ -0,0 +1,98 @@
+"""Rolling thread summaries, so long threads send a bounded prompt.
+
+The AI_SUMMARY_RECENT_TURNS most recent comments are always sent verbatim.
+Once AI_SUMMARY_EVERY more have built up behind them, or those comments pass
+AI_SUMMARY_TOKEN_THRESHOLD estimated tokens, one LLM call folds them into the
+post's ThreadSummary, extending the previous summary rather than re-reading
+the thread. Prompts then carry the summary plus the comments after it (see
+conversation.build_context), however long the thread gets. Refreshes run at
+the end of an AI round, once its replies have been emitted; a failed refresh
+keeps the old summary and is retried by the next round.
+"""
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from . import conversation, metrics
+from .models import Comment, ThreadSummary
+from .personas import asummarize
+
+# conversation.estimate_tokens of the shortest possible entry
+MIN_ENTRY_TOKENS = 4
+
+
+def entries(comments):
+    """Render `comments` as (comment id, tokens, message) history entries"""
+    for comment in comments:
+        message = conversation.render(comment.created_by, comment.content)
+        yield comment.pk, conversation.estimate_tokens(message['content']), message
+
+
+def batch(candidates):
+    """The oldest `candidates` that fit in one refresh, at most AI_CONTEXT_TOKEN_BUDGET tokens"""
+    taken, budget = [], settings.AI_CONTEXT_TOKEN_BUDGET
+    for entry in candidates:
+        if taken and entry[1] > budget:
+            break
+        budget -= entry[1]
+        taken.append(entry)
+    return taken
+
+
+def pending(post):
+    """The post's stored summary and the uncovered comments to fold into it now, oldest first
+
+    The comments come from the database rather than the cached prompt window,
+    which only holds the latest ones. They are counted first, so a round with
+    nothing due reads no rows, and only the batch being folded is rendered; a
+    thread that was long before it had a summary catches up over a few rounds.
+    """
+    thread_summary = ThreadSummary.objects.filter(post_id=post.pk).first()
+    comments = Comment.objects.filter(post_id=post.pk)
+    if thread_summary:
+        comments = comments.filter(id__gt=thread_summary.last_comment_id)
+    older = comments.count() - settings.AI_SUMMARY_RECENT_TURNS
+    if older <= 0:
+        return thread_summary, []
+    comments = comments.select_related('created_by').order_by('id')
+    if older < settings.AI_SUMMARY_EVERY:
+        # Fewer than AI_SUMMARY_EVERY + AI_SUMMARY_RECENT_TURNS rows; due only if they pass the token threshold
+        uncovered = list(entries(comments))
+        if sum(entry[1] for entry in uncovered) < settings.AI_SUMMARY_TOKEN_THRESHOLD:
+            return thread_summary, []
+        return thread_summary, batch(uncovered[:older])
+    # Every entry is at least MIN_ENTRY_TOKENS, so no more rows than this can fit in one batch
+    limit = min(older, max(settings.AI_CONTEXT_TOKEN_BUDGET // MIN_ENTRY_TOKENS, 1))
+    return thread_summary, batch(entries(comments[:limit].iterator(chunk_size=100)))
+
+
+def save(post, previous, content, entries):
+    """Store `previous` extended with `entries`, unless another refresh changed the summary meanwhile"""
+    current = ThreadSummary.objects.filter(post_id=post.pk).first()
+    if (current and current.last_comment_id) != (previous and previous.last_comment_id):
+        conversation.remember_summary(post, current or False)
+        return None
+    thread_summary, _ = ThreadSummary.objects.update_or_create(post_id=post.pk, defaults={
+        'content': content,
+        'last_comment_id': entries[-1][0],
+        'comment_count': (previous.comment_count if previous else 0) + len(entries),
+        'source_tokens': (previous.source_tokens if previous else 0) + sum(entry[1] for entry in entries),
+    })
+    conversation.remember_summary(post, thread_summary)
+    return thread_summary
+
+
+async def arefresh(post):
+    """Fold the post's older comments into its summary when due; returns the new summary or None"""
+    if not settings.AI_SUMMARY_ENABLED:
+        return None
+    previous, older = await database_sync_to_async(pending)(post)
+    if not older:
+        return None
+    content = await asummarize(previous.content if previous else None, [message for _, _, message in older])
+    if content is None:
+        return None
+    thread_summary = await database_sync_to_async(save)(post, previous, content, older)
+    if thread_summary is None:
+        return None
+    metrics.increment('thread_summary_refreshes_total')
+    return thread_summary
@@ -1,3 +1,1731 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import F, Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openai import AsyncOpenAI
+from rest_framework.test import APIClient
+
+try:
+    import lupa  # noqa: F401  (fakeredis needs it for the Lua scripts channels_redis runs)
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+
+from djangoapp.caches import build_caches
+from djangoapp.channel_layers import build_channel_layers
+
+from .activity import repair_counters
+from .consumers import ChatConsumer
+from .fake_llm import FakeAsyncLLM, FakeOpenAIServer
+from . import activity, llm_cache, metrics, reactions, rollups, summaries, timing, topic_activity, trending, view_tracking
+from .conversation import build_context, estimate_tokens
+from . import jobs
+from .jobs import AIJobPool, aenqueue_ai_round, claim_job, claim_next_job, enqueue_ai_round, run_job
+from .ai_replies import PostBroadcast, post_group, run_ai_round, topic_group
+from .persona_router import aroute, local_route
+from .speculation import predict
+from .personas import achoose_persona_ai, aget_single_response, load_personas, parse_batch
+from .models import (
+    AIJob, Bookmark, Comment, DailyParticipant, Post, PostView, Reaction, ThreadSummary, Topic, TrendingScore, User
+)
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTestCase(TestCase):
+    """Requests, WebSocket messages and AI jobs over their QUERY_BUDGETS fail the test"""
+
+
+class FeedQueryCountTests(QueryBudgetTestCase):
+    """The feed endpoints must not issue per-post queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.viewer = User.objects.create(id=1, name="You", type="human")
+        self.other = User.objects.create(name="Alex", type="human")
+        self.topics = [Topic.objects.create(name=f"Topic {i}") for i in range(3)]
+
+    def add_posts(self, count):
+        posts = []
+        for i in range(count):
+            post = Post.objects.create(content=f"Post {i}", created_by=self.other, topic=self.topics[i % 3])
+            Reaction.objects.create(post=post, created_by=self.viewer, type='like' if i % 2 else 'dislike')
+            Reaction.objects.create(post=post, created_by=self.other, type='like')
+            Comment.objects.create(post=post, created_by=self.other, content="Reply")
+            Bookmark.objects.create(post=post, user=self.viewer)
+            posts.append(post)
+        repair_counters()
+        return posts
+
+    def count_queries(self, url):
+        # Topic activity scores are cached; count the cold case
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.add_posts(3)
+        small = self.count_queries(url)
+        self.add_posts(12)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+
+    def test_get_posts(self):
+        for sort in ('latest', 'popular', 'controversial'):
+            with self.subTest(sort=sort):
+                Post.objects.all().delete()
+                self.assert_constant_queries(f'/api/posts/?sort={sort}')
+
+    def test_trending_posts(self):
+        self.assert_constant_queries('/api/posts/trending/')
+
+    def test_users_posts(self):
+        self.assert_constant_queries(f'/api/user/{self.other.id}/posts/')
+
+    def test_user_bookmarks(self):
+        self.assert_constant_queries(f'/api/user/{self.viewer.id}/bookmarks/')
+
+    def test_batched_values_match_per_post_values(self):
+        post = self.add_posts(2)[1]
+        data = self.client.get('/api/posts/').json()
+        row = next(item for item in data if item['id'] == post.id)
+        self.assertEqual(row['like_count'], 2)
+        self.assertEqual(row['dislike_count'], 0)
+        self.assertEqual(row['comment_count'], 1)
+        self.assertEqual(row['topic_detail']['post_count'], 1)
+        self.assertEqual(row['topic_detail']['activity_score'], post.topic.activity_score)
+        self.assertEqual(row['user_reaction'], 'like')
+        self.assertTrue(row['is_liked'])
+        self.assertFalse(row['is_disliked'])
+
+    def test_compact_shape_side_loads_authors_and_topics_once(self):
+        self.add_posts(6)
+        full = self.client.get('/api/posts/')
+        compact = self.client.get('/api/posts/', {'shape': 'compact'})
+        data = compact.json()
+        self.assertEqual(set(data), {'posts', 'users', 'topics'})
+        self.assertEqual(list(data['users']), [str(self.other.id)])
+        self.assertEqual(sorted(data['topics']), sorted(str(topic.id) for topic in self.topics))
+        self.assertLess(len(compact.content), len(full.content))
+
+        for full_row, row in zip(full.json(), data['posts']):
+            self.assertEqual(row['created_by'], full_row['created_by_detail']['id'])
+            self.assertEqual(data['topics'][str(row['topic'])], full_row['topic_detail'])
+            del full_row['created_by_detail'], full_row['topic_detail'], row['created_by'], row['topic']
+            self.assertEqual(row, full_row)
+
+        bookmarks = self.client.get(f'/api/user/{self.viewer.id}/bookmarks/', {'shape': 'compact'}).json()
+        self.assertEqual(set(bookmarks), {'bookmarks', 'users', 'topics'})
+        self.assertEqual(bookmarks['bookmarks'][0]['post_detail']['created_by'], self.other.id)
+
+    def test_compact_shapes_keep_constant_queries(self):
+        for url in ('/api/posts/', '/api/posts/trending/', f'/api/user/{self.viewer.id}/bookmarks/'):
+            with self.subTest(url=url):
+                self.assert_constant_queries(f'{url}?shape=compact')
+
+    def test_sparse_fields_skip_the_lookups_they_do_not_need(self):
+        self.add_posts(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/', {'shape': 'compact', 'fields': 'content,like_count'})
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(set(response.json()), {'posts'})
+        self.assertEqual({tuple(sorted(row)) for row in response.json()['posts']}, {('content', 'id', 'like_count')})
+
+        rows = self.client.get('/api/posts/', {'fields': 'topic_detail,user_reaction'}).json()
+        self.assertEqual(set(rows[0]), {'id', 'topic_detail', 'user_reaction'})
+        self.assertIn(rows[0]['user_reaction'], ('like', 'dislike'))
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class TopicActivityTests(QueryBudgetTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topics = [Topic.objects.create(name=f"Transit {i}") for i in range(3)]
+        for topic in self.topics:
+            activity.topic_created(topic)
+
+    def create_post(self, topic):
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            response = self.client.post('/api/post/create/', {
+                'content': "Trams", 'created_by': self.user.id, 'topic': topic.id,
+            }, format='json')
+        return response.json()['id']
+
+    def list_topics(self, url='/api/topics/', **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row for row in response.json()}, len(queries)
+
+    def test_listing_is_one_query_once_scores_are_cached(self):
+        old = Post.objects.create(content="Old", created_by=self.user, topic=self.topics[1])
+        Post.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(days=8))
+        for _ in range(2):
+            Comment.objects.create(post=old, created_by=self.user, content="Still going")
+
+        topics, cold = self.list_topics()
+        self.assertEqual(cold, 2)
+        self.assertEqual(topics[self.topics[1].id]['activity_score'], 1.0)
+        self.assertEqual(topics[self.topics[0].id]['activity_score'], 0)
+        _, warm = self.list_topics()
+        self.assertEqual(warm, 1)
+
+        Topic.objects.bulk_create([Topic(name=f"More {i}") for i in range(10)])
+        cache.clear()
+        _, more = self.list_topics()
+        self.assertEqual(more, cold)
+
+    def test_writes_refresh_their_topic_score(self):
+        self.list_topics()
+        post_id = self.create_post(self.topics[0])
+        topics, _ = self.list_topics()
+        self.assertEqual(topics[self.topics[0].id]['activity_score'], 1)
+        self.assertEqual(topics[self.topics[0].id]['post_count'], 1)
+
+        self.client.post('/api/comment/create/', {
+            'content': "Buses", 'post': post_id, 'created_by': self.user.id,
+        }, format='json')
+        topics, _ = self.list_topics(url='/api/topics/search/', q='transit')
+        self.assertEqual(topics[self.topics[0].id]['activity_score'], 1.5)
+
+        # Moving the post (and its comment with it) refreshes both topics
+        self.client.put(f'/api/post/{post_id}/', {
+            'content': "Trams", 'created_by': self.user.id, 'topic': self.topics[2].id,
+        }, format='json')
+        topics, _ = self.list_topics()
+        self.assertEqual(topics[self.topics[0].id]['activity_score'], 0)
+        self.assertEqual(topics[self.topics[2].id]['activity_score'], 1.5)
+
+class CursorPaginationTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        self.posts = [Post.objects.create(content=f"Post {i}", created_by=self.author, topic=self.topic) for i in range(7)]
+        for i, post in enumerate(self.posts):
+            for j in range(i % 3):
+                voter = User.objects.create(name=f"Voter {i}-{j}")
+                Reaction.objects.create(post=post, created_by=voter, type='like' if j else 'dislike')
+        repair_counters()
+
+    def walk(self, url, **params):
+        ids, cursor = [], None
+        while True:
+            response = self.client.get(url, {**params, 'page_size': 2, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()), 2)
+            ids.extend(row['id'] for row in response.json())
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                return ids
+
+    def test_pages_cover_every_sort_once(self):
+        for sort in ('latest', 'popular', 'controversial'):
+            with self.subTest(sort=sort):
+                full = [row['id'] for row in self.client.get('/api/posts/', {'sort': sort}).json()]
+                self.assertEqual(self.walk('/api/posts/', sort=sort), full)
+                self.assertEqual(sorted(full), sorted(post.id for post in self.posts))
+
+    def test_comment_pages_are_chronological(self):
+        post = self.posts[0]
+        comments = [Comment.objects.create(post=post, created_by=self.author, content=str(i)) for i in range(5)]
+        self.assertEqual(self.walk(f'/api/post/{post.id}/comments/'), [comment.id for comment in comments])
+
+    def test_cursor_is_bound_to_its_ordering(self):
+        cursor = self.client.get('/api/posts/', {'page_size': 2}).get('X-Next-Cursor')
+        response = self.client.get('/api/posts/', {'sort': 'popular', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/posts/', {'cursor': 'not-a-cursor'})
+        self.assertEqual((response.status_code, response.json()), (400, {'cursor': ['Invalid cursor']}))
+
+    @override_settings(API_PAGE_SIZE=2)
+    def test_lists_are_only_paginated_on_request(self):
+        post = self.posts[0]
+        comments = [Comment.objects.create(post=post, created_by=self.author, content=str(i)) for i in range(5)]
+        response = self.client.get(f'/api/post/{post.id}/comments/')
+        self.assertEqual([row['id'] for row in response.json()], [comment.id for comment in comments])
+        self.assertNotIn('X-Next-Cursor', response)
+
+        response = self.client.get('/api/posts/')
+        self.assertEqual(len(response.json()), len(self.posts))
+        self.assertNotIn('X-Next-Cursor', response)
+        self.assertEqual(len(self.client.get('/api/posts/', {'page_size': ''}).json()), 2)
+
+
+class CommentThreadTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.post = Post.objects.create(content="Threads", created_by=self.user, topic=Topic.objects.create(name="Topic"))
+        self.first = self.reply(None, "First")
+        self.second = self.reply(None, "Second")
+
+    def reply(self, parent, content):
+        return Comment.objects.create(post=self.post, parent=parent, created_by=self.user, content=content)
+
+    def chain(self, parent, length):
+        for i in range(length):
+            parent = self.reply(parent, f"Level {i + 1}")
+        return parent
+
+    def thread(self, **params):
+        response = self.client.get(f'/api/post/{self.post.id}/thread/', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_replies_are_nested_with_counts_one_level_past_the_depth(self):
+        answer = self.reply(self.first, "Answer")
+        self.reply(self.first, "Another answer")
+        self.chain(answer, 4)
+        Reaction.objects.create(comment=answer, created_by=self.user, type='like')
+
+        first, second = self.thread(depth=2).json()
+        self.assertEqual((first['id'], second['id']), (self.first.id, self.second.id))
+        # Both answers and Level 1 below the first are returned; Level 2 is only counted as a reply
+        self.assertEqual((first['depth'], first['reply_count'], first['loaded_descendant_count']), (0, 2, 3))
+        self.assertEqual([node['content'] for node in first['replies']], ["Answer", "Another answer"])
+        node = first['replies'][0]
+        self.assertEqual((node['depth'], node['reply_count'], node['loaded_descendant_count']), (1, 1, 1))
+        self.assertEqual(node['user_reaction'], 'like')
+        # Below the depth limit the counts tell the client there is more to load
+        leaf = node['replies'][0]
+        self.assertEqual((leaf['depth'], leaf['reply_count'], leaf['loaded_descendant_count'], leaf['replies']), (2, 1, 0, []))
+        self.assertEqual((second['reply_count'], second['replies']), (0, []))
+
+        subtree = self.thread(parent=leaf['id'], depth=10).json()
+        self.assertEqual([node['content'] for node in subtree], ["Level 2"])
+        self.assertEqual([child['content'] for child in subtree[0]['replies']], ["Level 3"])
+
+    def test_deep_threads_load_in_constant_queries(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.thread(depth=100)
+            return len(queries)
+
+        self.chain(self.first, 2)
+        shallow = count_queries()
+        self.chain(self.chain(self.second, 30), 5)
+        self.assertEqual(count_queries(), shallow)
+
+        # A shallow page only walks one level past what it returns
+        first, second = self.thread(depth=1).json()
+        self.assertEqual((second['reply_count'], second['loaded_descendant_count']), (1, 1))
+        self.assertEqual((second['replies'][0]['reply_count'], second['replies'][0]['loaded_descendant_count']), (1, 0))
+
+        with override_settings(THREAD_MAX_DEPTH=10):
+            first, second = self.thread(depth=100).json()
+        self.assertEqual(second['loaded_descendant_count'], 10)
+
+    def test_roots_are_paginated(self):
+        self.reply(self.first, "Answer")
+        response = self.thread(page_size=1)
+        self.assertEqual([node['id'] for node in response.json()], [self.first.id])
+        self.assertEqual(response.json()[0]['replies'][0]['content'], "Answer")
+        response = self.thread(page_size=1, cursor=response['X-Next-Cursor'])
+        self.assertEqual([node['id'] for node in response.json()], [self.second.id])
+        self.assertIsNone(response.get('X-Next-Cursor'))
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class SearchTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.cyclist = User.objects.create(name="Velo", type="human")
+        self.transport = self.create_topic("Transport", "Getting around cities")
+        self.food = self.create_topic("Food", "Cooking and eating")
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            self.lanes = self.create_post("Protected bicycle lanes make cities safer", self.transport)
+            self.buses = self.create_post("Buses beat trams on cost", self.transport)
+            self.bread = self.create_post("Sourdough is worth the effort", self.food, author=self.cyclist)
+            self.client.post('/api/comment/create/', {
+                'content': "Only if you bake near a bicycle shop", 'post': self.bread, 'created_by': self.user.id,
+            }, format='json')
+
+    def create_topic(self, name, description):
+        return self.client.post('/api/topic/create/', {'name': name, 'description': description}, format='json').json()['id']
+
+    def create_post(self, content, topic, author=None):
+        return self.client.post('/api/post/create/', {
+            'content': content, 'created_by': (author or self.user).id, 'topic': topic,
+        }, format='json').json()['id']
+
+    def search(self, query, **params):
+        return [post['id'] for post in self.client.get('/api/posts/', {'search': query, **params}).json()]
+
+    def test_prefix_matches_are_ranked_by_relevance(self):
+        # "bicycl" prefixes "bicycle"; a match in the content outranks one in a comment
+        self.assertEqual(self.search("bicycl"), [self.lanes, self.bread])
+        self.assertEqual(self.search("bicycl", topic=self.food), [self.bread])
+        self.assertEqual(self.search("Velo"), [self.bread])
+        self.assertEqual(self.search("transport cost"), [self.buses])
+        self.assertEqual(self.search("!!!"), [])
+
+    def test_results_page_with_a_cursor(self):
+        first = self.client.get('/api/posts/', {'search': "bicycl", 'page_size': 1})
+        second = self.client.get('/api/posts/', {'search': "bicycl", 'page_size': 1, 'cursor': first['X-Next-Cursor']})
+        self.assertEqual([post['id'] for post in first.json() + second.json()], [self.lanes, self.bread])
+        self.assertNotIn('X-Next-Cursor', second)
+
+    def test_topics_and_renames_stay_in_sync(self):
+        topics = self.client.get('/api/topics/search/', {'q': "cook"}).json()
+        self.assertEqual([topic['id'] for topic in topics], [self.food])
+
+        self.client.put(f'/api/user/{self.cyclist.id}/', {'name': "Baker", 'type': "human"}, format='json')
+        self.assertEqual(self.search("baker"), [self.bread])
+        self.assertEqual(self.search("velo"), [])
+
+    def test_rebuild_indexes_rows_written_outside_the_hooks(self):
+        post = Post.objects.create(content="Congestion pricing works", created_by=self.user, topic_id=self.transport)
+        self.assertEqual(self.search("congestion"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search("congestion"), [post.id])
+
+    @override_settings(SEARCH_BACKEND='basic')
+    def test_basic_backend_scans_without_fts(self):
+        self.assertEqual(self.search("bicycle"), [self.lanes])
+        self.assertEqual([topic['name'] for topic in self.client.get('/api/topics/search/', {'q': "Food"}).json()], ["Food"])
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class CounterTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            response = self.client.post('/api/post/create/', {
+                'content': "Counters", 'created_by': self.user.id, 'topic': self.topic.id,
+            }, format='json')
+        self.post = Post.objects.get(pk=response.json()['id'])
+
+    def toggle(self, reaction_type):
+        return self.client.post('/api/reaction/toggle/', {'type': reaction_type, 'post_id': self.post.id}, format='json').json()
+
+    def test_writers_keep_counters_current(self):
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.post_count, 1)
+
+        self.assertEqual(self.toggle('like')['action'], 'created')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (1, 0))
+
+        self.assertEqual(self.toggle('dislike')['action'], 'updated')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (0, 1))
+
+        self.assertEqual(self.toggle('dislike')['action'], 'removed')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (0, 0))
+
+        self.client.post('/api/comment/create/', {
+            'content': "Reply", 'post': self.post.id, 'created_by': self.user.id,
+        }, format='json')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_repair_counters_fixes_drift(self):
+        Comment.objects.create(post=self.post, created_by=self.user, content="Untracked")
+        Post.objects.filter(pk=self.post.pk).update(like_count=5)
+
+        self.assertEqual(repair_counters(dry_run=True), {'Post': 1, 'Comment': 0, 'Topic': 0})
+        repair_counters()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (0, 1))
+        self.assertEqual(repair_counters(dry_run=True), {'Post': 0, 'Comment': 0, 'Topic': 0})
+
+
+class ReactionTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.other = User.objects.create(name="Other", type="human")
+        self.post = Post.objects.create(content="React", created_by=self.user, topic=Topic.objects.create(name="Topic"))
+        self.comment = Comment.objects.create(post=self.post, created_by=self.other, content="Reply")
+
+    def toggle(self, **data):
+        return self.client.post('/api/reaction/toggle/', data, format='json')
+
+    def assertCountersMatchReactions(self):
+        for target in (Post.objects.get(pk=self.post.pk), Comment.objects.get(pk=self.comment.pk)):
+            reactions = target.reactions.all()
+            self.assertEqual(
+                (target.like_count, target.dislike_count),
+                (reactions.filter(type='like').count(), reactions.filter(type='dislike').count()),
+            )
+
+    def test_toggle_is_single_statements_and_returns_counts(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.toggle(type='like', post_id=self.post.id)
+        self.assertEqual(response.json(), {'action': 'created', 'type': 'like', 'like_count': 1, 'dislike_count': 0})
+        # The same-type delete, the switch from the other type, then the insert
+        statements = [query['sql'] for query in queries if 'debateapp_reaction' in query['sql']]
+        self.assertEqual([sql.split()[0] for sql in statements], ['DELETE', 'UPDATE', 'INSERT'])
+        self.assertIn('ON CONFLICT', statements[2])
+
+        self.assertEqual(self.toggle(type='dislike', post_id=self.post.id, user_id=self.other.id).json()['dislike_count'], 1)
+        self.assertEqual(self.toggle(type='dislike', post_id=self.post.id).json(),
+                         {'action': 'updated', 'type': 'dislike', 'like_count': 0, 'dislike_count': 2})
+        self.assertEqual(self.toggle(type='dislike', post_id=self.post.id).json(),
+                         {'action': 'removed', 'type': 'dislike', 'like_count': 0, 'dislike_count': 1})
+        self.assertEqual(self.toggle(type='like', comment_id=self.comment.id).json()['like_count'], 1)
+
+        self.assertEqual(self.toggle(type='like', post_id=9999).status_code, 400)
+        self.assertEqual(self.toggle(type='love', post_id=self.post.id).status_code, 400)
+        self.assertEqual(Reaction.objects.count(), 2)
+        self.assertCountersMatchReactions()
+
+    def test_switch_is_told_from_insert_without_comparing_timestamps(self):
+        # A switch in the same instant as the original reaction is still a switch
+        with mock.patch('debateapp.reactions.timezone.now', return_value=timezone.now()):
+            self.toggle(type='like', post_id=self.post.id)
+            response = self.toggle(type='dislike', post_id=self.post.id)
+        self.assertEqual(response.json(), {'action': 'updated', 'type': 'dislike', 'like_count': 0, 'dislike_count': 1})
+        self.assertCountersMatchReactions()
+
+    def test_bulk_toggles_apply_in_order_and_skip_bad_ones(self):
+        response = self.client.post('/api/reaction/bulk/', {'toggles': [
+            {'type': 'like', 'post_id': self.post.id},
+            {'type': 'like', 'post_id': 9999},
+            {'type': 'dislike', 'post_id': self.post.id},
+            {'type': 'like', 'comment_id': self.comment.id, 'user_id': self.other.id},
+            "not a toggle",
+        ]}, format='json')
+        self.assertEqual([result.get('action', 'error') for result in response.json()['results']],
+                         ['created', 'error', 'updated', 'created', 'error'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (0, 1))
+        self.assertCountersMatchReactions()
+
+        with override_settings(REACTION_BULK_MAX=2):
+            response = self.client.post('/api/reaction/bulk/', {'toggles': [{}] * 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_toggle_reports_database_errors_per_toggle(self):
+        original = reactions.toggle
+
+        def toggle(user_id, reaction_type, post_id=None, comment_id=None):
+            if comment_id:
+                raise IntegrityError("CHECK constraint failed: reaction_target")
+            return original(user_id, reaction_type, post_id, comment_id)
+
+        with mock.patch('debateapp.reactions.toggle', toggle):
+            response = self.client.post('/api/reaction/bulk/', {'toggles': [
+                {'type': 'like', 'post_id': self.post.id},
+                {'type': 'like', 'comment_id': self.comment.id},
+                {'type': 'like', 'post_id': {'id': 1}},
+                {'type': 'dislike', 'post_id': self.post.id},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result.get('action') for result in results], ['created', None, None, 'updated'])
+        self.assertEqual(results[1], {'error': "CHECK constraint failed: reaction_target"})
+        self.assertIn('error', results[2])
+        self.assertCountersMatchReactions()
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class TrendingTests(QueryBudgetTestCase):
+    def setUp(self):
+        trending.forget_landmark()
+        patcher = mock.patch.object(view_tracking, 'buffer', view_tracking.ViewBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.users = [User.objects.create(id=i, name=f"User {i}", type="human") for i in range(1, 5)]
+        self.topic = Topic.objects.create(name="Topic")
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            self.quiet, self.busy = [
+                self.client.post('/api/post/create/', {
+                    'content': content, 'created_by': 1, 'topic': self.topic.id,
+                }, format='json').json()['id']
+                for content in ("Quiet", "Busy")
+            ]
+
+    def react(self, post_id, user_id, reaction_type='like'):
+        self.client.post('/api/reaction/toggle/', {'type': reaction_type, 'post_id': post_id, 'user_id': user_id}, format='json')
+
+    def score(self, post_id):
+        return TrendingScore.objects.get(post_id=post_id).score
+
+    def test_engagement_ranks_posts_with_exact_counts(self):
+        for user in self.users[:3]:
+            self.react(self.busy, user.id)
+        for content in ("One", "Two"):
+            self.client.post('/api/comment/create/', {'content': content, 'post': self.busy, 'created_by': 1}, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            posts = self.client.get('/api/posts/trending/').json()
+        # The top-N read, then the viewer's bookmarks and reactions for the whole page
+        self.assertEqual(len(queries), 3)
+        self.assertEqual([post['id'] for post in posts], [self.busy, self.quiet])
+        self.assertEqual((posts[0]['like_count'], posts[0]['comment_count']), (3, 2))
+
+    def test_repeat_views_and_removed_reactions_do_not_count(self):
+        before = self.score(self.quiet)
+        for _ in range(3):
+            self.client.get(f'/api/post/{self.quiet}/', REMOTE_ADDR='10.0.0.1')
+        view_tracking.buffer.flush()
+        self.assertAlmostEqual(self.score(self.quiet), before + trending.WEIGHTS['view'], places=3)
+
+        self.react(self.quiet, 2)
+        self.react(self.quiet, 2)
+        self.assertAlmostEqual(self.score(self.quiet), before + trending.WEIGHTS['view'], places=3)
+
+    def test_old_engagement_decays_and_compaction_keeps_order(self):
+        now = timezone.now()
+        two_days_ago = now - timedelta(hours=48)
+        for _ in range(3):
+            trending.record(self.quiet, 'like', two_days_ago)
+        trending.record(self.busy, 'like', now)
+        ranked = [post.id for post in trending.top_posts(10)]
+        self.assertEqual(ranked, [self.busy, self.quiet])
+
+        trending.compact(now + timedelta(hours=24))
+        self.assertEqual([post.id for post in trending.top_posts(10)], ranked)
+        self.assertAlmostEqual(self.score(self.busy), (1 + trending.WEIGHTS['post']) / 2, places=2)
+
+        call_command('compact_trending', stdout=StringIO())
+        trending.compact(now + timedelta(days=30))
+        self.assertEqual(list(trending.top_posts(10)), [])
+
+        # The likes above were recorded directly, so a rebuild only sees the posts being created
+        call_command('compact_trending', '--rebuild', stdout=StringIO())
+        self.assertAlmostEqual(self.score(self.quiet), trending.WEIGHTS['post'], places=3)
+
+
+class ViewTrackingTests(QueryBudgetTestCase):
+    def setUp(self):
+        user = User.objects.create(id=1, name="You", type="human")
+        self.post = Post.objects.create(content="Viewed", created_by=user, topic=Topic.objects.create(name="Topic"))
+        self.client = APIClient()
+        patcher = mock.patch.object(view_tracking, 'buffer', view_tracking.ViewBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, address, **params):
+        return self.client.get(f'/api/post/{self.post.id}/', params, REMOTE_ADDR=address).json()
+
+    def test_reads_are_read_only_and_views_are_flushed_deduplicated(self):
+        with CaptureQueriesContext(connection) as queries:
+            for address in ('10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.1'):
+                self.view(address)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+
+        self.assertEqual(view_tracking.buffer.flush(), 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.view_count, 2)
+        self.assertAlmostEqual(TrendingScore.objects.get(post=self.post).score, 2 * trending.WEIGHTS['view'], places=3)
+        self.assertNotIn('unique_viewers', self.view('10.0.0.3'))
+        self.assertEqual(self.view('10.0.0.3', include='unique_viewers')['unique_viewers'], 2)
+
+        self.view('10.0.0.2')
+        self.assertEqual(view_tracking.buffer.flush(), 1)
+        self.assertEqual(view_tracking.buffer.flush(), 0)
+
+    @override_settings(VIEW_UNIQUE_COUNTING='hll')
+    def test_hll_counts_viewers_without_a_row_per_viewer(self):
+        for address in ('10.0.0.1', '10.0.0.2'):
+            self.view(address)
+        view_tracking.buffer.flush()
+        # The second flush merges into the stored sketch
+        self.view('10.0.0.3')
+        view_tracking.buffer.flush()
+        self.assertEqual(self.view('10.0.0.4', include='unique_viewers')['unique_viewers'], 3)
+        self.assertFalse(PostView.objects.exists())
+
+        sketch = view_tracking.HyperLogLog()
+        for i in range(20000):
+            sketch.add(f'10.{i // 256}.{i % 256}.1')
+        half = view_tracking.HyperLogLog()
+        for i in range(10000):
+            half.add(f'10.{i // 256}.{i % 256}.1')
+        half.merge(sketch)
+        self.assertAlmostEqual(sketch.count(), 20000, delta=1000)
+        self.assertEqual(half.count(), sketch.count())
+
+
+class TimingTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        self.client = APIClient()
+
+    def test_server_timing_header_counts_queries_and_serializer_time(self):
+        Post.objects.create(content="Timed", created_by=self.user, topic=self.topic)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/')
+        header = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries)} queries"', header)
+        self.assertIn('serializer;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    def test_going_over_a_query_budget_fails(self):
+        with override_settings(QUERY_BUDGETS={'get_topics': 0}):
+            with self.assertRaisesMessage(timing.QueryBudgetExceeded, 'over the budget of 0 for get_topics'):
+                self.client.get('/api/topics/')
+            with override_settings(QUERY_BUDGET_ENFORCE=False), mock.patch('builtins.print') as printed:
+                self.assertEqual(self.client.get('/api/topics/').status_code, 200)
+        self.assertIn('over the budget', printed.call_args.args[0])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_log_their_repeated_statements(self):
+        with timing.collect() as timings:
+            for _ in range(3):
+                list(Topic.objects.filter(pk=self.topic.pk))
+            with timing.span('llm'):
+                pass
+        self.assertEqual(timings.queries, 3)
+        self.assertIn('llm;dur=', timings.server_timing())
+        with mock.patch('builtins.print') as printed:
+            timing.report('GET /slow/', None, timings)
+        lines = [call.args[0] for call in printed.call_args_list]
+        self.assertTrue(lines[0].startswith('Slow request GET /slow/: db;dur='))
+        self.assertTrue(lines[1].startswith('  3x SELECT'))
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class StatisticsTests(QueryBudgetTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.guest = User.objects.create(name="Guest", type="human")
+        activity.user_created(self.guest)
+        self.cities = Topic.objects.create(name="Cities")
+        self.food = Topic.objects.create(name="Food")
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            for content, topic in (("Trams", self.cities), ("Buses", self.cities), ("Bread", self.food)):
+                post = self.client.post('/api/post/create/', {
+                    'content': content, 'created_by': self.user.id, 'topic': topic.id,
+                }, format='json').json()
+            self.client.post('/api/comment/create/', {
+                'content': "Rye", 'post': post['id'], 'created_by': self.guest.id,
+            }, format='json')
+
+    def test_dashboard_reads_rollups_and_caches_the_snapshot(self):
+        stats = self.client.get('/api/statistics/').json()
+        self.assertEqual(
+            {key: stats[key] for key in ('total_posts', 'total_comments', 'total_users', 'participants_today', 'new_posts_today')},
+            # User 1 was created outside the API, so only the guest counts until a rebuild
+            {'total_posts': 3, 'total_comments': 1, 'total_users': 1, 'participants_today': 2, 'new_posts_today': 3},
+        )
+        self.assertEqual(stats['active_debates'], 3)
+        self.assertEqual(stats['trending_topics'], [
+            {'id': self.cities.id, 'name': "Cities", 'recent_posts': 2},
+            {'id': self.food.id, 'name': "Food", 'recent_posts': 1},
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/statistics/').json(), stats)
+        self.assertEqual(len(queries), 0)
+
+    def test_rebuild_matches_the_hooks_and_counts_unhooked_rows(self):
+        hooked = rollups.statistics()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(rollups.statistics(), {**hooked, 'total_users': 2})
+        self.assertEqual(DailyParticipant.objects.count(), 2)
+
+
+class ConversationContextTests(QueryBudgetTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.ai_user = User.objects.create(name="Critic", type="ai")
+        self.topic = Topic.objects.create(name="Topic")
+        Post.objects.create(content="Older post", created_by=self.user, topic=self.topic)
+        self.post = Post.objects.create(content="Opening", created_by=self.user, topic=self.topic)
+
+    def test_new_comments_are_appended_without_rereading_the_thread(self):
+        for i in range(30):
+            Comment.objects.create(post=self.post, created_by=self.ai_user, content=f"Point {i}")
+        self.assertEqual(len(build_context(self.post)), 32)
+
+        Comment.objects.create(post=self.post, created_by=self.user, content="Latest")
+        # One query for the new comments, one for the topic context
+        with self.assertNumQueries(2):
+            messages = build_context(self.post)
+        self.assertEqual(messages[0], {"role": "system", "content": "Recent topic discussion - You: Older post"})
+        self.assertEqual(messages[1], {"role": "user", "content": "You: Opening"})
+        self.assertEqual(messages[-2:], [
+            {"role": "assistant", "content": "Critic: Point 29"},
+            {"role": "user", "content": "You: Latest"},
+        ])
+
+    @override_settings(AI_CONTEXT_TOKEN_BUDGET=200)
+    def test_oldest_comments_are_dropped_to_fit_the_budget(self):
+        for i in range(20):
+            Comment.objects.create(post=self.post, created_by=self.ai_user, content=f"{i} " + "x" * 200)
+        messages = build_context(self.post)
+
+        self.assertLessEqual(sum(estimate_tokens(message['content']) for message in messages), 200)
+        self.assertEqual(messages[1]['content'], "You: Opening")
+        self.assertTrue(messages[-1]['content'].startswith("Critic: 19 "))
+        self.assertLess(len(messages), 10)
+
+    def test_editing_the_post_refreshes_the_cached_history(self):
+        build_context(self.post)
+        response = APIClient().put(f'/api/post/{self.post.id}/', {
+            'content': "Edited", 'created_by': self.user.id, 'topic': self.topic.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(build_context(self.post)[1]['content'], "You: Edited")
+
+
+@override_settings(AI_SUMMARY_RECENT_TURNS=4, AI_SUMMARY_EVERY=6, AI_SUMMARY_TOKEN_THRESHOLD=1000)
+class ThreadSummaryTests(QueryBudgetTestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.ai_user = User.objects.create(name="Critic", type="ai")
+        self.topic = Topic.objects.create(name="Topic")
+        self.post = Post.objects.create(content="Opening", created_by=self.user, topic=self.topic)
+
+    def add_comments(self, count):
+        start = Comment.objects.filter(post=self.post).count()
+        return [
+            Comment.objects.create(post=self.post, created_by=self.ai_user, content=f"Point {i}")
+            for i in range(start, start + count)
+        ]
+
+    def refresh(self, fake=None):
+        fake = fake or FakeAsyncLLM()
+        with mock.patch('debateapp.personas.async_client', fake):
+            return async_to_sync(summaries.arefresh)(self.post), fake
+
+    def test_nothing_is_summarized_until_enough_comments_build_up(self):
+        self.add_comments(9)
+        thread_summary, fake = self.refresh()
+        self.assertIsNone(thread_summary)
+        self.assertEqual(fake.calls, 0)
+
+        comments = self.add_comments(1)
+        thread_summary, fake = self.refresh()
+        self.assertEqual(fake.calls, 1)
+        self.assertEqual((thread_summary.comment_count, thread_summary.last_comment_id), (6, comments[0].id - 4))
+        self.assertEqual(metrics.value('thread_summary_refreshes_total'), 1)
+        self.assertEqual(metrics.value('llm_requests_total', purpose='summary'), 1)
+
+    def test_prompt_sends_the_summary_and_the_comments_after_it(self):
+        self.add_comments(10)
+        self.refresh()
+        full_thread = sum(estimate_tokens(f"Critic: Point {i}") for i in range(10))
+
+        messages = build_context(self.post)
+        self.assertEqual(messages[0], {"role": "user", "content": "You: Opening"})
+        self.assertEqual(messages[1]['role'], "system")
+        self.assertTrue(messages[1]['content'].startswith("Summary of the 6 earlier replies: "))
+        self.assertEqual([message['content'] for message in messages[2:]], [f"Critic: Point {i}" for i in range(6, 10)])
+
+        sent = sum(estimate_tokens(message['content']) for message in messages)
+        self.assertEqual(metrics.value('conversation_context_tokens_total'), sent)
+        summarized = sum(estimate_tokens(f"Critic: Point {i}") for i in range(6))
+        saved = summarized - estimate_tokens(messages[1]['content'])
+        self.assertEqual(metrics.value('conversation_summary_saved_tokens_total'), max(saved, 0))
+        self.assertLessEqual(sent - estimate_tokens("You: Opening"), full_thread)
+
+    def test_refresh_extends_the_previous_summary_with_the_new_comments_only(self):
+        self.add_comments(10)
+        first, _ = self.refresh()
+        self.add_comments(6)
+
+        requests = []
+        fake = FakeAsyncLLM()
+        fake.reply_for = lambda messages: requests.append(messages) or "Both sides restated"
+        second, _ = self.refresh(fake)
+
+        prompt = requests[0][1]['content']
+        self.assertTrue(prompt.startswith(f"Summary so far: {first.content}"))
+        self.assertNotIn("Point 5", prompt)
+        self.assertIn("Critic: Point 6\nCritic: Point 7", prompt)
+        self.assertEqual((second.content, second.comment_count), ("Both sides restated", 12))
+        self.assertEqual(ThreadSummary.objects.get(post=self.post).comment_count, 12)
+        self.assertIn("Both sides restated", build_context(self.post)[1]['content'])
+
+    @override_settings(AI_SUMMARY_TOKEN_THRESHOLD=200)
+    def test_long_comments_are_summarized_before_the_count_is_reached(self):
+        for i in range(6):
+            Comment.objects.create(post=self.post, created_by=self.user, content=f"{i} " + "x" * 200)
+        thread_summary, _ = self.refresh()
+        self.assertEqual(thread_summary.comment_count, 2)
+
+    @override_settings(AI_CONTEXT_TOKEN_BUDGET=300)
+    def test_comments_outside_the_prompt_window_are_still_summarized(self):
+        for i in range(12):
+            Comment.objects.create(post=self.post, created_by=self.ai_user, content=f"{i} " + "x" * 100)
+        self.assertFalse(build_context(self.post)[1]['content'].startswith("Critic: 0 "))
+
+        requests = []
+        fake = FakeAsyncLLM()
+        fake.reply_for = lambda messages: requests.append(messages) or "Long thread"
+        thread_summary, _ = self.refresh(fake)
+        self.assertEqual(thread_summary.comment_count, 8)
+        self.assertIn("Critic: 0 ", requests[0][1]['content'])
+
+    def test_rounds_with_nothing_due_only_count_the_uncovered_comments(self):
+        self.add_comments(4)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(summaries.pending(self.post), (None, []))
+        self.assertEqual(len(queries), 2)
+        self.assertIn("COUNT(", queries[1]['sql'])
+
+    @override_settings(AI_CONTEXT_TOKEN_BUDGET=100)
+    def test_long_unsummarized_threads_read_only_the_batch_they_fold(self):
+        self.add_comments(60)
+        with CaptureQueriesContext(connection) as queries:
+            _, entries = summaries.pending(self.post)
+        self.assertEqual(len(queries), 3)
+        self.assertIn("LIMIT 25", queries[2]['sql'])
+        self.assertEqual([entry[2]['content'] for entry in entries], [f"Critic: Point {i}" for i in range(len(entries))])
+        self.assertLessEqual(sum(entry[1] for entry in entries), 100)
+
+    def test_refresh_does_not_overwrite_a_summary_saved_meanwhile(self):
+        self.add_comments(10)
+        previous, entries = summaries.pending(self.post)
+        ThreadSummary.objects.create(post=self.post, content="Concurrent", last_comment_id=entries[5][0], comment_count=6)
+        self.assertIsNone(summaries.save(self.post, previous, "Stale", entries[:6]))
+        self.assertEqual(ThreadSummary.objects.get(post=self.post).content, "Concurrent")
+        self.assertIn("Concurrent", build_context(self.post)[1]['content'])
+
+    def test_failed_refresh_keeps_the_previous_summary(self):
+        self.add_comments(10)
+        first, _ = self.refresh()
+        self.add_comments(6)
+
+        fake = FakeAsyncLLM()
+        fake.chat.completions.create = mock.AsyncMock(side_effect=RuntimeError("down"))
+        self.assertIsNone(self.refresh(fake)[0])
+        self.assertEqual(ThreadSummary.objects.get(post=self.post).last_comment_id, first.last_comment_id)
+        self.assertEqual(metrics.value('llm_fallbacks_total', purpose='summary'), 1)
+
+    @override_settings(AI_JOBS_EAGER=True, PERSONA_ROUTER='llm', LLM_CACHE_ENABLED=False, AI_STREAMING=False)
+    def test_ai_round_refreshes_the_summary_once_its_replies_are_saved(self):
+        self.add_comments(8)
+        load_personas()
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM()):
+            job = APIClient().post(f'/api/post/{self.post.id}/trigger-ai/').json()['job']
+        self.assertEqual(job['status'], 'succeeded')
+        # 8 comments and the 2 replies, less the 4 most recent
+        self.assertEqual(ThreadSummary.objects.get(post=self.post).comment_count, 6)
+
+
+class LLMCacheTests(QueryBudgetTestCase):
+    history = [{"role": "user", "content": "You: Should we cache?"}]
+
+    def setUp(self):
+        llm_cache.memory.clear()
+        metrics.reset()
+
+    async def test_repeated_routing_is_served_from_cache(self):
+        fake = FakeAsyncLLM(personas=["critic"])
+        with mock.patch('debateapp.personas.async_client', fake):
+            self.assertEqual(await achoose_persona_ai("Should we cache?", self.history), ["critic"])
+            self.assertEqual(await achoose_persona_ai("Should we cache?", self.history), ["critic"])
+            self.assertEqual(fake.calls, 1)
+
+            # Another process (or a restart) still finds it in the database tier
+            llm_cache.memory.clear()
+            self.assertEqual(await achoose_persona_ai("Should we cache?", self.history), ["critic"])
+            self.assertEqual(fake.calls, 1)
+
+            await achoose_persona_ai("Something else", self.history)
+            self.assertEqual(fake.calls, 2)
+
+        self.assertEqual(metrics.value('llm_cache_hits_total', kind='route', tier='memory'), 1)
+        self.assertEqual(metrics.value('llm_cache_hits_total', kind='route', tier='db'), 1)
+        self.assertEqual(metrics.value('llm_cache_misses_total', kind='route'), 2)
+
+    async def test_replies_are_cached_only_when_enabled(self):
+        fake = FakeAsyncLLM()
+        with mock.patch('debateapp.personas.async_client', fake):
+            await aget_single_response("critic", self.history)
+            await aget_single_response("critic", self.history)
+            self.assertEqual(fake.calls, 2)
+
+            with override_settings(LLM_CACHE_REPLIES=True):
+                first = await aget_single_response("critic", self.history)
+                second = await aget_single_response("critic", self.history)
+            self.assertEqual(fake.calls, 3)
+            self.assertEqual(first, second)
+
+    @override_settings(LLM_CACHE_MAX_ENTRIES=2)
+    def test_memory_tier_evicts_least_recently_used_and_expired(self):
+        llm_cache.memory.set('a', "A", ttl=60)
+        llm_cache.memory.set('b', "B", ttl=60)
+        llm_cache.memory.get('a')
+        llm_cache.memory.set('c', "C", ttl=60)
+        self.assertEqual([llm_cache.memory.get(key) for key in 'abc'], ["A", None, "C"])
+
+        llm_cache.memory.set('d', "D", ttl=0)
+        self.assertIsNone(llm_cache.memory.get('d'))
+
+
+class PersonaRouterTests(QueryBudgetTestCase):
+    def test_local_router_matches_message_mentions_and_rotates_speakers(self):
+        self.assertEqual(local_route("Where is the evidence? That is a logical fallacy.", [])[0], ["logic_master"])
+        self.assertEqual(local_route("What would CitationWizard say?", [])[0], ["phd_student"])
+        self.assertEqual(local_route("Pineapple on pizza", []), ([], 0.0))
+
+        message = "Is there research or evidence for this?"
+        self.assertEqual(local_route(message, [])[0], ["phd_student", "logic_master"])
+        # CitationWizard just spoke, so the other voice leads
+        history = [{"role": "assistant", "content": "CitationWizard: I stand by what I said."}]
+        self.assertEqual(local_route(message, history)[0], ["logic_master", "phd_student"])
+
+    def test_local_router_is_sub_millisecond(self):
+        local_route("warm up", [])
+        history = [{"role": "user", "content": f"You: message {i} about evidence and stories"} for i in range(50)]
+        started = time.perf_counter()
+        for _ in range(200):
+            local_route("I hope research proves this will get better", history)
+        self.assertLess((time.perf_counter() - started) / 200, 0.001)
+
+    async def test_modes(self):
+        fake = FakeAsyncLLM(personas=["diplomat"])
+        with mock.patch('debateapp.personas.async_client', fake), override_settings(LLM_CACHE_ENABLED=False):
+            with override_settings(PERSONA_ROUTER='local'):
+                self.assertEqual(await aroute("lol seriously, whatever", []), ["troll"])
+            with override_settings(PERSONA_ROUTER='hybrid'):
+                self.assertEqual(await aroute("lol seriously, whatever", []), ["troll"])
+                self.assertEqual(fake.calls, 0)
+                # Nothing to go on locally, so the model decides
+                self.assertEqual(await aroute("Pineapple on pizza", []), ["diplomat"])
+            with override_settings(PERSONA_ROUTER='llm'):
+                self.assertEqual(await aroute("lol seriously, whatever", []), ["diplomat"])
+            self.assertEqual(fake.calls, 2)
+
+
+@override_settings(PERSONA_ROUTER='llm', LLM_CACHE_ENABLED=False, AI_SPECULATION_BUDGET=2)
+class SpeculationTests(QueryBudgetTestCase):
+    latency = 0.3
+
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.post = Post.objects.create(content="Cities should ban cars downtown", created_by=self.user,
+                                        topic=Topic.objects.create(name="Cities"))
+        load_personas()
+        Comment.objects.create(post=self.post, created_by=User.objects.get(name="SunnySide"), content="Agreed!")
+
+    def test_prediction_uses_message_then_recent_speakers(self):
+        history = [{"role": "assistant", "content": "SunnySide: Agreed!"}]
+        self.assertEqual(predict("That is flawed and wrong", history, 2), ["critic", "optimist"])
+        self.assertEqual(predict("Hmm", history, 2), ["optimist"])
+
+    async def round(self):
+        frames = []
+
+        async def emit(frame):
+            frames.append(frame)
+
+        started = time.monotonic()
+        comment_ids = await run_ai_round(self.post, "That is flawed and wrong", emit)
+        return time.monotonic() - started, comment_ids, frames
+
+    async def check_round(self):
+        # The router picks critic, which was predicted; the predicted optimist is wasted
+        fake = FakeAsyncLLM(latency=self.latency, personas=["critic"])
+        with mock.patch('debateapp.personas.async_client', fake):
+            elapsed, comment_ids, frames = await self.round()
+
+        self.assertEqual(len(comment_ids), 1)
+        reply = [frame for frame in frames if frame['type'] == 'post_reply'][0]
+        self.assertEqual(reply['created_by_detail']['name'], "RazorTongue")
+        self.assertTrue(reply['message'].startswith("Considered reply to:"))
+        # Routing and generation overlapped instead of taking two full round trips
+        self.assertLess(elapsed, self.latency * 1.8)
+        self.assertEqual(fake.calls, 3)
+        self.assertEqual(metrics.value('speculative_generations_total', outcome='confirmed'), 1)
+        self.assertEqual(metrics.value('speculative_generations_total', outcome='wasted'), 1)
+        self.assertGreater(metrics.value('speculation_saved_seconds_total'), self.latency * 0.8)
+        self.assertGreater(metrics.value('speculation_wasted_seconds_total'), 0)
+
+    @override_settings(AI_STREAMING=True)
+    async def test_confirmed_stream_keeps_its_head_start(self):
+        await self.check_round()
+
+    @override_settings(AI_STREAMING=False)
+    async def test_confirmed_completion_keeps_its_head_start(self):
+        await self.check_round()
+
+
+@override_settings(PERSONA_ROUTER='llm', LLM_CACHE_ENABLED=False, AI_STREAMING=False)
+class BatchedGenerationTests(QueryBudgetTestCase):
+    personas = ["critic", "diplomat", "optimist"]
+
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Cities")
+        self.post = Post.objects.create(content="Cities should ban cars downtown " * 20, created_by=self.user,
+                                        topic=self.topic)
+        load_personas()
+
+    def test_invalid_replies_are_dropped_per_persona(self):
+        content = json.dumps({"critic": "No.", "diplomat": "  ", "optimist": 3})
+        self.assertEqual(parse_batch(content, self.personas), {"critic": "No."})
+        self.assertEqual(parse_batch('{"critic": "tru', self.personas), {})
+        self.assertEqual(parse_batch('["critic"]', self.personas), {})
+
+    async def run_round(self, generation, fake):
+        async def emit(frame):
+            pass
+
+        metrics.reset()
+        with override_settings(AI_GENERATION=generation), mock.patch('debateapp.personas.async_client', fake):
+            comment_ids = await run_ai_round(self.post, "Who pays for the buses?", emit)
+        self.assertEqual(len(comment_ids), 3)
+        return {
+            purpose: (metrics.value('llm_requests_total', purpose=purpose),
+                      metrics.value('llm_prompt_bytes_total', purpose=purpose))
+            for purpose in ('reply', 'batch')
+        }
+
+    async def test_one_request_answers_for_every_persona(self):
+        per_persona = await self.run_round('per_persona', FakeAsyncLLM(personas=self.personas))
+        fake = FakeAsyncLLM(personas=self.personas)
+        batched = await self.run_round('batched', fake)
+
+        self.assertEqual(fake.calls, 2)
+        self.assertEqual(per_persona['reply'][0], 3)
+        self.assertEqual(batched, {'reply': (0, 0), 'batch': (1, batched['batch'][1])})
+        # The conversation is uploaded once instead of once per persona
+        self.assertLess(batched['batch'][1], per_persona['reply'][1])
+        self.assertEqual(
+            {comment.created_by.name async for comment in Comment.objects.filter(post=self.post).select_related('created_by')},
+            {"RazorTongue", "PeaceBroker", "SunnySide"},
+        )
+
+    async def test_malformed_batch_falls_back_to_per_persona_requests(self):
+        fake = FakeAsyncLLM(personas=self.personas, fail_batches=True)
+        requests = await self.run_round('batched', fake)
+        self.assertEqual(fake.calls, 5)
+        self.assertEqual(requests['reply'][0], 3)
+        self.assertEqual(metrics.value('llm_batch_fallbacks_total'), 3)
+
+
+
+@override_settings(AI_JOBS_EAGER=True, PERSONA_ROUTER='llm', LLM_CACHE_ENABLED=False, AI_STREAMING=True)
+class LLMTelemetryTests(QueryBudgetTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        load_personas()
+
+    def create_post(self, fake):
+        with mock.patch('debateapp.personas.async_client', fake):
+            response = self.client.post('/api/post/create/', {
+                'content': "Should cities ban cars?", 'created_by': self.user.id, 'topic': self.topic.id,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_requests_are_timed_and_counted_per_persona_and_entry_point(self):
+        self.create_post(FakeAsyncLLM(personas=["critic"]))
+
+        self.assertEqual(metrics.value('llm_requests_total', purpose='route', entry_point='rest'), 1)
+        self.assertEqual(metrics.value('llm_requests_total', purpose='reply', persona='critic', entry_point='rest'), 1)
+        self.assertGreater(metrics.value('llm_prompt_tokens_total', purpose='reply', persona='critic'), 0)
+        self.assertGreater(metrics.value('llm_completion_tokens_total', purpose='reply', persona='critic'), 0)
+        self.assertEqual(metrics.histogram('llm_request_duration_seconds', outcome='ok')[0], 2)
+        self.assertEqual(metrics.histogram('llm_time_to_first_token_seconds', persona='critic')[0], 1)
+        self.assertEqual(metrics.value('llm_requests_in_flight'), 0)
+
+        response = self.client.get('/api/metrics/')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE llm_request_duration_seconds histogram', body)
+        self.assertIn(
+            'llm_request_duration_seconds_bucket{entry_point="rest",outcome="ok",persona="critic",purpose="reply",le="+Inf"} 1',
+            body,
+        )
+        self.assertIn('llm_requests_total{entry_point="rest",purpose="route"} 1', body)
+
+    def test_errors_and_fallbacks_are_counted(self):
+        async def fail(**kwargs):
+            raise RuntimeError("upstream unavailable")
+
+        with mock.patch('debateapp.personas.fallback_personas', return_value=["critic"]):
+            self.create_post(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail))))
+
+        self.assertEqual(metrics.value('llm_errors_total', error='RuntimeError'), 3)
+        self.assertEqual(metrics.value('llm_fallbacks_total', purpose='route'), 1)
+        self.assertEqual(metrics.value('llm_fallbacks_total', purpose='stream', persona='critic'), 1)
+        self.assertEqual(metrics.value('llm_fallbacks_total', purpose='reply', persona='critic'), 1)
+        self.assertEqual(metrics.histogram('llm_request_duration_seconds', outcome='error')[0], 3)
+        self.assertEqual(Comment.objects.filter(post__content="Should cities ban cars?").count(), 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for seconds in (0.02, 0.3, 0.4, 100):
+            metrics.observe('probe_seconds', seconds, buckets=(0.1, 0.5), kind='x')
+        self.assertEqual(metrics.render().splitlines(), [
+            '# TYPE probe_seconds histogram',
+            'probe_seconds_bucket{kind="x",le="0.1"} 1',
+            'probe_seconds_bucket{kind="x",le="0.5"} 3',
+            'probe_seconds_bucket{kind="x",le="+Inf"} 4',
+            'probe_seconds_sum{kind="x"} 100.72',
+            'probe_seconds_count{kind="x"} 4',
+        ])
+
+@override_settings(AI_JOB_RETRY_DELAY=0, AI_JOB_POLL_INTERVAL=0.05)
+class AIJobQueueTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        self.post = Post.objects.create(content="Queue me", created_by=self.user, topic=self.topic)
+        load_personas()
+
+    def run_pool_until(self, done, timeout=10):
+        async def run():
+            pool = AIJobPool()
+            pool.start()
+            try:
+                deadline = time.monotonic() + timeout
+                while not await done():
+                    self.assertLess(time.monotonic(), deadline)
+                    await asyncio.sleep(0.05)
+            finally:
+                await pool.stop()
+        async_to_sync(run)()
+
+    def test_workers_run_queued_and_interrupted_jobs(self):
+        response = self.client.post('/api/post/create/', {
+            'content': "Bounded workers", 'created_by': self.user.id, 'topic': self.topic.id,
+        }, format='json')
+        queued = AIJob.objects.get(post_id=response.json()['id'])
+        self.assertEqual((queued.status, queued.source), ('queued', 'post'))
+        # A job whose worker died mid-run; its lease has lapsed
+        interrupted = AIJob.objects.create(
+            post=self.post, message=self.post.content, source='manual', status='running', attempts=1,
+            run_after=timezone.now(), lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        async def finished():
+            return not await AIJob.objects.exclude(status__in=['succeeded', 'failed']).aexists()
+
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=["critic"])):
+            self.run_pool_until(finished)
+
+        for job in (queued, interrupted):
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'succeeded')
+            self.assertEqual(Comment.objects.get(pk__in=job.result['comment_ids']).post_id, job.post_id)
+        self.assertEqual(interrupted.attempts, 2)
+
+    def test_running_job_with_live_lease_is_not_claimed(self):
+        AIJob.objects.create(
+            post=self.post, message="Busy", source='manual', status='running', attempts=1,
+            run_after=timezone.now(), lease_expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        self.assertIsNone(claim_next_job())
+
+    def run_slow_round(self, during, seconds=0.6):
+        """Run a claimed job whose round takes `seconds`, calling `during` halfway through"""
+        AIJob.objects.create(post=self.post, message="Slow", source='manual', run_after=timezone.now())
+        job = claim_job(Q(status='queued'))
+
+        async def slow_round(post, message, emit, answered, on_saved):
+            await asyncio.sleep(seconds)
+            await on_saved(SimpleNamespace(id=42, created_by=SimpleNamespace(name="Critic")))
+            return [42]
+
+        async def run():
+            with mock.patch('debateapp.jobs.run_ai_round', slow_round):
+                round_task = asyncio.ensure_future(run_job(job))
+                await asyncio.sleep(seconds / 2)
+                await database_sync_to_async(during)(job)
+                await round_task
+        async_to_sync(run)()
+        return AIJob.objects.get(pk=job.pk)
+
+    @override_settings(AI_JOB_LEASE_SECONDS=0.15)
+    def test_lease_is_renewed_while_the_round_runs(self):
+        def not_reclaimable(job):
+            self.assertIsNone(claim_next_job())
+        job = self.run_slow_round(not_reclaimable)
+        self.assertEqual((job.status, job.attempts), ('succeeded', 1))
+        self.assertEqual(job.result, {'comment_ids': [42], 'answered': ["Critic"]})
+
+    @override_settings(AI_JOB_LEASE_SECONDS=0.15)
+    def test_round_stops_once_another_worker_holds_the_job(self):
+        def reclaimed(job):
+            AIJob.objects.filter(pk=job.pk).update(attempts=F('attempts') + 1)
+        job = self.run_slow_round(reclaimed)
+        # The new owner records the outcome, not the worker that lost the lease
+        self.assertEqual((job.status, job.attempts, job.result), ('running', 2, {}))
+
+    @override_settings(AI_JOBS_EAGER=True)
+    def test_failed_job_is_retried_until_max_attempts(self):
+        with mock.patch('debateapp.jobs.run_ai_round', side_effect=[RuntimeError("flaky"), []]):
+            job = self.client.post(f'/api/post/{self.post.id}/trigger-ai/').json()['job']
+        self.assertEqual((job['status'], job['attempts'], job['result']), ('succeeded', 2, {'comment_ids': []}))
+
+        with mock.patch('debateapp.jobs.run_ai_round', side_effect=RuntimeError("down")):
+            job = self.client.post(f'/api/post/{self.post.id}/trigger-ai/').json()['job']
+        self.assertEqual((job['status'], job['attempts'], job['last_error']), ('failed', 3, "down"))
+
+    @override_settings(AI_JOBS_EAGER=True)
+    def test_retried_round_does_not_post_saved_replies_again(self):
+        original = PostBroadcast.__call__
+        failures = []
+
+        async def flaky_broadcast(broadcast, frame):
+            # The first reply is saved, then broadcasting it fails the round
+            if frame['type'] == 'post_reply' and not failures:
+                failures.append(frame['comment_id'])
+                raise ConnectionError("channel layer unavailable")
+            await original(broadcast, frame)
+
+        for streaming in (False, True):
+            with self.subTest(streaming=streaming), override_settings(AI_STREAMING=streaming), \
+                    mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=["logic_master", "critic"])), \
+                    mock.patch('debateapp.jobs.PostBroadcast.__call__', flaky_broadcast):
+                failures.clear()
+                Comment.objects.all().delete()
+                job = self.client.post(f'/api/post/{self.post.id}/trigger-ai/').json()['job']
+
+                comments = Comment.objects.filter(post=self.post)
+                self.assertEqual((job['status'], job['attempts']), ('succeeded', 2))
+                self.assertEqual(sorted(comment.created_by.name for comment in comments), ["ProfessorLogic", "RazorTongue"])
+                self.assertEqual(sorted(job['result']['comment_ids']), sorted(comment.id for comment in comments))
+                self.assertIn(failures[0], job['result']['comment_ids'])
+
+    @override_settings(AI_JOB_QUEUE_LIMIT=1)
+    def test_full_queue_rejects_new_jobs(self):
+        response = self.client.post(f'/api/post/{self.post.id}/trigger-ai/')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job']['id']
+
+        self.assertEqual(self.client.post(f'/api/post/{self.post.id}/trigger-ai/').status_code, 503)
+        # Posts are still created, just without AI replies
+        response = self.client.post('/api/post/create/', {
+            'content': "Too busy", 'created_by': self.user.id, 'topic': self.topic.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AIJob.objects.count(), 1)
+
+        job = self.client.get(f'/api/ai-job/{job_id}/').json()
+        self.assertEqual((job['status'], job['post'], job['source']), ('queued', self.post.id, 'manual'))
+
+    def reply(self, content):
+        comment = Comment.objects.create(post=self.post, created_by=self.user, content=content)
+        return enqueue_ai_round(self.post, content, 'reply', trigger_comment=comment), comment
+
+    @override_settings(AI_REPLY_DEBOUNCE=1, AI_REPLY_MAX_DELAY=5)
+    def test_burst_of_replies_is_coalesced_into_one_debounced_round(self):
+        metrics.reset()
+        first, _ = self.reply("One")
+        self.assertGreater(first.run_after, timezone.now())
+        self.assertIsNone(claim_next_job())
+
+        self.reply("Two")
+        job, latest = self.reply("Three")
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual(AIJob.objects.count(), 1)
+        self.assertEqual((job.message, job.trigger_comment_id, job.coalesced), ("Three", latest.id, 2))
+        self.assertEqual(metrics.value('ai_jobs_coalesced_total'), 2)
+
+        # Bursts cannot hold a round back for longer than the maximum delay
+        AIJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(seconds=10))
+        job, _ = self.reply("Four")
+        self.assertLessEqual(job.run_after, timezone.now())
+        self.assertEqual(claim_next_job().pk, job.pk)
+
+        # A running round is not extended; the next reply queues a round of its own
+        self.assertNotEqual(self.reply("Five")[0].pk, job.pk)
+
+    def test_claims_skip_posts_at_their_round_limit(self):
+        other = Post.objects.create(content="Quiet thread", created_by=self.user, topic=self.topic)
+        AIJob.objects.create(
+            post=self.post, message="Busy", source='manual', status='running', attempts=1,
+            run_after=timezone.now(), lease_expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        hot = AIJob.objects.create(post=self.post, message="Hot", source='manual', run_after=timezone.now())
+        quiet = AIJob.objects.create(post=other, message="Quiet", source='manual', run_after=timezone.now())
+
+        with override_settings(AI_JOB_MAX_RUNNING=1):
+            self.assertIsNone(claim_next_job())
+        # The older job on the busy post waits; the other thread goes first
+        self.assertEqual(claim_next_job().pk, quiet.pk)
+        self.assertIsNone(claim_next_job())
+        with override_settings(AI_JOB_MAX_PER_POST=2):
+            self.assertEqual(claim_next_job().pk, hot.pk)
+
+    @override_settings(AI_REPLY_DEBOUNCE=0)
+    def test_new_reply_cancels_the_running_round(self):
+        metrics.reset()
+        first_comment = Comment.objects.create(post=self.post, created_by=self.user, content="First")
+        second_comment = Comment.objects.create(post=self.post, created_by=self.user, content="Second")
+
+        async def run():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(post_group(self.post.id), channel)
+            jobs.pool.start()
+            try:
+                first = await aenqueue_ai_round(self.post, "First", 'reply', trigger_comment=first_comment)
+                while not await AIJob.objects.filter(pk=first.pk, status='running').aexists():
+                    await asyncio.sleep(0.01)
+                second = await aenqueue_ai_round(self.post, "Second", 'reply', trigger_comment=second_comment)
+                while not await AIJob.objects.filter(pk=second.pk, status='succeeded').aexists():
+                    await asyncio.sleep(0.05)
+                frames = []
+                while not frames or frames[-1]['type'] != 'post_round_cancelled':
+                    frames.append((await asyncio.wait_for(layer.receive(channel), 5))['frame'])
+                return first, second, frames[-1]
+            finally:
+                await jobs.pool.stop()
+
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(latency=0.3, personas=["critic"])):
+            first, second, cancelled = async_to_sync(run)()
+
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.result), ('superseded', {}))
+        self.assertEqual(cancelled, {'type': 'post_round_cancelled', 'job_id': first.pk, 'post_id': self.post.id})
+        self.assertEqual(metrics.value('ai_jobs_superseded_total'), 1)
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class ChatConsumerLoadTests(QueryBudgetTestCase):
+    """Concurrent replies must overlap their LLM calls instead of queueing on worker threads"""
+
+    latency = 0.2
+    sockets = 40
+
+    def setUp(self):
+        self.user = User.objects.create(id=1, name="You", type="human")
+        topic = Topic.objects.create(name="Topic")
+        self.posts = [
+            Post.objects.create(content=f"Is async worth it? #{i}", created_by=self.user, topic=topic)
+            for i in range(self.sockets)
+        ]
+        load_personas()
+
+    async def connect(self, count):
+        sockets = [WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/socket-server/") for _ in range(count)]
+        for socket in sockets:
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+        return sockets
+
+    async def receive_replies(self, socket, expected):
+        frames = []
+        while len([frame for frame in frames if frame['type'] == 'post_reply']) < expected:
+            frames.append(json.loads(await socket.receive_from(timeout=10)))
+        return frames
+
+    async def test_many_sockets_share_one_event_loop(self):
+        fake = FakeAsyncLLM(latency=self.latency, personas=["logic_master", "critic"])
+        sockets = await self.connect(self.sockets)
+        with mock.patch('debateapp.personas.async_client', fake):
+            started = time.monotonic()
+            for socket, post in zip(sockets, self.posts):
+                await socket.send_to(text_data=json.dumps({
+                    'type': 'post_reply', 'message': "Yes, for I/O bound work", 'post_id': post.id,
+                }))
+            # Every socket gets its human reply plus one reply per selected persona
+            results = await asyncio.gather(*(self.receive_replies(socket, 3) for socket in sockets))
+            elapsed = time.monotonic() - started
+
+        for frames, post in zip(results, self.posts):
+            self.assertEqual(frames[0]['message'], "Yes, for I/O bound work")
+            self.assertEqual({frame['post_id'] for frame in frames}, {post.id})
+            self.assertIn('post_users_typing', [frame['type'] for frame in frames])
+        # 40 routing calls and 80 persona calls overlapped rather than running back to back
+        self.assertEqual(fake.calls, self.sockets * 3)
+        self.assertGreaterEqual(fake.max_in_flight, self.sockets)
+        # Only a backstop against serialized calls (24s): overlapped they take about 1s, but CI boxes are slow
+        self.assertLess(elapsed, self.latency * self.sockets)
+
+        for socket in sockets:
+            await socket.disconnect()
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class PostGroupTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Topic")
+        self.post = Post.objects.create(content="Groups", created_by=self.user, topic=self.topic)
+        self.other_post = Post.objects.create(content="Elsewhere", created_by=self.user, topic=Topic.objects.create(name="Other"))
+        load_personas()
+
+    async def socket(self, **subscription):
+        socket = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/socket-server/")
+        await socket.connect()
+        if subscription:
+            await socket.send_to(text_data=json.dumps({'type': 'subscribe', **subscription}))
+            # Let the consumer process the subscription before anything is broadcast
+            await socket.receive_nothing(timeout=0.05)
+        return socket
+
+    async def test_reply_is_processed_once_and_sent_to_subscribers_only(self):
+        sender = await self.socket()
+        follower = await self.socket(post_id=self.post.id)
+        topic_follower = await self.socket(topic_ids=[self.topic.id], post_ids=[self.post.id])
+        bystander = await self.socket(post_id=self.other_post.id)
+        fake = FakeAsyncLLM(personas=["logic_master", "critic"])
+
+        with mock.patch('debateapp.personas.async_client', fake):
+            await sender.send_to(text_data=json.dumps({'type': 'post_reply', 'message': "Once", 'post_id': self.post.id}))
+            for socket in (sender, follower, topic_follower):
+                replies = []
+                while len(replies) < 3:
+                    frame = json.loads(await socket.receive_from(timeout=10))
+                    if frame['type'] == 'post_reply':
+                        replies.append(frame)
+                # Following both the post and its topic must not duplicate comments
+                self.assertEqual(len({frame['comment_id'] for frame in replies}), 3)
+                self.assertTrue(await socket.receive_nothing(timeout=0.2))
+
+        self.assertTrue(await bystander.receive_nothing(timeout=0.2))
+        self.assertEqual(await Comment.objects.filter(post=self.post).acount(), 3)
+        self.assertEqual(fake.calls, 3)
+        for socket in (sender, follower, topic_follower, bystander):
+            await socket.disconnect()
+
+    async def test_unsubscribe_stops_delivery(self):
+        sender = await self.socket()
+        listener = await self.socket(post_id=self.post.id)
+        await listener.send_to(text_data=json.dumps({'type': 'unsubscribe', 'post_id': self.post.id}))
+        await listener.receive_nothing(timeout=0.05)
+
+        with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=[])):
+            await sender.send_to(text_data=json.dumps({'type': 'post_reply', 'message': "Hello", 'post_id': self.post.id}))
+            frame = json.loads(await sender.receive_from(timeout=10))
+            self.assertEqual(frame['message'], "Hello")
+
+        self.assertTrue(await listener.receive_nothing(timeout=0.2))
+        await sender.disconnect()
+        await listener.disconnect()
+
+    async def test_unknown_posts_are_not_subscribed_or_replied_to(self):
+        socket = await self.socket(post_ids=[self.post.id, 999, "abc"], topic_id=999)
+        for post_id in (999, "abc", None):
+            await socket.send_to(text_data=json.dumps({'type': 'post_reply', 'message': "Lost", 'post_id': post_id}))
+            frame = json.loads(await socket.receive_from(timeout=10))
+            self.assertEqual(frame, {'type': 'error', 'message': "Post not found", 'post_id': post_id})
+
+        groups = get_channel_layer().groups
+        self.assertIn(post_group(self.post.id), groups)
+        self.assertNotIn(post_group(999), groups)
+        self.assertNotIn(topic_group(999), groups)
+        self.assertEqual(await Comment.objects.acount(), 0)
+        await socket.disconnect()
+
+    async def test_reply_errors_are_reported_to_the_client(self):
+        socket = await self.socket()
+        with mock.patch('debateapp.consumers.save_comment', side_effect=RuntimeError("database is locked")):
+            await socket.send_to(text_data=json.dumps({'type': 'post_reply', 'message': "Boom", 'post_id': self.post.id}))
+            frame = json.loads(await socket.receive_from(timeout=10))
+
+        self.assertEqual(frame, {'type': 'error', 'message': "Could not save your reply", 'post_id': self.post.id})
+        await socket.disconnect()
+
+
+@override_settings(AI_JOBS_EAGER=True)
+class StreamingReplyTests(QueryBudgetTestCase):
+    def setUp(self):
+        self.user = User.objects.create(id=1, name="You", type="human")
+        topic = Topic.objects.create(name="Topic")
+        self.post = Post.objects.create(content="Should replies stream?", created_by=self.user, topic=topic)
+        load_personas()
+
+    async def exchange(self, server):
+        client = AsyncOpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+        socket = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/socket-server/")
+        await socket.connect()
+        with mock.patch('debateapp.personas.async_client', client):
+            await socket.send_to(text_data=json.dumps({
+                'type': 'post_reply', 'message': "Tokens as they arrive", 'post_id': self.post.id,
+            }))
+            frames = []
+            while len([frame for frame in frames if frame['type'] == 'post_reply']) < 3:
+                frames.append(json.loads(await socket.receive_from(timeout=10)))
+        await socket.disconnect()
+        await client.close()
+        return frames
+
+    async def test_deltas_precede_final_frame_with_comment_id(self):
+        with FakeOpenAIServer(token_latency=0.01) as server:
+            frames = await self.exchange(server)
+
+        finals = [frame for frame in frames if frame['type'] == 'post_reply' and 'stream_id' in frame]
+        self.assertEqual(len(finals), 2)
+        for final in finals:
+            deltas = [frame['delta'] for frame in frames
+                      if frame['type'] == 'post_reply_delta' and frame['stream_id'] == final['stream_id']]
+            self.assertGreater(len(deltas), 1)
+            self.assertEqual(''.join(deltas), final['message'])
+            self.assertIsNotNone(final['first_token_ms'])
+            comment = await Comment.objects.aget(pk=final['comment_id'])
+            self.assertEqual(comment.content, final['message'])
+
+    async def test_failed_stream_falls_back_to_full_completion(self):
+        with FakeOpenAIServer(fail_streams=True) as server:
+            frames = await self.exchange(server)
+
+        self.assertNotIn('post_reply_delta', [frame['type'] for frame in frames])
+        finals = [frame for frame in frames if frame['type'] == 'post_reply' and 'stream_id' in frame]
+        self.assertEqual(len(finals), 2)
+        for final in finals:
+            self.assertTrue(final['message'].startswith("Considered reply to:"))
+
+    @override_settings(AI_STREAMING=False)
+    async def test_streaming_can_be_disabled(self):
+        with FakeOpenAIServer() as server:
+            frames = await self.exchange(server)
+
+        self.assertNotIn('post_reply_delta', [frame['type'] for frame in frames])
+        self.assertFalse(any(server_request.get('stream') for server_request in server.requests))
+
+
+# Runs in a separate interpreter: a second worker process with one socket following a post
+REMOTE_SOCKET_SCRIPT = """
+import asyncio, json, os, sys
+import django
+django.setup()
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from debateapp.consumers import ChatConsumer
+
+async def main(post_id, expected):
+    socket = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/socket-server/")
+    await socket.connect()
+    await socket.send_to(text_data=json.dumps({"type": "subscribe", "post_id": post_id}))
+    await socket.receive_nothing(timeout=0.2)
+    print("ready", flush=True)
+    replies = 0
+    while replies < expected:
+        frame = await socket.receive_from(timeout=15)
+        print(frame, flush=True)
+        replies += json.loads(frame)["type"] == "post_reply"
+    await socket.disconnect()
+
+asyncio.run(main(int(sys.argv[1]), int(sys.argv[2])))
+"""
+
+
+@skipUnless(TcpFakeServer, 'install "fakeredis[lua]" to run the Redis channel layer tests')
+@override_settings(AI_JOBS_EAGER=True)
+class RedisChannelLayerTests(QueryBudgetTestCase):
+    """Broadcasts must cross process boundaries through a Redis channel layer"""
+
+    def setUp(self):
+        self.redis = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        threading.Thread(target=self.redis.serve_forever, daemon=True).start()
+        host, port = self.redis.server_address
+        self.redis_url = f"redis://{host}:{port}/0"
+
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.post = Post.objects.create(content="Scale out", created_by=self.user, topic=Topic.objects.create(name="Topic"))
+        load_personas()
+
+    def tearDown(self):
+        self.redis.shutdown()
+        self.redis.server_close()
+
+    def start_remote_socket(self, expected_replies):
+        env = {**os.environ, 'CHANNEL_LAYER': 'redis', 'REDIS_URL': self.redis_url,
+               'DJANGO_SETTINGS_MODULE': 'djangoapp.settings'}
+        remote = subprocess.Popen(
+            [sys.executable, '-c', REMOTE_SOCKET_SCRIPT, str(self.post.id), str(expected_replies)],
+            cwd=Path(settings.BASE_DIR), env=env, stdout=subprocess.PIPE, text=True,
+        )
+        self.addCleanup(remote.kill)
+        # The consumer logs to stdout too; wait for the socket to be subscribed
+        for line in remote.stdout:
+            if line.strip() == "ready":
+                return remote
+        self.fail("remote worker exited before subscribing")
+
+    def test_reply_reaches_socket_on_another_worker(self):
+        remote = self.start_remote_socket(expected_replies=2)
+
+        async def reply_from_this_worker():
+            socket = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/socket-server/")
+            await socket.connect()
+            with mock.patch('debateapp.personas.async_client', FakeAsyncLLM(personas=["logic_master"])):
+                await socket.send_to(text_data=json.dumps({
+                    'type': 'post_reply', 'message': "Across processes", 'post_id': self.post.id,
+                }))
+                replies = 0
+                while replies < 2:
+                    replies += json.loads(await socket.receive_from(timeout=15))['type'] == 'post_reply'
+            await socket.disconnect()
+
+        with override_settings(CHANNEL_LAYERS=build_channel_layers('redis', self.redis_url)):
+            async_to_sync(reply_from_this_worker)()
+
+        output, _ = remote.communicate(timeout=20)
+        frames = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+        replies = [frame for frame in frames if frame['type'] == 'post_reply']
+        self.assertEqual(replies[0]['message'], "Across processes")
+        self.assertEqual(replies[1]['created_by_detail']['name'], "ProfessorLogic")
+        self.assertIn('post_reply_delta', [frame['type'] for frame in frames])
+        # The remote worker only relayed; the comments were written once, here
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 2)
+
+
+@skipUnless(TcpFakeServer, 'install "fakeredis[lua]" to run the shared cache tests')
+class SharedCacheTests(QueryBudgetTestCase):
+    """Cache invalidation must reach every worker when the cache lives in Redis"""
+
+    def setUp(self):
+        self.redis = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        threading.Thread(target=self.redis.serve_forever, daemon=True).start()
+        host, port = self.redis.server_address
+        self.caches = build_caches('redis', f"redis://{host}:{port}/0")
+        self.user = User.objects.create(id=1, name="You", type="human")
+        self.topic = Topic.objects.create(name="Shared")
+
+    def tearDown(self):
+        self.redis.shutdown()
+        self.redis.server_close()
+
+    def test_backend_aliases(self):
+        self.assertEqual(build_caches()['default']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(self.caches['default']['BACKEND'], 'django.core.cache.backends.redis.RedisCache')
+        self.assertEqual(build_caches('dummy.Cache'), {'default': {'BACKEND': 'dummy.Cache'}})
+
+    def test_invalidation_reaches_other_workers(self):
+        config = self.caches['default']
+        # Another worker's connection to the same cache
+        other_worker = RedisCache(config['LOCATION'], {})
+        with override_settings(CACHES=self.caches):
+            topic_activity.scores([self.topic.id])
+            self.assertEqual(other_worker.get(topic_activity.cache_key(self.topic.id)), 0)
+
+            post = Post.objects.create(content="Trams", created_by=self.user, topic=self.topic)
+            with self.captureOnCommitCallbacks(execute=True):
+                activity.post_created(post)
+            self.assertIsNone(other_worker.get(topic_activity.cache_key(self.topic.id)))
+            self.assertEqual(topic_activity.scores([self.topic.id]), {self.topic.id: 1})
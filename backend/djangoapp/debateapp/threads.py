@@ -0,0 +1,89 @@
+"""Threaded comment trees in a constant number of queries.
+
+A page of thread roots (top-level comments, or the replies to one comment) is
+expanded with one recursive CTE walking `parent_id` one level past the
+requested depth, which yields the tree's shape and the per-comment counts,
+then one query loads the comments within the requested depth. However deep or
+wide the thread, loading it costs the same queries, and the walk only visits
+the levels the response needs. It never goes past THREAD_MAX_DEPTH levels
+below the roots, which also bounds it should a parent cycle ever be saved.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Comment
+
+SUBTREE_SQL = """
+WITH RECURSIVE thread(id, parent_id, depth) AS (
+    SELECT id, parent_id, 1 FROM {table} WHERE parent_id IN ({roots})
+    UNION ALL
+    SELECT comment.id, comment.parent_id, thread.depth + 1
+    FROM {table} AS comment JOIN thread ON comment.parent_id = thread.id
+    WHERE thread.depth < %s
+)
+SELECT {columns} FROM thread
+"""
+
+
+def subtree_sql(root_ids, depth, columns):
+    """SQL and params selecting `columns` of every comment up to `depth` levels below `root_ids`"""
+    sql = SUBTREE_SQL.format(
+        table=connection.ops.quote_name(Comment._meta.db_table),
+        roots=', '.join(['%s'] * len(root_ids)),
+        columns=columns,
+    )
+    return sql, [*root_ids, depth]
+
+
+def subtree(root_ids, depth):
+    """(id, parent_id, depth) of every comment up to `depth` levels below `root_ids`; the roots are depth 0"""
+    if not root_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(*subtree_sql(root_ids, min(depth, settings.THREAD_MAX_DEPTH), 'id, parent_id, depth'))
+        return cursor.fetchall()
+
+
+def load(roots, depth):
+    """The comments within `depth` levels below `roots` (inclusive), and per-comment counts
+
+    Returns (comments, stats). `comments` starts with the roots; `stats` maps
+    every returned comment id to its depth, reply_count and
+    loaded_descendant_count. The walk goes one level beyond `depth`, so
+    reply_count is exact for every returned comment and clients can tell which
+    have more replies to load; loaded_descendant_count only counts the
+    descendants within `depth`, i.e. those returned.
+    """
+    root_ids = [root.id for root in roots]
+    shape = subtree(root_ids, depth + 1)
+    stats = {root_id: {'depth': 0, 'reply_count': 0, 'loaded_descendant_count': 0} for root_id in root_ids}
+    for comment_id, parent_id, level in shape:
+        stats[comment_id] = {'depth': level, 'reply_count': 0, 'loaded_descendant_count': 0}
+    # Deepest first, so each comment's total is final before it is added to its parent's
+    for comment_id, parent_id, level in sorted(shape, key=lambda row: -row[2]):
+        stats[parent_id]['reply_count'] += 1
+        if level <= depth:
+            stats[parent_id]['loaded_descendant_count'] += 1 + stats[comment_id]['loaded_descendant_count']
+
+    replies = []
+    if depth > 0 and shape:
+        # The same walk as a subquery, so a large thread doesn't become a long list of ids
+        replies = Comment.objects.filter(
+            pk__in=RawSQL(*subtree_sql(root_ids, depth, 'id'))
+        ).select_related('created_by').order_by('created_at', 'id')
+    comments = list(roots) + list(replies)
+    return comments, {comment.id: stats[comment.id] for comment in comments}
+
+
+def nest(rows, stats, root_ids):
+    """Nest serialized comment `rows` under their parents, adding the counts to each
+
+    Replies keep the order of `rows`; returns the roots in `root_ids` order.
+    """
+    nodes = {row['id']: {**row, **stats[row['id']], 'replies': []} for row in rows}
+    roots = set(root_ids)
+    for node in nodes.values():
+        if node['id'] not in roots and node['parent'] in nodes:
+            nodes[node['parent']]['replies'].append(node)
+    return [nodes[root_id] for root_id in root_ids]
@@ -0,0 +1,139 @@
+"""Per-request instrumentation: query count, DB, serializer and LLM time.
+
+`collect()` starts a Timings for an HTTP request (api.middleware) or a
+WebSocket message (ChatConsumer). While it is active, every database query
+(through an execute wrapper installed on each new connection), serializers
+with TimedSerializerMixin and `span('llm')` blocks add to it. It lives in a
+context variable, so database_sync_to_async threads and tasks started while
+it is active report into it too.
+
+`report()` logs slow requests with their most repeated SQL and checks the
+query budget for the endpoint (QUERY_BUDGETS), raising QueryBudgetExceeded
+when QUERY_BUDGET_ENFORCE is set, as the test suite's QueryBudgetTestCase
+does, so N+1 regressions fail the test run.
+"""
+import contextvars
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+current = contextvars.ContextVar('timings', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Timings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.queries = 0
+        self.durations = defaultdict(float)  # seconds per kind: db, serializer, llm
+        self.statements = Counter()
+        self.serializing = False
+
+    @property
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def server_timing(self):
+        """A Server-Timing header value, durations in milliseconds"""
+        parts = [f'db;dur={self.durations["db"] * 1000:.1f};desc="{self.queries} queries"']
+        parts += [f'{kind};dur={self.durations[kind] * 1000:.1f}' for kind in ('serializer', 'llm') if kind in self.durations]
+        parts.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(parts)
+
+    def repeated_statements(self, limit=3):
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+@contextmanager
+def collect():
+    timings = Timings()
+    token = current.set(timings)
+    try:
+        yield timings
+    finally:
+        current.reset(token)
+        timings.finished = time.perf_counter()
+
+
+@contextmanager
+def span(kind):
+    """Add the time spent in the block to the current request's `kind` total"""
+    timings = current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.durations[kind] += time.perf_counter() - started
+
+
+async def timed_chunks(stream, kind='llm'):
+    """Iterate an async stream, counting only the time spent waiting for each chunk"""
+    iterator = stream.__aiter__()
+    while True:
+        with span(kind):
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.durations['db'] += time.perf_counter() - started
+        # Parameters are separate, so identical statements group N+1 loops together
+        timings.statements[sql] += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver (connected in DebateappConfig.ready)"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """Counts a serializer's to_representation as serializer time; nested serializers count once"""
+
+    def to_representation(self, instance):
+        timings = current.get()
+        if timings is None or timings.serializing:
+            return super().to_representation(instance)
+        timings.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializing = False
+            timings.durations['serializer'] += time.perf_counter() - started
+
+
+def report(label, endpoint, timings):
+    """Log a slow request and check `endpoint` against its query budget"""
+    if timings.total * 1000 >= settings.SLOW_REQUEST_MS:
+        print(f"Slow request {label}: {timings.server_timing()}")
+        for sql, count in timings.repeated_statements():
+            print(f"  {count}x {sql[:200]}")
+
+    budget = settings.QUERY_BUDGETS.get(endpoint)
+    if budget is not None and timings.queries > budget:
+        message = f"{label} ran {timings.queries} queries, over the budget of {budget} for {endpoint}"
+        repeated = timings.repeated_statements(1)
+        if repeated:
+            message += f"; most repeated ({repeated[0][1]}x): {repeated[0][0][:200]}"
+        if settings.QUERY_BUDGET_ENFORCE:
+            raise QueryBudgetExceeded(message)
+        print(message)
@@ -0,0 +1,65 @@
+"""Topic activity scores, computed in one query and cached per topic.
+
+A topic's score weighs its posts updated and comments written in the last
+week (Topic.compute_activity_score). Scores for any set of topics come from a
+single aggregate query and are cached per topic for
+TOPIC_ACTIVITY_CACHE_TTL seconds, so topic lists and post feeds normally read
+them from the cache. The activity hooks drop a topic's entry when a post or
+comment in it is added or edited; the TTL covers activity ageing out of the
+week.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Comment, Post, Topic
+
+WINDOW = timedelta(days=7)
+
+
+def cache_key(topic_id):
+    return f'topic_activity:{topic_id}'
+
+
+def _count(queryset, topic):
+    """A correlated COUNT(*) subquery grouped by the `topic` path, 0 when there are no rows"""
+    counted = queryset.order_by().values(topic).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), 0)
+
+
+def compute(topic_ids):
+    """Scores for `topic_ids` straight from the content tables, in one query"""
+    week_ago = timezone.now() - WINDOW
+    rows = Topic.objects.filter(id__in=topic_ids).annotate(
+        recent_posts=_count(Post.objects.filter(topic=OuterRef('pk'), updated_at__gte=week_ago), 'topic'),
+        recent_comments=_count(Comment.objects.filter(post__topic=OuterRef('pk'), created_at__gte=week_ago), 'post__topic'),
+    ).values_list('id', 'recent_posts', 'recent_comments')
+    return {topic_id: Topic.compute_activity_score(posts, comments) for topic_id, posts, comments in rows}
+
+
+def scores(topic_ids):
+    """Activity score by topic id, from the cache where possible"""
+    topic_ids = {topic_id for topic_id in topic_ids if topic_id is not None}
+    if not topic_ids:
+        return {}
+    cached = cache.get_many([cache_key(topic_id) for topic_id in topic_ids])
+    found = {topic_id: cached[cache_key(topic_id)] for topic_id in topic_ids if cache_key(topic_id) in cached}
+    missing = topic_ids - found.keys()
+    if missing:
+        fresh = compute(missing)
+        cache.set_many({cache_key(topic_id): score for topic_id, score in fresh.items()}, settings.TOPIC_ACTIVITY_CACHE_TTL)
+        found.update(fresh)
+    return found
+
+
+def invalidate(*topic_ids):
+    """Drop the cached scores of `topic_ids`, now and again when the current transaction commits"""
+    keys = [cache_key(topic_id) for topic_id in set(topic_ids) if topic_id is not None]
+    cache.delete_many(keys)
+    # A concurrent read may cache the old counts again before the writes are visible
+    transaction.on_commit(lambda: cache.delete_many(keys))
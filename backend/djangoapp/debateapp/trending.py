@@ -0,0 +1,131 @@
+"""Trending posts as forward-decayed engagement scores.
+
+An event of weight w at time t adds w * 2^((t - L) / TRENDING_HALF_LIFE_HOURS)
+to its post's score, where L is the landmark time. Every stored score is then
+the decayed engagement sum(w * 2^(-(now - t) / h)) times the same factor
+2^((now - L) / h), so ordering by the stored score orders posts by how much is
+happening now, and recording an event is one atomic upsert.
+
+`manage.py compact_trending` (run it periodically, e.g. hourly) moves the
+landmark to now, rescaling every score so the numbers stay small, and drops
+posts whose engagement has decayed below TRENDING_MIN_SCORE.
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import upsert
+from .models import Comment, Post, PostView, Reaction, TrendingLandmark, TrendingScore
+
+WEIGHTS = {
+    'post': 1.0,
+    'like': 1.0,
+    'dislike': 0.5,
+    'comment': 2.0,
+    'view': 0.2,
+}
+# Compact before growth factors get anywhere near float overflow (2^1023)
+MAX_EXPONENT = 256
+LANDMARK_CACHE_SECONDS = 60
+
+
+def half_life_seconds():
+    return settings.TRENDING_HALF_LIFE_HOURS * 3600
+
+
+_landmark = {'value': None, 'expires': 0.0}
+
+
+def get_landmark():
+    """The current landmark, re-read at most every LANDMARK_CACHE_SECONDS
+
+    A process that has not yet seen a compaction weighs new events against the
+    previous landmark, overstating them by 2^(compaction interval / half-life),
+    about 3% for hourly compaction with a day's half-life, until it re-reads.
+    """
+    if _landmark['value'] is None or time.monotonic() >= _landmark['expires']:
+        landmark, _ = TrendingLandmark.objects.get_or_create(pk=1, defaults={'landmark': timezone.now()})
+        forget_landmark(landmark.landmark)
+    return _landmark['value']
+
+
+def forget_landmark(value=None):
+    _landmark['value'] = value
+    _landmark['expires'] = time.monotonic() + LANDMARK_CACHE_SECONDS if value else 0.0
+
+
+def growth(at, landmark):
+    """2^((at - landmark) / half_life): weight of an event at `at` relative to the landmark"""
+    return 2 ** ((at - landmark).total_seconds() / half_life_seconds())
+
+
+def record(post_id, event, at=None, removed=False, count=1):
+    """Add (or take back) the weight of `count` events to a post's trending score"""
+    at = at or timezone.now()
+    landmark = get_landmark()
+    if (timezone.now() - landmark).total_seconds() / half_life_seconds() > MAX_EXPONENT:
+        compact()
+        landmark = get_landmark()
+
+    delta = WEIGHTS[event] * count * growth(at, landmark)
+    if removed:
+        TrendingScore.objects.filter(post_id=post_id).update(score=Greatest(F('score') - delta, Value(0.0)))
+    else:
+        upsert.increment(TrendingScore, {'post_id': post_id}, score=delta)
+
+
+def top_posts(limit):
+    """Posts ordered by current trending score: a single read of the score index"""
+    return (
+        Post.objects.filter(trending__score__gt=0)
+        .select_related('created_by', 'topic')
+        .order_by('-trending__score', '-id')[:limit]
+    )
+
+
+def compact(now=None):
+    """Move the landmark to `now` and drop cold posts; returns (rescaled, dropped)"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        forget_landmark()
+        landmark = get_landmark()
+        rescaled = TrendingScore.objects.update(score=F('score') / growth(now, landmark))
+        dropped, _ = TrendingScore.objects.filter(score__lt=settings.TRENDING_MIN_SCORE).delete()
+        TrendingLandmark.objects.filter(pk=1).update(landmark=now)
+    forget_landmark(now)
+    return rescaled, dropped
+
+
+def rebuild(now=None, window_days=7):
+    """Recompute every score from the last `window_days` of events; returns the number of posts scored"""
+    now = now or timezone.now()
+    since = now - timezone.timedelta(days=window_days)
+    scores = defaultdict(float)
+    events = [
+        ('post', Post.objects.filter(created_at__gte=since).values_list('id', 'created_at')),
+        ('comment', Comment.objects.filter(created_at__gte=since).values_list('post_id', 'created_at')),
+        ('view', PostView.objects.filter(viewed_at__gte=since).values_list('post_id', 'viewed_at')),
+    ]
+    for reaction_type in ('like', 'dislike'):
+        events.append((reaction_type, Reaction.objects.filter(
+            post__isnull=False, type=reaction_type, created_at__gte=since,
+        ).values_list('post_id', 'created_at')))
+
+    for event, rows in events:
+        for post_id, at in rows.iterator():
+            scores[post_id] += WEIGHTS[event] * growth(at, now)
+
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingLandmark.objects.update_or_create(pk=1, defaults={'landmark': now})
+        TrendingScore.objects.bulk_create([
+            TrendingScore(post_id=post_id, score=score)
+            for post_id, score in scores.items() if score >= settings.TRENDING_MIN_SCORE
+        ])
+    forget_landmark(now)
+    return len(scores)
@@ -0,0 +1,48 @@
+"""Single-statement upserts for the bookkeeping tables.
+
+The write hooks run on every post, comment, reaction and view, inside the
+writer's transaction, so each table update there should be one statement:
+INSERT ... ON CONFLICT (SQLite 3.24+ and PostgreSQL) rather than an UPDATE
+followed by a get_or_create and its savepoint.
+"""
+from django.db import connection
+
+
+def _insert(model, values):
+    """INSERT INTO ... VALUES for a row built from `values`, with defaults and auto_now filled in"""
+    instance = model(**values)
+    fields = [field for field in model._meta.concrete_fields if field is not model._meta.auto_field]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    params = [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+    placeholders = ', '.join(['%s'] * len(fields))
+    return f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", params
+
+
+def _conflict_target(model, keys):
+    return ', '.join(connection.ops.quote_name(model._meta.get_field(key).column) for key in keys)
+
+
+def increment(model, keys, **amounts):
+    """Add `amounts` to the row matching `keys` (a unique key), inserting it with those amounts if missing"""
+    sql, params = _insert(model, {**keys, **amounts})
+    table = connection.ops.quote_name(model._meta.db_table)
+    updates = []
+    for field in model._meta.concrete_fields:
+        column = connection.ops.quote_name(field.column)
+        if field.name in amounts or field.attname in amounts:
+            updates.append(f"{column} = {table}.{column} + excluded.{column}")
+        elif getattr(field, 'auto_now', False):
+            updates.append(f"{column} = excluded.{column}")
+    sql += f" ON CONFLICT ({_conflict_target(model, keys)}) DO UPDATE SET {', '.join(updates)}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def insert_missing(model, keys):
+    """Insert the row identified by `keys` unless it exists; returns whether it was inserted"""
+    sql, params = _insert(model, keys)
+    sql += f" ON CONFLICT ({_conflict_target(model, keys)}) DO NOTHING"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
@@ -1,6 +1,8 @@
 from django.utils import timezone
 from datetime import timedelta
 import random
+from debateapp import rollups, search, trending
+from debateapp.activity import repair_counters
 from debateapp.models import Topic, User, Post, Comment, Reaction, Bookmark, PostView
 
 # Create topics with better variety
@@ -127,6 +129,12 @@ for post_data in posts_data:
                     user=user
                 )
 
+# Rows above bypass the activity hooks, so bring the counters, search index, trending scores and rollups up to date
+repair_counters()
+search.get_backend().rebuild()
+trending.rebuild()
+rollups.rebuild()
+
 print("\nDatabase populated with sample data!")
 print(f"Topics: {Topic.objects.count()}")
 print(f"Users: {User.objects.count()}")
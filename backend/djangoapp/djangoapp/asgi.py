@@ -11,14 +11,19 @@ import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangoapp.settings")
 
 from django.core.asgi import get_asgi_application
+# Set up Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import debateapp.routing
+from debateapp.jobs import JobWorkersMiddleware
+from debateapp.view_tracking import ViewFlushMiddleware
 
 
-application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+application = JobWorkersMiddleware(ViewFlushMiddleware(ProtocolTypeRouter({
+    'http': django_asgi_app,
     'websocket': AuthMiddlewareStack(
         URLRouter(debateapp.routing.websocket_urlpatterns)
     )
-})
+})))
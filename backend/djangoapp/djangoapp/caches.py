@@ -0,0 +1,22 @@
+"""Cache selection for settings.CACHES
+
+Topic activity scores, conversation history and thread summaries are
+invalidated by deleting their cache entries. The local-memory cache only
+drops them in the process that handled the write, so other Daphne workers
+keep serving the old entries until they expire; use the Redis backend
+whenever more than one worker runs.
+"""
+
+CACHE_BACKENDS = {
+    'memory': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+
+def build_caches(backend='memory', redis_url=None):
+    """Return a CACHES dict for a backend alias or a dotted cache class path"""
+    cache_class = CACHE_BACKENDS.get(backend, backend)
+    default = {'BACKEND': cache_class}
+    if cache_class == CACHE_BACKENDS['redis']:
+        default['LOCATION'] = redis_url or 'redis://127.0.0.1:6379/0'
+    return {'default': default}
@@ -0,0 +1,23 @@
+"""Channel layer selection for settings.CHANNEL_LAYERS
+
+The in-memory layer only delivers within one process; use a Redis backend when
+running more than one Daphne worker so group broadcasts reach every process.
+"""
+
+CHANNEL_LAYER_BACKENDS = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'redis_pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+
+
+def build_channel_layers(backend='memory', redis_url=None, prefix='debateapp'):
+    """Return a CHANNEL_LAYERS dict for a backend alias or a dotted layer class path"""
+    layer_class = CHANNEL_LAYER_BACKENDS.get(backend, backend)
+    layer = {'BACKEND': layer_class}
+    if layer_class.startswith('channels_redis.'):
+        layer['CONFIG'] = {
+            'hosts': [redis_url or 'redis://127.0.0.1:6379/0'],
+            'prefix': prefix,
+        }
+    return {'default': layer}
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from .caches import build_caches
+from .channel_layers import build_channel_layers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,11 +35,66 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
 
+# Paginated list endpoints return the next page cursor in these headers
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor', 'Link']
+
 
 load_dotenv()  # load .env file
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Stream persona replies to WebSocket clients token by token (post_reply_delta frames)
+AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"
+
+# How personas are picked for a reply: `llm` (a model call), `local` (in-process scoring) or `hybrid`
+# (local, falling back to the model when the local confidence is below the minimum)
+PERSONA_ROUTER = os.getenv("PERSONA_ROUTER", "llm")
+PERSONA_ROUTER_MIN_CONFIDENCE = float(os.getenv("PERSONA_ROUTER_MIN_CONFIDENCE", 0.5))
+
+# `per_persona`: one completion per replying persona; `batched`: one structured completion answers for all of them
+AI_GENERATION = os.getenv("AI_GENERATION", "per_persona")
+
+# Personas to start generating speculatively while the (model) router decides; 0 disables speculation
+AI_SPECULATION_BUDGET = int(os.getenv("AI_SPECULATION_BUDGET", 0))
+
+# Content-addressed cache of LLM responses: an in-process LRU in front of the LLMCacheEntry table
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1024))
+# Routing is always cached; persona replies only when enabled, which also makes them deterministic (temperature 0)
+LLM_CACHE_REPLIES = os.getenv("LLM_CACHE_REPLIES", "false").lower() == "true"
+
+# Estimated tokens of conversation history sent with each AI request; the oldest comments are dropped first
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", 3000))
+# Rolling thread summaries (see debateapp/summaries.py): comments older than the most recent turns are folded into a
+# per-post summary once AI_SUMMARY_EVERY of them have built up, or they pass the estimated token threshold
+AI_SUMMARY_ENABLED = os.getenv("AI_SUMMARY_ENABLED", "true").lower() == "true"
+AI_SUMMARY_RECENT_TURNS = int(os.getenv("AI_SUMMARY_RECENT_TURNS", 8))
+AI_SUMMARY_EVERY = int(os.getenv("AI_SUMMARY_EVERY", 10))
+AI_SUMMARY_TOKEN_THRESHOLD = int(os.getenv("AI_SUMMARY_TOKEN_THRESHOLD", 1500))
+AI_SUMMARY_MAX_TOKENS = int(os.getenv("AI_SUMMARY_MAX_TOKENS", 300))
+
+# AI reply rounds run as queued jobs on a fixed pool of workers (see debateapp/jobs.py)
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", 4))
+AI_JOB_QUEUE_LIMIT = int(os.getenv("AI_JOB_QUEUE_LIMIT", 100))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", 3))
+AI_JOB_RETRY_DELAY = float(os.getenv("AI_JOB_RETRY_DELAY", 5))
+AI_JOB_LEASE_SECONDS = int(os.getenv("AI_JOB_LEASE_SECONDS", 300))
+AI_JOB_POLL_INTERVAL = float(os.getenv("AI_JOB_POLL_INTERVAL", 2))
+# Rounds running at once for one post, and across all processes (0: no limit beyond AI_JOB_WORKERS per process)
+AI_JOB_MAX_PER_POST = int(os.getenv("AI_JOB_MAX_PER_POST", 1))
+AI_JOB_MAX_RUNNING = int(os.getenv("AI_JOB_MAX_RUNNING", 0))
+# Replies to a post within AI_REPLY_DEBOUNCE seconds of each other share one round over the latest context, started
+# at most AI_REPLY_MAX_DELAY seconds after the first; a new reply cancels the post's running round (AI_REPLY_SUPERSEDE)
+AI_REPLY_DEBOUNCE = float(os.getenv("AI_REPLY_DEBOUNCE", 1))
+AI_REPLY_MAX_DELAY = float(os.getenv("AI_REPLY_MAX_DELAY", 5))
+AI_REPLY_SUPERSEDE = os.getenv("AI_REPLY_SUPERSEDE", "true").lower() == "true"
+# Start the workers inside the ASGI server; disable when running `manage.py run_ai_workers` instead
+AI_JOB_AUTOSTART = os.getenv("AI_JOB_AUTOSTART", "true").lower() == "true"
+# Run jobs inline where they are enqueued (tests, debugging)
+AI_JOBS_EAGER = os.getenv("AI_JOBS_EAGER", "false").lower() == "true"
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -57,6 +114,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,12 +144,85 @@ TEMPLATES = [
 WSGI_APPLICATION = 'djangoapp.wsgi.application'
 ASGI_APPLICATION = 'djangoapp.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    }
+# CHANNEL_LAYER is `memory` (single process), `redis`, `redis_pubsub` or a dotted layer class path
+CHANNEL_LAYER = os.getenv("CHANNEL_LAYER", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+CHANNEL_LAYERS = build_channel_layers(CHANNEL_LAYER, REDIS_URL)
+
+# CACHE_BACKEND is `memory` (per process), `redis` or a dotted cache class path. Cached entries are invalidated
+# by deleting them, which a per-process cache only does in the worker that saw the write, so it defaults to
+# `redis` whenever the channel layer does
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis" if "redis" in CHANNEL_LAYER else "memory")
+CACHES = build_caches(CACHE_BACKEND, REDIS_URL)
+
+# Most toggles /reaction/bulk/ applies in one request
+REACTION_BULK_MAX = int(os.getenv("REACTION_BULK_MAX", 200))
+
+# Request instrumentation (debateapp/timing.py): Server-Timing headers on HTTP responses, logs for
+# requests slower than SLOW_REQUEST_MS, and query budgets per URL name (`ws:<message type>` for
+# WebSocket messages, `job:ai_round` for AI jobs), set at the current counts so any extra query shows up.
+# Going over a budget raises with QUERY_BUDGET_ENFORCE=true (the test suite turns it on) and is logged otherwise
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() == "true"
+QUERY_BUDGETS = {
+    "get_topics": 2,
+    "search_topics": 3,
+    "create_topic": 7,
+    "get_users": 1,
+    "user_detail": 5,
+    "user_posts": 3,
+    "user_bookmarks": 3,
+    "get_posts": 4,
+    "trending_posts": 3,
+    "create_post": 24,
+    "post_detail": 12,
+    "post_comments": 2,
+    "post_thread": 4,
+    "trigger_ai_responses": 17,
+    "ai_job_detail": 1,
+    "create_comment": 13,
+    "toggle_reaction": 8,
+    "toggle_bookmark": 2,
+    "get_statistics": 4,
+    "metrics": 0,
+    "ws:post_reply": 21,
+    "job:ai_round": 42,
 }
 
+# Keyset pagination for list endpoints, used when a request passes ?page_size= or ?cursor= (clamped to the max)
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 200))
+
+# Threaded comments (/post/<id>/thread/): reply levels returned below each root by default (?depth=),
+# and the deepest a thread is walked or returned
+THREAD_DEFAULT_DEPTH = int(os.getenv("THREAD_DEFAULT_DEPTH", 3))
+THREAD_MAX_DEPTH = int(os.getenv("THREAD_MAX_DEPTH", 100))
+
+# Full-text search: `auto` (FTS5 on SQLite, else basic), `fts5`, `basic` or a dotted backend class path
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+
+# Trending: engagement loses half its weight every TRENDING_HALF_LIFE_HOURS; `compact_trending`
+# drops posts whose decayed score falls below TRENDING_MIN_SCORE (about one like, a few half-lives ago)
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 24))
+TRENDING_MIN_SCORE = float(os.getenv("TRENDING_MIN_SCORE", 0.05))
+TRENDING_LIMIT = int(os.getenv("TRENDING_LIMIT", 20))
+
+# Post views are deduplicated per post and address for VIEW_DEDUPE_SECONDS, buffered in memory and
+# written every VIEW_FLUSH_INTERVAL seconds (0 writes each view immediately) or once VIEW_BUFFER_MAX
+# are waiting. VIEW_UNIQUE_COUNTING is `exact` (a PostView row per viewer) or `hll` (a HyperLogLog sketch)
+VIEW_DEDUPE_SECONDS = int(os.getenv("VIEW_DEDUPE_SECONDS", 1800))
+VIEW_DEDUPE_MAX_ENTRIES = int(os.getenv("VIEW_DEDUPE_MAX_ENTRIES", 100000))
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", 5))
+VIEW_BUFFER_MAX = int(os.getenv("VIEW_BUFFER_MAX", 1000))
+VIEW_UNIQUE_COUNTING = os.getenv("VIEW_UNIQUE_COUNTING", "exact")
+
+# Seconds the /statistics/ snapshot is cached for; 0 computes it from the rollups on every request
+STATISTICS_CACHE_TTL = int(os.getenv("STATISTICS_CACHE_TTL", 30))
+
+# Seconds a topic's activity score is cached for (debateapp/topic_activity.py). New and edited posts and
+# comments drop their topic's entry; the TTL bounds how long activity older than a week still counts
+TOPIC_ACTIVITY_CACHE_TTL = int(os.getenv("TOPIC_ACTIVITY_CACHE_TTL", 300))
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -17,10 +17,14 @@ export function PostReplies({ post }: PostRepliesProps) {
   const [reply, setReply] = useState("");
   const [showReplies, setShowReplies] = useState(false);
   const [isExpanded, setIsExpanded] = useState(false);
-  const { sendMessage } = useWebSocketClient();
+  const { sendMessage, followPost } = useWebSocketClient();
   const { postReplies, setPostReplies, aiThinkingPosts, setAiThinking } =
     useGlobalStore();
 
+  // Receive live replies for this post while it is on screen; the provider
+  // counts followers, so another component showing the same post keeps it
+  useEffect(() => followPost(post.id), [followPost, post.id]);
+
   // Enable comment fetching if replies are shown OR if this is a new post with AI thinking
   const shouldFetchComments = showReplies || aiThinkingPosts.has(post.id);
   const { data: commentData } = getCommentsForPost(post.id.toString(), {
@@ -27,6 +27,8 @@ export interface WebSocketContextValue {
   isOpen: boolean;
   close: (code?: number, reason?: string) => void;
   subscribe: (listener: MessageListener) => () => void;
+  // Follow a post's live frames; returns a function that stops following it
+  followPost: (postId: number) => () => void;
   reconnect: () => void;
 }
 
@@ -44,6 +46,8 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
 }) => {
   // message listeners registry
   const listenersRef = useRef<Set<MessageListener>>(new Set());
+  // post id -> number of mounted components following it; the server only needs one subscription each
+  const followersRef = useRef<Map<number, number>>(new Map());
 
   const {
     sendMessage,
@@ -86,6 +90,40 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     };
   }, []);
 
+  // (Re)subscribe to every followed post whenever the socket opens; the server forgets them on reconnect
+  useEffect(() => {
+    if (readyState !== WebSocket.OPEN) return;
+    const postIds = [...followersRef.current.keys()];
+    if (postIds.length > 0) {
+      sendJsonMessage({ type: "subscribe", post_ids: postIds }, false);
+    }
+  }, [readyState, sendJsonMessage]);
+
+  const followPost = useCallback(
+    (postId: number) => {
+      const followers = followersRef.current;
+      const count = followers.get(postId) ?? 0;
+      followers.set(postId, count + 1);
+      // Not sent while the socket is closed (keep=false); the open effect above covers it
+      if (count === 0) {
+        sendJsonMessage({ type: "subscribe", post_id: postId }, false);
+      }
+      let followed = true;
+      return () => {
+        if (!followed) return;
+        followed = false;
+        const remaining = (followers.get(postId) ?? 1) - 1;
+        if (remaining > 0) {
+          followers.set(postId, remaining);
+          return;
+        }
+        followers.delete(postId);
+        sendJsonMessage({ type: "unsubscribe", post_id: postId }, false);
+      };
+    },
+    [sendJsonMessage]
+  );
+
   const close = useCallback(
     (code?: number, reason?: string) => {
       const ws = getWebSocket?.(); // may be undefined if not connected yet
@@ -118,6 +156,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
       isOpen: readyState === WebSocket.OPEN,
       close,
       subscribe,
+      followPost,
       reconnect,
     }),
     [
@@ -127,6 +166,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
       readyState,
       close,
       subscribe,
+      followPost,
       reconnect,
     ]
   );